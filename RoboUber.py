@@ -1,14 +1,22 @@
-import pygame
+import argparse
+import logging
 import threading
 import time
 import math
 import numpy
 import sys
 import json
+# logging set-up
+import simlog
+# recording what happens as the world runs
+import recorder
 # the 3 Python modules containing the RoboUber objects
 import networld
 import taxi
 import dispatcher
+import routecache
+
+logger = logging.getLogger(__name__)
 
 # create objects for RoboUber
 
@@ -26,14 +34,16 @@ trafficOn = False
 # play around with these parameters if you want, to see how they affect the results.
 # (but keep the original settings so you can return to something more-or-less 'sensible)
 
+# (fareRates are fixed per-minute probabilities drawn from the world's own random generator, so
+# runs with a given seed are repeatable. Any callable, e.g. a lambda, works too, but isn't seeded)
 # most popular locations can generate a fare every hour
-fareProbMagnet = lambda m: numpy.random.random() > 0.98
+fareProbMagnet = networld.fareRate(0.02)
 # popular locations generate a fare about once every 2 hours
-fareProbPopular = lambda p: numpy.random.random() > 0.992
+fareProbPopular = networld.fareRate(0.008)
 # semi-popular locations generate a fare approximately every 4 hours
-fareProbSemiPopular = lambda s: numpy.random.random() > 0.995
+fareProbSemiPopular = networld.fareRate(0.005)
 # normal locations generate a fare about once per day
-fareProbNormal = lambda n: numpy.random.random() > 0.999
+fareProbNormal = networld.fareRate(0.001)
 
 # some traffic injectors and sinks for real-time simulation
 trafficSrcMinor = 1 if trafficOn else 0
@@ -137,49 +147,86 @@ streets = [strt0,strt1,strt2,strt3,strt4,strt5,strt6,strt7,strt8,strt9,strt10,st
            strt16,strt17,strt18,strt19,strt20,strt21,strt22,strt23,strt24,strt25,strt26,strt27,strt28,strt29,strt30,strt31,
            strt32,strt33,strt34,strt35,strt36,strt37,strt38,strt39,strt40,strt41,strt42,strt43,strt44,strt45,strt46,strt47]
 
-# create the dict of things we want to record
-outputValues = {'time': [], 'fares': {}, 'taxis': {}}
-
-# RoboUber itself will be run as a separate thread for performance, so that screen
-# redraws aren't interfering with model updates.
-def runRoboUber(worldX,worldY,runTime,stop,junctions=None,streets=None,interpolate=False,outputValues=None,**args):
+# builds the NetWorld with its taxis and dispatcher, and brings the taxis on duty ready to run.
+# Returns a (world, taxis, dispatcher) tuple (with zones, the first zone's dispatcher: the world
+# has them all, in its dispatchers property). Both the display thread and the headless runner
+# start from here, so they always simulate the same service area. seed seeds the world's random
+# generator. The rest of the options come in args:
+# taxiClass and dispatcherClass substitute alternative agent policies.
+# trafficAware makes the taxis route around traffic (by default, whenever there is traffic).
+# batchAllocation has the dispatcher allocate fares together rather than one by one.
+# broadcastRadius and broadcastNearest limit fare broadcasts to the taxis near each fare.
+# dispatchZones, a (columns, rows) pair, divides the map into a grid of zones, each with its own dispatcher.
+# vectorTraffic flows the traffic with array operations, in this process.
+# fareDestinations weights fare destinations by their distance from the fare's origin.
+def createRoboUber(worldX,worldY,runTime,junctions=None,streets=None,interpolate=False,seed=None,**args):
 
    # initialise a random fare generator
    if 'fareProbNormal' not in args:
-      args['fareProbNormal'] = lambda x: numpy.random.random() > 0.999
+      args['fareProbNormal'] = networld.fareRate(0.001)
+   taxiClass = args.get('taxiClass', taxi.Taxi)
+   dispatcherClass = args.get('dispatcherClass', dispatcher.Dispatcher)
+   trafficAware = args.get('trafficAware', trafficOn)
       
    # create the NetWorld - the service area
-   print("Creating world...")
-   svcArea = networld.NetWorld(x=worldX,y=worldY,runtime=runTime,fareprob=args['fareProbNormal'],jctNodes=junctions,edges=streets,interpolateNodes=interpolate)
-   print("Exporting map...")
+   logger.info("Creating world...")
+   svcArea = networld.NetWorld(x=worldX,y=worldY,runtime=runTime,fareprob=args['fareProbNormal'],jctNodes=junctions,edges=streets,interpolateNodes=interpolate,seed=seed,
+                               fareDestinations=args.get('fareDestinations'),
+                               vectorTraffic=args.get('vectorTraffic', False))
+   logger.info("Exporting map...")
    svcMap = svcArea.exportMap()
    if 'serviceMap' in args:
       args['serviceMap'] = svcMap
 
-   # create some taxis
-   print("Creating taxis")
-   taxi0 = taxi.Taxi(world=svcArea,taxi_num=100,service_area=svcMap,start_point=(20,0))
-   taxi1 = taxi.Taxi(world=svcArea,taxi_num=101,service_area=svcMap,start_point=(49,15))
-   taxi2 = taxi.Taxi(world=svcArea,taxi_num=102,service_area=svcMap,start_point=(15,49))
-   taxi3 = taxi.Taxi(world=svcArea,taxi_num=103,service_area=svcMap,start_point=(0,35))
+   # create some taxis. They all have the same map, so can share the routes they plan across it
+   logger.info("Creating taxis")
+   routeCache = routecache.RouteCache()
+   taxi0 = taxiClass(world=svcArea,taxi_num=100,service_area=svcMap,start_point=(20,0),route_cache=routeCache,
+                     traffic_aware=trafficAware)
+   taxi1 = taxiClass(world=svcArea,taxi_num=101,service_area=svcMap,start_point=(49,15),route_cache=routeCache,
+                     traffic_aware=trafficAware)
+   taxi2 = taxiClass(world=svcArea,taxi_num=102,service_area=svcMap,start_point=(15,49),route_cache=routeCache,
+                     traffic_aware=trafficAware)
+   taxi3 = taxiClass(world=svcArea,taxi_num=103,service_area=svcMap,start_point=(0,35),route_cache=routeCache,
+                     traffic_aware=trafficAware)
 
    taxis = [taxi0,taxi1,taxi2,taxi3]
 
    # and a dispatcher
-   print("Adding a dispatcher")
-   dispatcher0 = dispatcher.Dispatcher(parent=svcArea,taxis=taxis)
-
-   # who should be on duty
-   svcArea.addDispatcher(dispatcher0)
+   dispatcherArgs = {'batchAllocation': args.get('batchAllocation', False),
+                     'broadcastRadius': args.get('broadcastRadius'),
+                     'broadcastNearest': args.get('broadcastNearest')}
+   if args.get('dispatchZones') is None:
+      logger.info("Adding a dispatcher")
+      dispatcher0 = dispatcherClass(parent=svcArea,taxis=taxis,**dispatcherArgs)
+
+      # who should be on duty
+      svcArea.addDispatcher(dispatcher0)
+   # or one for each zone, which get to know the taxis as they come into their zones
+   else:
+      logger.info("Adding a dispatcher for each zone")
+      zones = svcArea.gridZones(*args['dispatchZones'])
+      svcArea.setZones(zones)
+      for zone in sorted(set(zones.values())):
+          svcArea.addDispatcher(dispatcherClass(parent=svcArea,**dispatcherArgs), zone)
+      dispatcher0 = svcArea.dispatchers[0]
 
    # bring the taxis on duty
-   print("Bringing taxis on duty")
+   logger.info("Bringing taxis on duty")
    for onDutyTaxi in taxis:
        onDutyTaxi.comeOnDuty()
 
+   return (svcArea, taxis, dispatcher0)
+
+# RoboUber itself will be run as a separate thread for performance, so that screen
+# redraws aren't interfering with model updates.
+def runRoboUber(worldX,worldY,runTime,stop,junctions=None,streets=None,interpolate=False,outputValues=None,**args):
+
+   svcArea, taxis, dispatcher0 = createRoboUber(worldX,worldY,runTime,junctions,streets,interpolate,**args)
+
    threadRunTime = runTime
    threadTime = 0
-   print("Starting world")
+   logger.info("Starting world")
    while threadTime < threadRunTime:
 
          # exit if 'q' has been pressed
@@ -190,188 +237,271 @@ def runRoboUber(worldX,worldY,runTime,stop,junctions=None,streets=None,interpola
             if threadTime != svcArea.simTime:
                threadTime += 1
             time.sleep(1)
-
-# event to manage a user exit, invoked by pressing 'q' on the keyboard
-userExit = threading.Event()
-
-roboUber = threading.Thread(target=runRoboUber,
-                            name='RoboUberThread',
-                            kwargs={'worldX':worldX,
-                                    'worldY':worldY,
-                                    'runTime':runTime,
-                                    'stop':userExit,
-                                    'junctions':junctions,
-                                    'streets':streets,
-                                    'interpolate':True,
-                                    'outputValues':outputValues,
-                                    'fareProbMagnet':fareProbMagnet,
-                                    'fareProbPopular':fareProbPopular,
-                                    'fareProbSemiPopular':fareProbSemiPopular,
-                                    'fareProbNormal':fareProbNormal})
-
-pygame.init()
-displaySurface = pygame.display.set_mode(size=displaySize,flags=pygame.RESIZABLE) # |pygame.SCALED arrgh...new in pygame 2.0, but pip install installs 1.9.6 on Ubuntu 16.04 LTS
-backgroundRect = None
-aspectRatio = worldX/worldY
-if aspectRatio > 4/3:
-   activeSize = (displaySize[0]-100, (displaySize[0]-100)/aspectRatio)
-else:
-   activeSize = (aspectRatio*(displaySize[1]-100), displaySize[1]-100)
-displayedBackground=pygame.Surface(activeSize)
-displayedBackground.fill(pygame.Color(255,255,255))
-activeRect = pygame.Rect(round((displaySize[0]-activeSize[0])/2),round((displaySize[1]-activeSize[1])/2),activeSize[0],activeSize[1])
-
-meshSize = ((activeSize[0]/worldX),round(activeSize[1]/worldY))
-
-# create a mesh of possible drawing positions
-positions = [[pygame.Rect(round(x*meshSize[0]),
-                          round(y*meshSize[1]),
-                          round(meshSize[0]),
-                          round(meshSize[1]))
-              for y in range(worldY)]
-             for x in range(worldX)]
-drawPositions = [[displayedBackground.subsurface(positions[x][y]) for y in range(worldY)] for x in range(worldX)]
-
-# junctions exist only at labelled locations; it's convenient to create subsurfaces for them
-jctRect = pygame.Rect(round(meshSize[0]/4),
-                      round(meshSize[1]/4),
-                      round(meshSize[0]/2),
-                      round(meshSize[1]/2))
-jctSquares = [drawPositions[jct[0]][jct[1]].subsurface(jctRect) for jct in junctionIdxs]
-
-# initialise the network edge drawings (as grey lines)
-for street in streets:
-    pygame.draw.aaline(displayedBackground,
-                       pygame.Color(128,128,128),
-                       (round(street.nodeA[0]*meshSize[0]+meshSize[0]/2),round(street.nodeA[1]*meshSize[1]+meshSize[1]/2)),
-                       (round(street.nodeB[0]*meshSize[0]+meshSize[0]/2),round(street.nodeB[1]*meshSize[1]+meshSize[1]/2)))
-    
-# initialise the junction drawings (as grey boxes)
-for jct in range(len(junctionIdxs)):
-    jctSquares[jct].fill(pygame.Color(192,192,192))
-    # note that the rectangle target in draw.rect refers to a Rect relative to the source surface, not an
-    # absolute-coordinates Rect.
-    pygame.draw.rect(jctSquares[jct],pygame.Color(128,128,128),pygame.Rect(0,0,round(meshSize[0]/2),round(meshSize[1]/2)),5)
-
-# redraw the entire image    
-displaySurface.blit(displayedBackground, activeRect)
-pygame.display.flip()
-
-# which taxi is associated with which colour
-taxiColours = {}
-# possible colours for taxis: black, blue, green, red, magenta, cyan, yellow, white
-taxiPalette = [pygame.Color(0,0,0),
-               pygame.Color(0,0,255),
-               pygame.Color(0,255,0),
-               pygame.Color(255,0,0),
-               pygame.Color(255,0,255),
-               pygame.Color(0,255,255),
-               pygame.Color(255,255,0),
-               pygame.Color(255,255,255)]
-
-# relative positions of taxi and fare markers in a mesh point
-taxiRect = pygame.Rect(round(meshSize[0]/3),
-                       round(meshSize[1]/3),
-                       round(meshSize[0]/3),
-                       round(meshSize[1]/3))
-
-fareRect = pygame.Rect(round(3*meshSize[0]/8),
-                       round(3*meshSize[1]/8),
-                       round(meshSize[0]/4),
-                       round(meshSize[1]/4))
-
-# curTime is the time point currently displayed
-curTime = 0
-
-# start the simulation (which will automatically stop at the end of the run time)
-roboUber.start()
-
-# this is the display loop which updates the on-screen output.
-while curTime < runTime:
-
-      # you can end the simulation by pressing 'q'. This triggers an event which is also passed into the world loop
-      try:
-          quitevent = next(evt for evt in pygame.event.get() if evt.type == pygame.KEYDOWN and evt.key == pygame.K_q)
-          userExit.set()
-          pygame.quit()
-          sys.exit()
-      # event queue had no 'q' keyboard events. Continue.
-      except StopIteration:
-          pygame.event.get()
-          if 'time' in outputValues and len(outputValues['time']) > 0 and curTime != outputValues['time'][-1]:
-             print("curTime: {0}, world.time: {1}".format(curTime,outputValues['time'][-1]))
-
-             # naive: redraw the entire map each time step. This could be improved by saving a list of squares
-             # to redraw and being incremental, but there is a fair amount of bookkeeping involved.
-             displayedBackground.fill(pygame.Color(255,255,255))
-         
-             for street in streets:
-                 pygame.draw.aaline(displayedBackground,
-                                    pygame.Color(128,128,128),
-                                    (round(street.nodeA[0]*meshSize[0]+meshSize[0]/2),round(street.nodeA[1]*meshSize[1]+meshSize[1]/2)),
-                                    (round(street.nodeB[0]*meshSize[0]+meshSize[0]/2),round(street.nodeB[1]*meshSize[1]+meshSize[1]/2)))
+   svcArea.close()
+
+# runs the simulation in batch mode: no display, and no pacing of the clock, so the world runs as fast
+# as the model itself allows. Returns the recorded outputValues (by default an OutputRecorder) along with a dict of summary statistics.
+# The simulation's running commentary goes to the logging system; nothing is shown below WARNING unless
+# logging has been configured (see simlog). eventDriven uses the world's discrete-event engine (runEvents)
+# instead of stepping every tick.
+def runHeadless(worldX=worldX,worldY=worldY,runTime=runTime,junctions=junctions,streets=streets,interpolate=True,outputValues=None,seed=None,eventDriven=False,**args):
+
+   # batch mode runs until the world's run time expires, so it had better have one
+   if runTime <= 0:
+      raise ValueError("Headless runs need a finite run time, not {0}".format(runTime))
+   if outputValues is None:
+      outputValues = recorder.OutputRecorder(runTime)
+   if 'fareProbNormal' not in args:
+      args['fareProbNormal'] = fareProbNormal
+
+   svcArea, taxis, dispatcher0 = createRoboUber(worldX,worldY,runTime,junctions,streets,interpolate,seed,**args)
+   if eventDriven:
+      svcArea.runEvents(ticks=0, outputs=outputValues)
+   else:
+      svcArea.runWorld(ticks=0, outputs=outputValues)
+   svcArea.close()
+
+   return (outputValues, summariseRun(svcArea, taxis, dispatcher0))
+
+# collects the end-of-run totals for a world and its agents into a (JSON-friendly) dict
+def summariseRun(svcArea, taxis, dispatcher0):
+
+   stats = svcArea.stats
+   return {'simTime': svcArea.simTime,
+           'faresCreated': stats['faresCreated'],
+           'faresCompleted': stats['faresCompleted'],
+           'faresAbandoned': stats['faresAbandoned'],
+           'fareRevenue': stats['fareRevenue'],
+           'dispatcherRevenue': sum([dispatcher.revenue for dispatcher in svcArea.dispatchers]),
+           'taxiAccounts': dict([(str(cab.number), cab.account) for cab in taxis]),
+           # fraction of on-duty taxi time spent actually carrying a passenger
+           'utilisation': stats['carryingTicks']/stats['taxiTicks'] if stats['taxiTicks'] > 0 else 0.0}
+
+if __name__ == '__main__':
+
+   argParser = argparse.ArgumentParser(description="Run the RoboUber simulation")
+   argParser.add_argument('--headless', action='store_true',
+                          help="run as fast as possible without the display, printing a JSON summary at the end")
+   argParser.add_argument('--runtime', type=int, default=runTime, help="number of time steps to simulate")
+   argParser.add_argument('--verbose', action='store_true', help="keep the simulation's running commentary in headless mode")
+   argParser.add_argument('--log-level', default=None,
+                          help="logging level (DEBUG, INFO, WARNING...). Default: INFO with the display or --verbose, WARNING otherwise")
+   argParser.add_argument('--log-file', default=None, help="write the log to this file (buffered) instead of stdout")
+   argParser.add_argument('--seed', type=int, default=None, help="seed for the world's random generator")
+   argParser.add_argument('--events', action='store_true', help="use the discrete-event engine in headless mode")
+   argParser.add_argument('--batch-allocation', action='store_true',
+                          help="have the dispatcher allocate all the fares ready for it each tick together")
+   argParser.add_argument('--vector-traffic', action='store_true',
+                          help="flow the traffic for the whole map at once with array operations")
+   cmdArgs = argParser.parse_args()
+
+   logLevel = cmdArgs.log_level
+   if logLevel is None:
+      logLevel = logging.WARNING if cmdArgs.headless and not cmdArgs.verbose else logging.INFO
+   simlog.configureLogging(level=logLevel, logFile=cmdArgs.log_file)
+
+   if cmdArgs.headless:
+      summary = runHeadless(runTime=cmdArgs.runtime,
+                            seed=cmdArgs.seed,
+                            eventDriven=cmdArgs.events,
+                            batchAllocation=cmdArgs.batch_allocation,
+                            vectorTraffic=cmdArgs.vector_traffic,
+                            fareProbMagnet=fareProbMagnet,
+                            fareProbPopular=fareProbPopular,
+                            fareProbSemiPopular=fareProbSemiPopular,
+                            fareProbNormal=fareProbNormal)[1]
+      print(json.dumps(summary, indent=2))
+      sys.exit()
+   runTime = cmdArgs.runtime
+
+   import pygame
+
+   # create the recorder for the things we want to record. The display reads it just like a dict of
+   # outputs, e.g. outputValues['taxis'][number][time]
+   outputValues = recorder.OutputRecorder(runTime)
+
+   # event to manage a user exit, invoked by pressing 'q' on the keyboard
+   userExit = threading.Event()
+
+   roboUber = threading.Thread(target=runRoboUber,
+                               name='RoboUberThread',
+                               kwargs={'worldX':worldX,
+                                       'worldY':worldY,
+                                       'runTime':runTime,
+                                       'stop':userExit,
+                                       'junctions':junctions,
+                                       'streets':streets,
+                                       'interpolate':True,
+                                       'outputValues':outputValues,
+                                       'seed':cmdArgs.seed,
+                                       'batchAllocation':cmdArgs.batch_allocation,
+                                       'vectorTraffic':cmdArgs.vector_traffic,
+                                       'fareProbMagnet':fareProbMagnet,
+                                       'fareProbPopular':fareProbPopular,
+                                       'fareProbSemiPopular':fareProbSemiPopular,
+                                       'fareProbNormal':fareProbNormal})
+
+   pygame.init()
+   displaySurface = pygame.display.set_mode(size=displaySize,flags=pygame.RESIZABLE) # |pygame.SCALED arrgh...new in pygame 2.0, but pip install installs 1.9.6 on Ubuntu 16.04 LTS
+   backgroundRect = None
+   aspectRatio = worldX/worldY
+   if aspectRatio > 4/3:
+      activeSize = (displaySize[0]-100, (displaySize[0]-100)/aspectRatio)
+   else:
+      activeSize = (aspectRatio*(displaySize[1]-100), displaySize[1]-100)
+   displayedBackground=pygame.Surface(activeSize)
+   displayedBackground.fill(pygame.Color(255,255,255))
+   activeRect = pygame.Rect(round((displaySize[0]-activeSize[0])/2),round((displaySize[1]-activeSize[1])/2),activeSize[0],activeSize[1])
+
+   meshSize = ((activeSize[0]/worldX),round(activeSize[1]/worldY))
+
+   # create a mesh of possible drawing positions
+   positions = [[pygame.Rect(round(x*meshSize[0]),
+                             round(y*meshSize[1]),
+                             round(meshSize[0]),
+                             round(meshSize[1]))
+                 for y in range(worldY)]
+                for x in range(worldX)]
+   drawPositions = [[displayedBackground.subsurface(positions[x][y]) for y in range(worldY)] for x in range(worldX)]
+
+   # junctions exist only at labelled locations, drawn as a box in the middle of their cell
+   jctRect = pygame.Rect(round(meshSize[0]/4),
+                         round(meshSize[1]/4),
+                         round(meshSize[0]/2),
+                         round(meshSize[1]/2))
+
+   # the road network never changes, so it is drawn just once, onto a cached background layer. Each cell of
+   # the display is erased by copying it back from here.
+   staticBackground = displayedBackground.copy()
+
+   # initialise the network edge drawings (as grey lines)
+   for street in streets:
+       pygame.draw.aaline(staticBackground,
+                          pygame.Color(128,128,128),
+                          (round(street.nodeA[0]*meshSize[0]+meshSize[0]/2),round(street.nodeA[1]*meshSize[1]+meshSize[1]/2)),
+                          (round(street.nodeB[0]*meshSize[0]+meshSize[0]/2),round(street.nodeB[1]*meshSize[1]+meshSize[1]/2)))
     
-             for jct in range(len(junctionIdxs)):
-                 jctSquares[jct].fill(pygame.Color(192,192,192))
-                 pygame.draw.rect(jctSquares[jct],pygame.Color(128,128,128),pygame.Rect(0,0,round(meshSize[0]/2),round(meshSize[1]/2)),5)
-             
-             # get fares and taxis that need to be redrawn. We find these by checking the recording dicts
-             # for time points in advance of our current display timepoint. The nested comprehensions
-             # look formidable, but are simply extracting members with a time stamp ahead of our
-             # most recent display time. The odd indexing fare[1].keys()[-1] gets the last element
-             # in the time sequence dictionary for a fare (or taxi), which, because of the way this
-             # is recorded, is guaranteed to be the most recent entry.
-             faresToRedraw = dict([(fare[0], dict([(time[0], time[1])
-                                                   for time in fare[1].items()
-                                                   if time[0] > curTime]))
-                                   for fare in outputValues['fares'].items()
-                                   if max(fare[1].keys()) > curTime])
-                                   #if sorted(list(fare[1].keys()))[-1] > curTime])
-         
-             taxisToRedraw = dict([(taxi[0], dict([(taxiPos[0], taxiPos[1])
-                                                   for taxiPos in taxi[1].items()
-                                                   if taxiPos[0] > curTime]))
-                                   for taxi in outputValues['taxis'].items()
-                                   if max(taxi[1].keys()) > curTime])
-                                   #if sorted(list(taxi[1].keys()))[-1] > curTime])
-
-             # some taxis are on duty?
-             if len(taxisToRedraw) > 0:
-                for taxi in taxisToRedraw.items():
+   # initialise the junction drawings (as grey boxes)
+   for jct in junctionIdxs:
+       jctSquare = staticBackground.subsurface(positions[jct[0]][jct[1]]).subsurface(jctRect)
+       jctSquare.fill(pygame.Color(192,192,192))
+       # note that the rectangle target in draw.rect refers to a Rect relative to the source surface, not an
+       # absolute-coordinates Rect.
+       pygame.draw.rect(jctSquare,pygame.Color(128,128,128),pygame.Rect(0,0,round(meshSize[0]/2),round(meshSize[1]/2)),5)
+
+   # draw the entire image once
+   displayedBackground.blit(staticBackground, (0,0))
+   displaySurface.blit(displayedBackground, activeRect)
+   pygame.display.flip()
+
+   # what is currently drawn in each cell with something in it: a tuple of taxi colours, and whether
+   # there is a fare there. Only cells whose contents differ from this need redrawing.
+   displayedCells = {}
+
+   # which taxi is associated with which colour
+   taxiColours = {}
+   # possible colours for taxis: black, blue, green, red, magenta, cyan, yellow, white
+   taxiPalette = [pygame.Color(0,0,0),
+                  pygame.Color(0,0,255),
+                  pygame.Color(0,255,0),
+                  pygame.Color(255,0,0),
+                  pygame.Color(255,0,255),
+                  pygame.Color(0,255,255),
+                  pygame.Color(255,255,0),
+                  pygame.Color(255,255,255)]
+
+   # relative positions of taxi and fare markers in a mesh point
+   taxiRect = pygame.Rect(round(meshSize[0]/3),
+                          round(meshSize[1]/3),
+                          round(meshSize[0]/3),
+                          round(meshSize[1]/3))
+
+   fareRect = pygame.Rect(round(3*meshSize[0]/8),
+                          round(3*meshSize[1]/8),
+                          round(meshSize[0]/4),
+                          round(meshSize[1]/4))
+
+   # curTime is the time point currently displayed
+   curTime = 0
+
+   # start the simulation (which will automatically stop at the end of the run time)
+   roboUber.start()
+
+   # this is the display loop which updates the on-screen output.
+   while curTime < runTime:
+
+         # you can end the simulation by pressing 'q'. This triggers an event which is also passed into the world loop
+         try:
+             quitevent = next(evt for evt in pygame.event.get() if evt.type == pygame.KEYDOWN and evt.key == pygame.K_q)
+             userExit.set()
+             pygame.quit()
+             sys.exit()
+         # event queue had no 'q' keyboard events. Continue.
+         except StopIteration:
+             pygame.event.get()
+             if len(outputValues.times) > 0 and curTime != outputValues.times[-1]:
+                logger.debug("curTime: %s, world.time: %s", curTime, outputValues.times[-1])
+
+                # work out what should be in each cell now: the taxis and waiting fares at the most recently
+                # recorded time step, read straight from the recorder's arrays. While the world is still
+                # running, its newest time step may only be part-recorded, so show the one before.
+                latest = len(outputValues.times)-1
+                if roboUber.is_alive() and latest > 0:
+                   latest -= 1
+                newCells = {}
+                taxiPositions = outputValues.taxiPositions[latest]
+                for taxiNum, taxiCol in zip(outputValues.taxiNumbers, range(len(taxiPositions))):
+                    # a taxi that isn't anywhere in the world (e.g. off duty) has no position
+                    if taxiPositions[taxiCol][0] < 0:
+                       continue
                     # new ones should be assigned a colour
-                    if taxi[0] not in taxiColours and len(taxiPalette) > 0:
-                       taxiColours[taxi[0]] = taxiPalette.pop(0)
+                    if taxiNum not in taxiColours and len(taxiPalette) > 0:
+                       taxiColours[taxiNum] = taxiPalette.pop(0)
                     # but only plot taxis up to the palette limit (which can be easily extended)
-                    if taxi[0] in taxiColours:
-                       newestTime = sorted(list(taxi[1].keys()))[-1]
+                    if taxiNum in taxiColours:
+                       cell = (int(taxiPositions[taxiCol][0]), int(taxiPositions[taxiCol][1]))
+                       taxis, fare = newCells.get(cell, ((), False))
+                       newCells[cell] = (taxis+(tuple(taxiColours[taxiNum]),), fare)
+                # fare records are appended in time order, so those for one time step are all together
+                fareRecords = outputValues.fares
+                fareRecords = fareRecords[numpy.searchsorted(fareRecords['time'], outputValues.times[latest], 'left'):
+                                          numpy.searchsorted(fareRecords['time'], outputValues.times[latest], 'right')]
+                for fareX, fareY in zip(fareRecords['x'].tolist(), fareRecords['y'].tolist()):
+                    taxis, fare = newCells.get((fareX, fareY), ((), False))
+                    newCells[(fareX, fareY)] = (taxis, True)
+
+                # redraw only the cells whose contents have changed: erase each back to the static background,
+                # then draw whatever is there now
+                dirtyRects = []
+                for cell in set(displayedCells.keys()).union(newCells.keys()):
+                    if displayedCells.get(cell) == newCells.get(cell):
+                       continue
+                    cellRect = positions[cell[0]][cell[1]]
+                    displayedBackground.blit(staticBackground, cellRect, cellRect)
+                    if cell in newCells:
+                       taxis, fare = newCells[cell]
                        # a taxi shows up as a circle in its colour
-                       pygame.draw.circle(drawPositions[taxi[1][newestTime][0]][taxi[1][newestTime][1]],
-                                          taxiColours[taxi[0]],
-                                          (round(meshSize[0]/2),round(meshSize[1]/2)),
-                                          round(meshSize[0]/3))
-                   
-             # some fares still awaiting a taxi?
-             if len(faresToRedraw) > 0:
-                for fare in faresToRedraw.items():
-                    newestFareTime = sorted(list(fare[1].keys()))[-1]
-                    # fares are plotted as orange triangles (using pygame's points representation which
-                    # is relative to the rectangular surface on which you are drawing)
-                    pygame.draw.polygon(drawPositions[fare[0][0]][fare[0][1]],
-                                        pygame.Color(255,128,0),
-                                        [(meshSize[0]/2,meshSize[1]/4),
-                                         (meshSize[0]/2-math.cos(math.pi/6)*meshSize[1]/4,meshSize[1]/2+math.sin(math.pi/6)*meshSize[1]/4),
-                                         (meshSize[0]/2+math.cos(math.pi/6)*meshSize[1]/4,meshSize[1]/2+math.sin(math.pi/6)*meshSize[1]/4)])
-                   
-             # redraw the whole map 
-             displaySurface.blit(displayedBackground, activeRect)
-             pygame.display.flip()
-
-             # advance the time                           
-             curTime += 1
-
-
-
-
-
-
-      
+                       for taxiColour in taxis:
+                           pygame.draw.circle(drawPositions[cell[0]][cell[1]],
+                                              pygame.Color(*taxiColour),
+                                              (round(meshSize[0]/2),round(meshSize[1]/2)),
+                                              round(meshSize[0]/3))
+                       # fares are plotted as orange triangles (using pygame's points representation which
+                       # is relative to the rectangular surface on which you are drawing)
+                       if fare:
+                          pygame.draw.polygon(drawPositions[cell[0]][cell[1]],
+                                              pygame.Color(255,128,0),
+                                              [(meshSize[0]/2,meshSize[1]/4),
+                                               (meshSize[0]/2-math.cos(math.pi/6)*meshSize[1]/4,meshSize[1]/2+math.sin(math.pi/6)*meshSize[1]/4),
+                                               (meshSize[0]/2+math.cos(math.pi/6)*meshSize[1]/4,meshSize[1]/2+math.sin(math.pi/6)*meshSize[1]/4)])
+                    screenRect = cellRect.move(activeRect.topleft)
+                    displaySurface.blit(displayedBackground, screenRect, cellRect)
+                    dirtyRects.append(screenRect)
+                displayedCells = newCells
+
+                # and put just those on the screen
+                if len(dirtyRects) > 0:
+                   pygame.display.update(dirtyRects)
+
+                # advance the time                           
+                curTime += 1
@@ -0,0 +1,47 @@
+import numpy
+
+'''
+An AliasTable draws from a fixed discrete distribution in constant time, however many outcomes it has
+(Walker's alias method, built with Vose's algorithm). Each outcome gets a slot, holding its own probability
+(scaled so that the average is 1) topped up by a single other outcome - its alias - to fill the slot. A draw
+picks a slot uniformly, then either the slot's own outcome or its alias. Building the table is O(n); every
+draw after that is 2 random numbers and 2 array lookups.
+
+Arguments:
+weights - array-like of non-negative weights, one per outcome (they needn't add up to 1)
+'''
+class AliasTable:
+
+      def __init__(self, weights):
+          weights = numpy.array(weights, dtype=numpy.float64)
+          if weights.ndim != 1 or len(weights) == 0:
+             raise ValueError("An alias table needs a 1-D list of weights, not {0}".format(weights.shape))
+          if (weights < 0).any() or not numpy.isfinite(weights).all() or weights.sum() <= 0:
+             raise ValueError("Alias table weights must be finite, non-negative and not all 0")
+          size = len(weights)
+          scaled = weights*size/weights.sum()
+          self._probability = numpy.ones(size)
+          self._alias = numpy.arange(size)
+          small = list(numpy.flatnonzero(scaled < 1))
+          large = list(numpy.flatnonzero(scaled >= 1))
+          # fill each underfull slot from an overfull outcome, which stays in play for as long as it has
+          # probability left over
+          while len(small) > 0 and len(large) > 0:
+                slot = small.pop()
+                donor = large[-1]
+                self._probability[slot] = scaled[slot]
+                self._alias[slot] = donor
+                scaled[donor] -= 1-scaled[slot]
+                if scaled[donor] < 1:
+                   small.append(large.pop())
+          # whatever is left is full (to within rounding), and keeps its default of always being drawn itself
+
+      def __len__(self):
+          return len(self._probability)
+
+      # draws an outcome (its position in the weights) using the random generator rng
+      def sample(self, rng):
+          slot = rng.integers(len(self._probability))
+          if rng.random() < self._probability[slot]:
+             return int(slot)
+          return int(self._alias[slot])
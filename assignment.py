@@ -0,0 +1,88 @@
+import numpy
+
+'''
+solveAssignment solves the (rectangular) linear assignment problem: given a cost matrix, with a row for
+each job and a column for each worker, pick at most one worker for each job and at most one job for each
+worker so that as many jobs as possible are done, as cheaply as possible in total. This is what the
+Dispatcher's batch allocation needs: rows are fares, columns taxis, and costs how far each taxi is from
+each fare.
+
+The method is the shortest augmenting path algorithm (Jonker and Volgenant's, in the form Crouse gives):
+rows are assigned one at a time, each along the cheapest path of reassignments that frees up a column for
+it, with dual variables (prices) on the rows and columns keeping the reduced costs non-negative so that
+each path can be found Dijkstra-style. The scan over columns is vectorised, so each row takes O(cols)
+numpy steps rather than O(cols^2) Python ones.
+
+Arguments:
+costs - 2-D array-like of costs. Infinite (or NaN) entries are forbidden pairings.
+Returns (rows, cols): integer arrays of the matched pairs, in increasing row order. Rows that cannot be
+given a column (not enough columns, or only forbidden ones) are left out.
+'''
+def solveAssignment(costs):
+   costs = numpy.array(costs, dtype=numpy.float64)
+   if costs.ndim != 2:
+      raise ValueError("Assignment costs must be a 2-D matrix, not {0}-D".format(costs.ndim))
+   # the algorithm wants no more rows than columns: otherwise solve it the other way round
+   transposed = costs.shape[0] > costs.shape[1]
+   if transposed:
+      costs = costs.T
+   rows, cols = costs.shape
+   if rows == 0:
+      return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+   # forbidden pairings are given a cost so high that any assignment using fewer of them is cheaper, and
+   # the ones that still get used are dropped afterwards
+   allowed = numpy.isfinite(costs)
+   if allowed.any():
+      forbidden = (numpy.abs(costs[allowed]).sum()+1)*(rows+1)
+   else:
+      forbidden = 1.0
+   costs = numpy.where(allowed, costs, forbidden)
+   # the dual variables, and the assignment so far
+   rowPrices = numpy.zeros(rows)
+   colPrices = numpy.zeros(cols)
+   colForRow = numpy.full(rows, -1, dtype=numpy.int64)
+   rowForCol = numpy.full(cols, -1, dtype=numpy.int64)
+   for newRow in range(rows):
+       # Dijkstra over the reduced costs from newRow, until it reaches a column nobody has
+       shortest = numpy.full(cols, numpy.inf)
+       path = numpy.full(cols, -1, dtype=numpy.int64)
+       scannedRows = numpy.zeros(rows, dtype=bool)
+       scannedCols = numpy.zeros(cols, dtype=bool)
+       row = newRow
+       distance = 0.0
+       freeCol = -1
+       while freeCol < 0:
+             scannedRows[row] = True
+             reduced = distance+costs[row]-rowPrices[row]-colPrices
+             shorter = ~scannedCols & (reduced < shortest)
+             path[shorter] = row
+             shortest[shorter] = reduced[shorter]
+             col = numpy.argmin(numpy.where(scannedCols, numpy.inf, shortest))
+             distance = shortest[col]
+             scannedCols[col] = True
+             if rowForCol[col] < 0:
+                freeCol = col
+             else:
+                row = rowForCol[col]
+       # update the prices so that the reduced costs stay non-negative
+       rowPrices[newRow] += distance
+       others = scannedRows.copy()
+       others[newRow] = False
+       rowPrices[others] += distance-shortest[colForRow[others]]
+       colPrices[scannedCols] -= distance-shortest[scannedCols]
+       # and shift the assignments along the path
+       col = freeCol
+       while True:
+             row = path[col]
+             rowForCol[col] = row
+             col, colForRow[row] = colForRow[row], col
+             if row == newRow:
+                break
+   matchedRows = numpy.arange(rows)
+   keep = allowed[matchedRows, colForRow]
+   matchedRows = matchedRows[keep]
+   matchedCols = colForRow[keep]
+   if transposed:
+      order = numpy.argsort(matchedCols, kind='stable')
+      return (matchedCols[order], matchedRows[order])
+   return (matchedRows, matchedCols)
@@ -1,7 +1,16 @@
 import math
 import numpy
 import heapq
+import logging
 import CSP
+
+from netevent import NetEvent
+from assignment import solveAssignment
+from servicemap import ServiceMap
+from pathtable import PathTable
+
+logger = logging.getLogger(__name__)
+
 # a data container for all pertinent information related to fares. (Should we
 # add an underway flag and require taxis to acknowledge collection to the dispatcher?)
 class FareEntry:
@@ -16,6 +25,100 @@ class FareEntry:
           self.taxi = taxiIndex
           # a list of indices of taxis that have bid on the fare.
           self.bidders = []
+          # when the fare was last broadcast to the taxis, and how many times it has been broadcast more
+          # widely since the first time (see Dispatcher.broadcastRadius)
+          self.broadcastTime = time
+          self.broadcastRound = 0
+
+      # fares are identified by their (origin, destination, calltime) triplet
+      @property
+      def fareId(self):
+          return (self.origin, self.destination, self.calltime)
+
+'''
+A FareBoard holds the Dispatcher's active fares, indexed so that nothing ever has to be searched for: fares
+can be looked up by their id - the (origin, destination, calltime) triplet - or by origin, and each fare is in
+one of 3 queues according to what the dispatcher has to do about it:
+unpriced - new fares, which need a price and broadcasting to the taxis
+open - fares out for bidding, waiting to be allocated
+allocated - fares given to a taxi, which need nothing more (unless they cancel)
+so that the dispatcher can go straight to the fares that need its attention. The queues keep fares in the
+order they arrived (or were allocated).
+'''
+class FareBoard:
+
+      def __init__(self):
+          self._fares = {}
+          # origin -> the ids of the fares from there (as dicts, which keep their order)
+          self._byOrigin = {}
+          self._unpriced = {}
+          self._open = {}
+          self._allocated = {}
+
+      def __len__(self):
+          return len(self._fares)
+
+      def __contains__(self, fareId):
+          return fareId in self._fares
+
+      # the fare with a given id, None if it isn't on the board
+      def get(self, fareId):
+          return self._fares.get(fareId)
+
+      # the fares from an origin
+      def atOrigin(self, origin):
+          return [self._fares[fareId] for fareId in self._byOrigin.get(origin, {}).keys()]
+
+      @property
+      def unpriced(self):
+          return [self._fares[fareId] for fareId in self._unpriced.keys()]
+
+      @property
+      def open(self):
+          return [self._fares[fareId] for fareId in self._open.keys()]
+
+      @property
+      def allocated(self):
+          return [self._fares[fareId] for fareId in self._allocated.keys()]
+
+      # puts a fare on the board, replacing any with the same id, in the queue its price and taxi put it in
+      def add(self, fare):
+          self.remove(fare.fareId)
+          self._fares[fare.fareId] = fare
+          self._byOrigin.setdefault(fare.origin, {})[fare.fareId] = None
+          if fare.taxi >= 0:
+             self._allocated[fare.fareId] = None
+          elif fare.price == 0:
+             self._unpriced[fare.fareId] = None
+          else:
+             self._open[fare.fareId] = None
+
+      # takes a fare off the board, returning it (None if it wasn't there)
+      def remove(self, fareId):
+          fare = self._fares.pop(fareId, None)
+          if fare is not None:
+             del self._byOrigin[fare.origin][fareId]
+             if len(self._byOrigin[fare.origin]) == 0:
+                del self._byOrigin[fare.origin]
+             self._unpriced.pop(fareId, None)
+             self._open.pop(fareId, None)
+             self._allocated.pop(fareId, None)
+          return fare
+
+      # prices an unpriced fare, opening it for bidding
+      def setPrice(self, fareId, price):
+          fare = self._fares[fareId]
+          fare.price = price
+          if fareId in self._unpriced and price != 0:
+             del self._unpriced[fareId]
+             self._open[fareId] = None
+
+      # allocates a fare to the taxi with a given index
+      def allocate(self, fareId, taxiIdx):
+          self._fares[fareId].taxi = taxiIdx
+          self._unpriced.pop(fareId, None)
+          self._open.pop(fareId, None)
+          self._allocated[fareId] = None
 
 '''
 A Dispatcher is a static agent whose job is to allocate fares amongst available taxis. Like the taxis, all
@@ -27,31 +130,80 @@ now have the fare.
 '''
 class Dispatcher:
 
+      # up to this many bidders for a fare are simply compared one by one; with more, the world's taxi index
+      # finds the nearest ones
+      directBidders = 16
+
       # constructor only needs to know the world it lives in, although you can also populate its knowledge base
-      # with taxi and map information.
-      def __init__(self, parent, taxis=None, serviceMap=None):
+      # with taxi and map information. batchAllocation allocates all the fares whose bidding has closed together,
+      # each tick, rather than one at a time (see _allocateFares). broadcastRadius and broadcastNearest geofence
+      # fare broadcasts, advising only the taxis within that distance of the fare by road, or the nearest that
+      # many (see NetWorld.broadcastFare). A fare nobody bids on is broadcast again with the radius and number
+      # doubled, up to broadcastRounds times, after which it goes out to every taxi.
+      def __init__(self, parent, taxis=None, serviceMap=None, batchAllocation=False, broadcastRadius=None,
+                   broadcastNearest=None, broadcastRounds=3):
 
           self._parent = parent
           # our incoming account
           self._revenue = 0
-          # the list of taxis
-          self._taxis = taxis
-          if self._taxis is None:
-             self._taxis = []
-          # fareBoard will be a nested dictionary indexed by origin, then destination, then call time.
-          # Its values are FareEntries. The nesting structure provides for reasonably fast lookup; it's
-          # more or less a multi-level hash.
-          self._fareBoard = {}
+          # the list of taxis (a copy: taxis come and go from it as they move between zones)
+          self._taxis = [] if taxis is None else list(taxis)
+          # each taxi's position in the list, which is how fares refer to it
+          self._taxiIndices = dict([(taxi, taxiIdx) for taxiIdx, taxi in enumerate(self._taxis)])
+          # positions in the list left empty by taxis that have been released, for new taxis to reuse
+          self._freeIndices = []
+          # fareBoard holds the active fares (FareEntries), indexed by id and origin and queued by what needs
+          # doing about them
+          self._fareBoard = FareBoard()
           # serviceMap gives the dispatcher its service area
           self._map = serviceMap
+          # and a shortest-path table gives distances across it (fetched when needed: see _mapPathTable)
+          self._pathTable = None
+          self._batchAllocation = batchAllocation
+          self._broadcastRadius = broadcastRadius
+          self._broadcastNearest = broadcastNearest
+          self._broadcastRounds = broadcastRounds
+
+      # total takings of the dispatcher so far
+      @property
+      def revenue(self):
+          return self._revenue
+
+      # an idle dispatcher has no fares to price or allocate, so has nothing to do at a clock tick
+      @property
+      def idle(self):
+          return len(self._fareBoard.unpriced) == 0 and len(self._fareBoard.open) == 0
 
       #_________________________________________________________________________________________________________
       # methods to add objects to the Dispatcher's knowledge base
       
       # make a new taxi known.
       def addTaxi(self, taxi):
-          if taxi not in self._taxis:
-             self._taxis.append(taxi)
+          if taxi not in self._taxiIndices:
+             if len(self._freeIndices) > 0:
+                self._taxiIndices[taxi] = self._freeIndices.pop()
+                self._taxis[self._taxiIndices[taxi]] = taxi
+             else:
+                self._taxiIndices[taxi] = len(self._taxis)
+                self._taxis.append(taxi)
+
+      # forget a taxi, e.g. one that has driven out of the dispatcher's zone. Fares refer to taxis by their
+      # position in the list, so the others stay where they are: the taxi's position is left empty, for the
+      # next new taxi, and it is struck off the bidders for open fares. Its allocations come off the board,
+      # and are returned (as FareEntries), so that they can be handed over to another dispatcher.
+      def releaseTaxi(self, parent, taxi):
+          if self._parent != parent or taxi not in self._taxiIndices:
+             return []
+          taxiIdx = self._taxiIndices.pop(taxi)
+          self._taxis[taxiIdx] = None
+          self._freeIndices.append(taxiIdx)
+          for fare in self._fareBoard.unpriced+self._fareBoard.open:
+              if taxiIdx in fare.bidders:
+                 fare.bidders = [bidder for bidder in fare.bidders if bidder != taxiIdx]
+          allocations = [fare for fare in self._fareBoard.allocated if fare.taxi == taxiIdx]
+          for fare in allocations:
+              self._fareBoard.remove(fare.fareId)
+          return allocations
 
       # incrementally add to the map. This can be useful if, e.g. the world itself has a set of
       # nodes incrementally added. It can then call this function on the dispatcher to add to
@@ -70,11 +222,23 @@ class Dispatcher:
               if neighbourNode is None:
                  return KeyError("Node {0} expects neighbour {1} which is not in this Dispatcher's service area".format(coords, neighbour))
               neighbourDict[neighbourCoords] = (neighbour[0],self._parent.distance2Node(node, neighbourNode))
+          # a shared map can't be changed: the dispatcher needs a copy of its own
+          if isinstance(self._map, ServiceMap):
+             self._map = self._map.toDict()
           self._map[coords] = neighbourDict
+          self._pathTable = None
+
+      # the shortest-path table for the dispatcher's map: the world's, shared with everyone, as long as the dispatcher
+      # has the world's own map, or one of its own if it has changed its map
+      def _mapPathTable(self):
+          if self._map is self._parent.exportMap():
+             return self._parent.exportPathTable()
+          return PathTable(self._map)
 
       # importMap gets the service area map, and can be brought in incrementally as well as
       # in one wodge.
       def importMap(self, newMap):
+          self._pathTable = None
           # a fresh map can just be inserted
           if self._map is None:
              self._map = newMap
@@ -85,18 +249,15 @@ class Dispatcher:
                  neighbours = [(neighbour[1][0],neighbour[0][0],neighbour[0][1]) for neighbour in node[1].items()]
                  self.addMapNode(node[0],neighbours)
 
-      # any legacy fares or taxis from a previous dispatcher can be imported here - future functionality,
-      # for the most part
+      # any legacy fares or taxis from a previous dispatcher can be imported here: a fare already allocated
+      # to a taxi, which the dispatcher takes over along with the taxi (see releaseTaxi)
       def handover(self, parent, origin, destination, time, taxi, price):
           if self._parent == parent:
              # handover implies taxis definitely known to a previous dispatcher. The current
              # dispatcher should thus be made aware of them
-             if taxi not in self._taxis:
-                self._taxis.append(taxi)
+             self.addTaxi(taxi)
              # add any fares found along with their allocations
-             self.newFare(parent, origin, destination, time)
-             self._fareBoard[origin][destination][time].taxi = self._taxis.index(taxi)
-             self._fareBoard[origin][destination][time].price = price
+             self._fareBoard.add(FareEntry(origin, destination, time, price, self._taxiIndices[taxi]))
 
       #--------------------------------------------------------------------------------------------------------------
       # runtime methods used to inform the Dispatcher of real-time events
@@ -106,47 +267,35 @@ class Dispatcher:
       def newFare(self, parent, origin, destination, time):
           # only add new fares coming from the same world
           if parent == self._parent:
-             fare = FareEntry(origin,destination,time)
-             if origin in self._fareBoard:               
-                if destination not in self._fareBoard[origin]:
-                   self._fareBoard[origin][destination] = {}
-             else:
-                self._fareBoard[origin] = {destination: {}}
              # overwrites any existing fare with the same (origin, destination, calltime) triplet, but
              # this would be equivalent to saying it was the same fare, at least in this world where
              # a given Node only has one fare at a time.
-             self._fareBoard[origin][destination][time] = fare
+             self._fareBoard.add(FareEntry(origin,destination,time))
              
       # abandoning fares will call this to cancel their request
       def cancelFare(self, parent, origin, destination, calltime):
           # if the fare exists in our world,
-          if parent == self._parent and origin in self._fareBoard:
-             if destination in self._fareBoard[origin]:
-                if calltime in self._fareBoard[origin][destination]:
-                   # get rid of it
-                   print("Fare ({0},{1}) cancelled".format(origin[0],origin[1]))
-                   # inform taxis that the fare abandoned
-                   self._parent.cancelFare(origin, self._taxis[self._fareBoard[origin][destination][calltime].taxi])
-                   del self._fareBoard[origin][destination][calltime]
-                if len(self._fareBoard[origin][destination]) == 0:
-                   del self._fareBoard[origin][destination]
-                if len(self._fareBoard[origin]) == 0:
-                   del self._fareBoard[origin]
+          if parent == self._parent:
+             # get rid of it
+             fare = self._fareBoard.remove((origin, destination, calltime))
+             if fare is not None:
+                logger.info("Fare (%s,%s) cancelled", origin[0], origin[1])
+                # inform the allocated taxi (if there is one) that the fare abandoned
+                if fare.taxi >= 0:
+                   self._parent.cancelFare(origin, self._taxis[fare.taxi])
 
       # taxis register their bids for a fare using this mechanism
       def fareBid(self, origin, taxi):
           # rogue taxis (not known to the dispatcher) can't bid on fares
-          if taxi in self._taxis:
+          if taxi in self._taxiIndices:
              # everyone else bids on fares available
-             if origin in self._fareBoard:
-                for destination in self._fareBoard[origin].keys():
-                    for time in self._fareBoard[origin][destination].keys():
-                        # as long as they haven't already been allocated
-                        if self._fareBoard[origin][destination][time].taxi == -1:
-                           self._fareBoard[origin][destination][time].bidders.append(self._taxis.index(taxi))
-                           # only one fare per origin can be actively open for bid, so
-                           # immediately return once we[ve found it
-                           return
+             for fare in self._fareBoard.atOrigin(origin):
+                 # as long as they haven't already been allocated
+                 if fare.taxi == -1:
+                    fare.bidders.append(self._taxiIndices[taxi])
+                    # only one fare per origin can be actively open for bid, so
+                    # immediately return once we[ve found it
+                    return
                      
       # fares call this (through the parent world) when they have reached their destination
       def recvPayment(self, parent, amount):
@@ -161,22 +310,49 @@ class Dispatcher:
       # allocateFare(origin, taxi).
       def clockTick(self, parent):
           if self._parent == parent:
-             for origin in self._fareBoard.keys():
-                 for destination in self._fareBoard[origin].keys():
-                     # TODO - if you can come up with something better. Not essential though.
-                     # not super-efficient here: need times in order, dictionary view objects are not
-                     # sortable because they are an iterator, so we need to turn the times into a
-                     # sorted list. Hopefully fareBoard will never be too big
-                     for time in sorted(list(self._fareBoard[origin][destination].keys())):
-                         if self._fareBoard[origin][destination][time].price == 0:
-                            self._fareBoard[origin][destination][time].price = self._costFare(self._fareBoard[origin][destination][time])
-                            # broadcastFare actually returns the number of taxis that got the info, if you
-                            # wish to use that information in the decision over when to allocate
-                            self._parent.broadcastFare(origin,
-                                                       destination,
-                                                       self._fareBoard[origin][destination][time].price)
-                         elif self._fareBoard[origin][destination][time].taxi < 0 and len(self._fareBoard[origin][destination][time].bidders) > 0:
-                              self._allocateFare(origin, destination, time)
+             # fares to be allocated together, in batch mode
+             closedFares = []
+             # only the fares that need something doing are looked at: open fares with bids can be allocated
+             # (fares just priced have to wait for bids first)
+             for fare in self._fareBoard.open:
+                 if len(fare.bidders) > 0:
+                    if self._batchAllocation:
+                       closedFares.append(fare.fareId)
+                    else:
+                       self._allocateFare(fare.origin, fare.destination, fare.calltime)
+                 # a geofenced broadcast that nobody has bid on by the time bidding closes goes out again, wider
+                 elif self._parent.simTime-fare.broadcastTime > 5 and self._broadcastScope(fare.broadcastRound) != (None, None):
+                      fare.broadcastRound += 1
+                      self._broadcast(fare)
+             # and new fares get priced and put out to the taxis
+             for fare in self._fareBoard.unpriced:
+                 self._fareBoard.setPrice(fare.fareId, self._costFare(fare))
+                 self._broadcast(fare)
+             if len(closedFares) > 0:
+                self._allocateFares(closedFares)
+
+      # the (radius, nearest) limits of a fare's broadcast, given how many times it has been widened. (None, None)
+      # means every taxi.
+      def _broadcastScope(self, broadcastRound):
+          if broadcastRound >= self._broadcastRounds:
+             return (None, None)
+          radius = None if self._broadcastRadius is None else self._broadcastRadius*2**broadcastRound
+          nearest = None if self._broadcastNearest is None else self._broadcastNearest*2**broadcastRound
+          return (radius, nearest)
+
+      # advertises a fare to the taxis in its current broadcast scope
+      def _broadcast(self, fare):
+          radius, nearest = self._broadcastScope(fare.broadcastRound)
+          fare.broadcastTime = self._parent.simTime
+          # broadcastFare actually returns the number of taxis that got the info, if you
+          # wish to use that information in the decision over when to allocate
+          self._parent.broadcastFare(fare.origin,
+                                     fare.destination,
+                                     fare.price,
+                                     radius,
+                                     nearest)
+          # make sure we're around to allocate it once bidding closes (see _allocateFare), or to widen the broadcast
+          self._parent.scheduleEvent(fare.broadcastTime+6, NetEvent.BID_DEADLINE, fare.origin)
 
       #----------------------------------------------------------------------------------------------------------------
 
@@ -219,29 +395,87 @@ class Dispatcher:
              # 3) that the taxi's location is 'on-grid': somewhere in the dispatcher's map
              # 4) that at least one valid taxi has actually bid on the fare
              if fareNode is not None:
-                for taxiIdx in self._fareBoard[origin][destination][time].bidders:
-
-                    if len(self._taxis) > taxiIdx:
+                if self._pathTable is None:
+                   self._pathTable = self._mapPathTable()
+                winnerDistance = -1
+                bidders = [taxiIdx for taxiIdx in self._fareBoard.get((origin, destination, time)).bidders if len(self._taxis) > taxiIdx]
+                if len(bidders) <= self.directBidders:
+                   for taxiIdx in bidders:
                        bidderLoc = self._taxis[taxiIdx].currentLocation
                        bidderNode = self._parent.getNode(bidderLoc[0],bidderLoc[1])
                        if bidderNode is not None:
-                          # ultimately the naive algorithm chosen is which taxi is the closest. This is patently unfair for several
-                          # reasons, but does produce *a* winner.
-
-                          if winnerNode is None or self._parent.distance2Node(bidderNode,fareNode) < self._parent.distance2Node(winnerNode,fareNode):
+                          # ultimately the naive algorithm chosen is which taxi is the closest by road. This is patently unfair for
+                          # several reasons, but does produce *a* winner. (A taxi with no route to the fare at all can't win.)
+                          bidderDistance = self._pathTable.distance(bidderLoc, origin)
+                          if bidderDistance >= 0 and (winnerNode is None or bidderDistance < winnerDistance):
                              allocatedTaxi = taxiIdx
                              winnerNode = bidderNode
-                          else:
-                             # and after all that, we still have to check that somebody won, because any of the other reasons to invalidate
-                             # the auction may have occurred.
-                             if allocatedTaxi >= 0:
-                                # but if so, allocate the taxi.
-                                self._fareBoard[origin][destination][time].taxi = allocatedTaxi     
-                                self._parent.allocateFare(origin,self._taxis[allocatedTaxi])
+                             winnerDistance = bidderDistance
+                # with lots of bidders, the world's taxi index offers up taxis nearest the fare first. No road is
+                # shorter than the straight line, so once the taxis are further away in a straight line than the best
+                # bidder is by road, none of the rest can beat it. Ties go to the earliest bidder, as above.
+                else:
+                   bidOrder = dict([(taxiIdx, order) for order, taxiIdx in reversed(list(enumerate(bidders)))])
+                   winnerOrder = -1
+                   for straightDistance, bidder in self._parent.taxisByDistance(origin):
+                       if winnerNode is not None and straightDistance > winnerDistance:
+                          break
+                       taxiIdx = self._taxiIndices.get(bidder)
+                       if taxiIdx not in bidOrder:
+                          continue
+                       bidderLoc = bidder.currentLocation
+                       bidderDistance = self._pathTable.distance(bidderLoc, origin)
+                       if bidderDistance >= 0 and (winnerNode is None or (bidderDistance, bidOrder[taxiIdx]) < (winnerDistance, winnerOrder)):
+                          allocatedTaxi = taxiIdx
+                          winnerNode = self._parent.getNode(bidderLoc[0],bidderLoc[1])
+                          winnerDistance = bidderDistance
+                          winnerOrder = bidOrder[taxiIdx]
+                # and after all that, we still have to check that somebody won, because any of the other reasons to invalidate
+                # the auction may have occurred.
+                if allocatedTaxi >= 0:
+                   # but if so, allocate the taxi.
+                   self._fareBoard.allocate((origin, destination, time), allocatedTaxi)
+                   self._parent.allocateFare(origin,self._taxis[allocatedTaxi])
+
+      # batch allocation: rather than giving each fare in turn to its nearest bidder, which can leave a later fare
+      # with only distant bidders because its nearest went to an earlier one, allocate all the fares whose bidding
+      # has closed at once, matching fares to the taxis that bid on them so that the total distance by road the
+      # taxis have to go to collect them is as small as possible (see assignment). fares is a list of
+      # (origin, destination, calltime) triples.
+      def _allocateFares(self, fares):
+          # the same 5 ticks to respond as _allocateFare gives, and the fare has to be somewhere in the world
+          fares = [fare for fare in fares if self._parent.simTime-fare[2] > 5 and self._parent.getNode(fare[0][0],fare[0][1]) is not None]
+          if len(fares) == 0:
+             return
+          if self._pathTable is None:
+             self._pathTable = self._mapPathTable()
+          # the bidding taxis (on the map) and where they are
+          bidders = {}
+          for fare in fares:
+              for taxiIdx in self._fareBoard.get(fare).bidders:
+                  if len(self._taxis) > taxiIdx and taxiIdx not in bidders:
+                     bidderLoc = self._taxis[taxiIdx].currentLocation
+                     if self._parent.getNode(bidderLoc[0],bidderLoc[1]) is not None:
+                        bidders[taxiIdx] = bidderLoc
+          if len(bidders) == 0:
+             return
+          taxiIdxs = list(bidders.keys())
+          cols = dict([(taxiIdx, col) for col, taxiIdx in enumerate(taxiIdxs)])
+          # costs are road distances; a taxi that didn't bid on a fare, or has no route to it, can't have it
+          costs = numpy.full((len(fares), len(taxiIdxs)), numpy.inf)
+          for row, fare in enumerate(fares):
+              for taxiIdx in self._fareBoard.get(fare).bidders:
+                  if taxiIdx in cols:
+                     bidderDistance = self._pathTable.distance(bidders[taxiIdx], fare[0])
+                     if bidderDistance >= 0:
+                        costs[row, cols[taxiIdx]] = bidderDistance
+          for row, col in zip(*solveAssignment(costs)):
+              self._fareBoard.allocate(fares[row], taxiIdxs[col])
+              self._parent.allocateFare(fares[row][0],self._taxis[taxiIdxs[col]])
 
       def _AC_3Inference(self, edges, basenode=None):
 
-          print("Running AC-3 inference")
+          logger.debug("Running AC-3 inference")
           toConsider = list(range(len(edges)))  # initialise AC-3 with all edges
           considered = []  # considered are the edges already evaluated
 
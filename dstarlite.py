@@ -0,0 +1,142 @@
+import heapq
+import itertools
+import math
+
+'''
+DStarLite is an incremental route planner (Koenig and Likhachev's D* Lite) for a single destination.
+It searches backwards, from the goal towards the start, and keeps its search tree between queries, so
+that when the cost of a few nodes changes - traffic building up or clearing somewhere - it only has to
+repair the part of the tree those changes affect, rather than search the whole map again. The start can
+move as the route is driven, too; the tree stays valid.
+
+Arguments:
+serviceMap - the map to plan over, the nested dict NetWorld.exportMap produces:
+{(x,y): {(neighbourx,neighboury): (direction, distance)}}
+cost - a function cost(a, b) giving the current cost of going from node a to its neighbour b: math.inf if
+that is impossible (e.g. gridlock)
+heuristic - a function heuristic(a, b) that never overestimates the cost of getting from a to b
+start, goal - the (x,y) ends of the route
+predecessors - the nodes leading into each node, {(x,y): [(x,y)...]}, if already worked out (see predecessorMap)
+'''
+class DStarLite:
+
+      def __init__(self, serviceMap, cost, heuristic, start, goal, predecessors=None):
+          self._map = serviceMap
+          self._cost = cost
+          self._heuristic = heuristic
+          self._predecessors = predecessors
+          if self._predecessors is None:
+             self._predecessors = predecessorMap(serviceMap)
+          self.goal = goal
+          self._start = start
+          # where the start was when the keys on the queue were computed, and by how much the keys have to be
+          # adjusted since, to account for the start having moved
+          self._lastStart = start
+          self._keyModifier = 0
+          # g is the cost-to-goal each node was last expanded with; rhs the one-step lookahead from its successors.
+          # Nodes not in these dicts are at infinity.
+          self._g = {}
+          self._rhs = {goal: 0}
+          # the priority queue of inconsistent nodes (g != rhs). Nodes are removed lazily: _keys holds the key
+          # each queued node should have, and heap entries that don't match it are skipped.
+          self._queue = []
+          self._keys = {}
+          self._tieBreaker = itertools.count()
+          self._push(goal)
+          self._computeShortestPath()
+
+      def _gValue(self, node):
+          return self._g.get(node, math.inf)
+
+      def _rhsValue(self, node):
+          return self._rhs.get(node, math.inf)
+
+      def _calculateKey(self, node):
+          best = min(self._gValue(node), self._rhsValue(node))
+          return (best+self._heuristic(self._start, node)+self._keyModifier, best)
+
+      def _push(self, node):
+          key = self._calculateKey(node)
+          self._keys[node] = key
+          heapq.heappush(self._queue, (key, next(self._tieBreaker), node))
+
+      # the smallest key on the queue (clearing out any stale entries on top), infinite if it is empty
+      def _topKey(self):
+          while len(self._queue) > 0 and self._keys.get(self._queue[0][2]) != self._queue[0][0]:
+                heapq.heappop(self._queue)
+          if len(self._queue) == 0:
+             return (math.inf, math.inf)
+          return self._queue[0][0]
+
+      def _updateVertex(self, node):
+          if node != self.goal:
+             self._rhs[node] = min([self._cost(node, successor)+self._gValue(successor)
+                                    for successor in self._map[node].keys() if successor in self._map] + [math.inf])
+          self._keys.pop(node, None)
+          if self._gValue(node) != self._rhsValue(node):
+             self._push(node)
+
+      def _computeShortestPath(self):
+          while self._topKey() < self._calculateKey(self._start) or self._rhsValue(self._start) != self._gValue(self._start):
+                oldKey, tie, node = heapq.heappop(self._queue)
+                if oldKey == (math.inf, math.inf):
+                   break
+                del self._keys[node]
+                newKey = self._calculateKey(node)
+                if oldKey < newKey:
+                   self._push(node)
+                elif self._gValue(node) > self._rhsValue(node):
+                     self._g[node] = self._rhsValue(node)
+                     for predecessor in self._predecessors.get(node, []):
+                         self._updateVertex(predecessor)
+                else:
+                     self._g[node] = math.inf
+                     self._updateVertex(node)
+                     for predecessor in self._predecessors.get(node, []):
+                         self._updateVertex(predecessor)
+
+      ''' update brings the plan up to date: start is where the route now starts from (it may have moved
+          along the route), and changed lists the nodes whose cost has changed since the last update (or
+          since the planner was created). Only those nodes and the ones leading into them are re-examined.
+      '''
+      def update(self, changed, start):
+          if start != self._start:
+             self._keyModifier += self._heuristic(self._lastStart, start)
+             self._lastStart = start
+             self._start = start
+          for node in changed:
+              if node in self._map:
+                 self._updateVertex(node)
+                 for predecessor in self._predecessors.get(node, []):
+                     self._updateVertex(predecessor)
+          self._computeShortestPath()
+
+      # the cost of the best route from the start to the goal, math.inf if there is none
+      @property
+      def cost(self):
+          return self._gValue(self._start)
+
+      # the best route from the start to the goal, with every node along the way; None if there isn't one
+      def path(self):
+          if self._start not in self._map or self._gValue(self._start) == math.inf:
+             return None
+          path = [self._start]
+          while path[-1] != self.goal:
+                # always step to the successor with the lowest cost-to-goal through it
+                successors = [(self._cost(path[-1], successor)+self._gValue(successor), successor)
+                              for successor in self._map[path[-1]].keys() if successor in self._map]
+                step = min(successors, key=lambda successor: successor[0])
+                # a route can't be longer than the map, unless something has gone badly wrong
+                if step[0] == math.inf or len(path) > len(self._map):
+                   return None
+                path.append(step[1])
+          return path
+
+# the nodes leading into each node of a service map
+def predecessorMap(serviceMap):
+   predecessors = dict([(node, []) for node in serviceMap.keys()])
+   for node, neighbours in serviceMap.items():
+       for neighbour in neighbours.keys():
+           if neighbour in predecessors:
+              predecessors[neighbour].append(node)
+   return predecessors
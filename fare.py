@@ -1,4 +1,7 @@
 import inspect
+import logging
+
+logger = logging.getLogger(__name__)
 
 '''
 A Fare is a very simple object residing in the world, representing a passenger to be delivered to some
@@ -27,7 +30,7 @@ class Fare:
           if self._taxi == taxi:
              self._enroute = True
              self._parent.removeFare(self)
-             print("Taxi {0} picked up a passenger".format(taxi.number))
+             logger.info("Taxi %s picked up a passenger", taxi.number)
 
 
       # alight from a taxi
@@ -43,8 +46,10 @@ class Fare:
           # ground is so gridlocked that no one is getting anywhere, any time soon.
           expectedTime2Dest = self._parent.travelTime(self._origin, self._destination)
           if (expectedTime2Dest < 0) or (self._price > 10*expectedTime2Dest):
-             print("Fare ({0},{1}) abandoned because expectedTime2Dest was {2} and price was {3}".format(self.origin[0],self.origin[1],expectedTime2Dest, self._price))
+             logger.info("Fare (%s,%s) abandoned because expectedTime2Dest was %s and price was %s", self.origin[0], self.origin[1], expectedTime2Dest, self._price)
              self._waitTime = 0
+             # which brings forward when it gives up
+             self._parent.scheduleAbandonment(self)
 
       # clear gets rid of any references to objects so that garbage collection can
       # delete the object for sure.
@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import math
+
+'''
+A JunctionGraph is a compressed routing graph over a service map. With interpolated streets, a map has
+a node for every grid cell along every street, and all but a few of them are simply somewhere along a
+street: they connect only to the cells before and after them. Searching through those one at a time is
+wasted effort, since there is only one way to go. The JunctionGraph contracts each such chain of street
+nodes into a single weighted link from the junction at one end to the junction at the other, so that
+searches only visit junctions - a search space typically an order of magnitude smaller.
+
+Any node along a street can still be the start or the end of a route: the graph knows which street
+segment(s) each street node lies on, and how far along, so a search from it starts by running out to the
+ends of its segment(s) ('first mile') and finishes by running in from the start of the target's
+segment(s) ('last mile'). route returns the junction waypoints of a route; expand fills in every node in
+between, as a Taxi's path needs them.
+
+The service map is the nested dict NetWorld.exportMap produces:
+{(x,y): {(neighbourx,neighboury): (direction, distance)}}.
+'''
+class JunctionGraph:
+
+      def __init__(self, serviceMap):
+          self._map = serviceMap
+          # the nodes leading into each node
+          incoming = dict([(node, set()) for node in serviceMap.keys()])
+          for node, neighbours in serviceMap.items():
+              for neighbour in neighbours.keys():
+                  if neighbour in incoming:
+                     incoming[neighbour].add(node)
+          # a street node connects to exactly 2 others, and traffic either flows both ways through it (a two-way
+          # street), or in from one side and out of the other (a one-way street). Everything else is a junction.
+          self._junctions = set()
+          for node, neighbours in serviceMap.items():
+              outgoing = set([neighbour for neighbour in neighbours.keys() if neighbour in serviceMap])
+              twoWay = len(outgoing) == 2 and outgoing == incoming[node]
+              oneWay = len(outgoing) == 1 and len(incoming[node]) == 1 and outgoing != incoming[node]
+              if node in outgoing or not (twoWay or oneWay):
+                 self._junctions.add(node)
+          # segments are the contracted streets: (from junction, to junction, length, street nodes in between,
+          # distance of each of them from the from junction). links gives the shortest segment from each
+          # junction to each junction it leads directly to.
+          self._segments = []
+          self._links = dict([(junction, {}) for junction in self._junctions])
+          # which segments each street node is on, and where: a list of (segment number, position) pairs
+          self._streetNodes = {}
+          for junction in list(self._junctions):
+              self._walkSegments(junction)
+          # a loop of street nodes with no junction anywhere on it can't be reached from any junction. Make one
+          # of its nodes a junction, and walk the loop from there.
+          for node in serviceMap.keys():
+              if node not in self._junctions and node not in self._streetNodes:
+                 self._junctions.add(node)
+                 self._links[node] = {}
+                 self._walkSegments(node)
+
+      # follows each street leading out of a junction until it reaches the next junction, recording it as a segment
+      def _walkSegments(self, junction):
+          for first in self._map[junction].keys():
+              if first not in self._map:
+                 continue
+              previous = junction
+              current = first
+              length = self._map[junction][first][1]
+              streetNodes = []
+              distances = []
+              while current not in self._junctions:
+                    streetNodes.append(current)
+                    distances.append(length)
+                    onward = next(neighbour for neighbour in self._map[current].keys() if neighbour != previous and neighbour in self._map)
+                    length += self._map[current][onward][1]
+                    previous = current
+                    current = onward
+              segment = len(self._segments)
+              self._segments.append((junction, current, length, tuple(streetNodes), tuple(distances)))
+              for position in range(len(streetNodes)):
+                  self._streetNodes.setdefault(streetNodes[position], []).append((segment, position))
+              if current not in self._links[junction] or length < self._segments[self._links[junction][current]][2]:
+                 self._links[junction][current] = segment
+
+      def __contains__(self, node):
+          return node in self._map
+
+      @property
+      def junctions(self):
+          return self._junctions
+
+      # the number of junction-to-junction links, i.e. the size of the contracted graph
+      @property
+      def linkCount(self):
+          return sum([len(links) for links in self._links.values()])
+
+      # the ways out of a node towards junctions: {junction: (distance, segment)}. A junction is its own way out.
+      def _exits(self, node):
+          if node in self._junctions:
+             return {node: (0, None)}
+          exits = {}
+          for segment, position in self._streetNodes[node]:
+              end = self._segments[segment]
+              distance = end[2]-end[4][position]
+              if end[1] not in exits or distance < exits[end[1]][0]:
+                 exits[end[1]] = (distance, segment)
+          return exits
+
+      # the ways into a node from junctions: {junction: (distance, segment)}
+      def _entries(self, node):
+          if node in self._junctions:
+             return {node: (0, None)}
+          entries = {}
+          for segment, position in self._streetNodes[node]:
+              start = self._segments[segment]
+              if start[0] not in entries or start[4][position] < entries[start[0]][0]:
+                 entries[start[0]] = (start[4][position], segment)
+          return entries
+
+      # the shortest way from one street node to another further along the same segment, as (distance, segment),
+      # if there is one
+      def _alongStreet(self, start, target):
+          if start in self._junctions or target in self._junctions:
+             return None
+          best = None
+          for segment, position in self._streetNodes[start]:
+              for targetSegment, targetPosition in self._streetNodes[target]:
+                  if targetSegment == segment and targetPosition > position:
+                     distance = self._segments[segment][4][targetPosition]-self._segments[segment][4][position]
+                     if best is None or distance < best[0]:
+                        best = (distance, segment)
+          return best
+
+      ''' route finds the shortest route from start to target with A* over the junctions, returning its waypoints:
+          start, the junctions passed through, and target. None if there is no route. heuristic is an estimate
+          of the distance between 2 nodes, which must never overestimate it (the default, straight-line
+          distance, doesn't).
+      '''
+      def route(self, start, target, heuristic=None):
+          if start not in self._map or target not in self._map:
+             return None
+          if start == target:
+             return [start]
+          if heuristic is None: heuristic = lambda x, y: math.sqrt((x[0] - y[0]) ** 2 + (x[1] - y[1]) ** 2)
+          # the best complete route found so far, as (length, last junction); None as the last junction means
+          # the route along the street shared by start and target
+          best = (math.inf, None)
+          alongStreet = self._alongStreet(start, target)
+          if alongStreet is not None:
+             best = (alongStreet[0], None)
+          lastMile = self._entries(target)
+          # the first mile takes the search out to the junction(s) at the end of start's street
+          bestCost = {}
+          parents = {}
+          tieBreaker = itertools.count()
+          frontier = []
+          for junction, exit in self._exits(start).items():
+              bestCost[junction] = exit[0]
+              parents[junction] = None
+              heapq.heappush(frontier, (exit[0]+heuristic(junction, target), next(tieBreaker), junction))
+          explored = set()
+          while len(frontier) > 0:
+                estimate, tie, junction = heapq.heappop(frontier)
+                # nothing left can beat the best complete route
+                if estimate >= best[0]:
+                   break
+                if junction in explored:
+                   continue
+                explored.add(junction)
+                if junction in lastMile and bestCost[junction]+lastMile[junction][0] < best[0]:
+                   best = (bestCost[junction]+lastMile[junction][0], junction)
+                for nextJunction, segment in self._links[junction].items():
+                    if nextJunction in explored:
+                       continue
+                    cost = bestCost[junction]+self._segments[segment][2]
+                    if nextJunction not in bestCost or cost < bestCost[nextJunction]:
+                       bestCost[nextJunction] = cost
+                       parents[nextJunction] = junction
+                       heapq.heappush(frontier, (cost+heuristic(nextJunction, target), next(tieBreaker), nextJunction))
+          if best[0] == math.inf:
+             return None
+          waypoints = [target]
+          junction = best[1]
+          while junction is not None:
+                if junction != waypoints[-1]:
+                   waypoints.append(junction)
+                junction = parents[junction]
+          if waypoints[-1] != start:
+             waypoints.append(start)
+          waypoints.reverse()
+          return waypoints
+
+      # the nodes strictly between 2 consecutive waypoints of a route, along the segment that joins them
+      def _between(self, start, target):
+          if start in self._junctions and target in self._junctions:
+             segment = self._links[start][target]
+          elif start in self._junctions:
+             segment = self._entries(target)[start][1]
+          elif target in self._junctions:
+             segment = self._exits(start)[target][1]
+          else:
+             segment = self._alongStreet(start, target)[1]
+          streetNodes = self._segments[segment][3]
+          first = 0 if start in self._junctions else streetNodes.index(start)+1
+          last = len(streetNodes) if target in self._junctions else streetNodes.index(target)
+          return list(streetNodes[first:last])
+
+      # expands a route's waypoints into the complete path, with every node along the way
+      def expand(self, waypoints):
+          if waypoints is None or len(waypoints) == 0:
+             return waypoints
+          path = [waypoints[0]]
+          for waypoint in waypoints[1:]:
+              path.extend(self._between(path[-1], waypoint))
+              path.append(waypoint)
+          return path
+
+      # the shortest complete path from start to target, or None if there is none
+      def path(self, start, target, heuristic=None):
+          return self.expand(self.route(start, target, heuristic))
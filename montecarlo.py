@@ -0,0 +1,80 @@
+import argparse
+import concurrent.futures
+import csv
+import sys
+import numpy
+# the RoboUber service area and its headless runner
+import RoboUber
+
+'''
+The Monte Carlo driver runs many independent RoboUber worlds, each seeded from its own branch of a
+single numpy SeedSequence, across a pool of worker processes. Because every world draws all its
+randomness from its own generator, each run is reproducible on its own and independent of the
+others, no matter which worker it lands on or in what order the runs complete. The per-run results
+are gathered into one table: a numpy record array with one row per run, in run order.
+'''
+
+# the columns of the results table
+resultFields = [('run', numpy.int64),
+                ('faresCreated', numpy.int64),
+                ('faresCompleted', numpy.int64),
+                ('faresAbandoned', numpy.int64),
+                ('fareRevenue', numpy.float64),
+                ('dispatcherRevenue', numpy.float64),
+                ('abandonment', numpy.float64),
+                ('utilisation', numpy.float64)]
+
+# runs a single world in a worker process and reduces its summary to a results row. This has to be a
+# module-level function so that the process pool can pickle it.
+def runSeeded(run, seed, runTime, args):
+   summary = RoboUber.runHeadless(runTime=runTime, seed=seed, **args)[1]
+   # abandonment is the fraction of fares that gave up waiting out of those that either gave up or got a taxi
+   resolved = summary['faresAbandoned'] + summary['faresCompleted']
+   return (run,
+           summary['faresCreated'],
+           summary['faresCompleted'],
+           summary['faresAbandoned'],
+           summary['fareRevenue'],
+           summary['dispatcherRevenue'],
+           summary['faresAbandoned']/resolved if resolved > 0 else 0.0,
+           summary['utilisation'])
+
+''' runMonteCarlo simulates runs independent worlds and returns the results table. Arguments:
+    runs - the number of worlds to simulate
+    seed - root seed; the same root seed reproduces the same table. None gives a fresh one.
+    workers - number of worker processes (default: one per core)
+    runTime - time steps in each simulated day
+    any other keyword arguments are handed on to RoboUber.runHeadless, so e.g. taxiClass or
+    dispatcherClass can select the policies under evaluation. They must be picklable.
+'''
+def runMonteCarlo(runs, seed=None, workers=None, runTime=RoboUber.runTime, **args):
+   # spawned child sequences are statistically independent of each other
+   seeds = numpy.random.SeedSequence(seed).spawn(runs)
+   with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(runSeeded, run, seeds[run], runTime, args) for run in range(runs)]
+        rows = [future.result() for future in futures]
+   return numpy.rec.fromrecords(rows, dtype=resultFields) if len(rows) > 0 else numpy.recarray(0, dtype=resultFields)
+
+# writes the results table out as CSV, with a header line
+def writeResults(results, stream):
+   writer = csv.writer(stream)
+   writer.writerow(results.dtype.names)
+   for row in results:
+       writer.writerow(row.tolist())
+
+if __name__ == '__main__':
+
+   argParser = argparse.ArgumentParser(description="Run many seeded RoboUber worlds in parallel")
+   argParser.add_argument('--runs', type=int, default=16, help="number of worlds to simulate")
+   argParser.add_argument('--seed', type=int, default=None, help="root seed for the whole batch")
+   argParser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+   argParser.add_argument('--runtime', type=int, default=RoboUber.runTime, help="time steps in each world")
+   argParser.add_argument('--output', default=None, help="CSV file for the results (default: stdout)")
+   cmdArgs = argParser.parse_args()
+
+   results = runMonteCarlo(cmdArgs.runs, seed=cmdArgs.seed, workers=cmdArgs.workers, runTime=cmdArgs.runtime)
+   if cmdArgs.output is None:
+      writeResults(results, sys.stdout)
+   else:
+      with open(cmdArgs.output, 'w', newline='') as resultsFile:
+           writeResults(results, resultsFile)
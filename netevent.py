@@ -0,0 +1,60 @@
+import heapq
+import itertools
+
+'''
+A NetEvent is something scheduled to happen in a NetWorld at a given time step. The world's event
+engine uses these to jump directly from one event time to the next when nothing else is going on.
+Events are typed by kind; subject is whatever the event concerns (a Node, a Fare, a Taxi...), and
+version lets the scheduler invalidate events lazily, rather than digging them out of the queue: an
+event whose version no longer matches what the world expects is simply ignored when it comes up.
+'''
+class NetEvent:
+
+      # event kinds
+      FARE_ARRIVAL = 1       # a fare may appear at a node (subject: Node)
+      FARE_ABANDON = 2       # a waiting fare runs out of patience (subject: Fare)
+      TAXI_ARRIVAL = 3       # a taxi completes its move into a node (subject: (Taxi, Node))
+      BID_DEADLINE = 4       # bidding on a fare closes and it can be allocated (subject: fare origin)
+      DISPATCHER_WAKEUP = 5  # the dispatcher has something to deal with (subject: None)
+
+      def __init__(self, time, kind, subject=None, version=0):
+          self.time = time
+          self.kind = kind
+          self.subject = subject
+          self.version = version
+
+'''
+NetEventQueue is a priority queue of NetEvents ordered by time, built on heapq. Events due at the
+same time come out in the order they were scheduled.
+'''
+class NetEventQueue:
+
+      def __init__(self):
+          self._heap = []
+          # tie-breaker so that simultaneous events are FIFO and the events themselves never get compared
+          self._sequence = itertools.count()
+
+      def __len__(self):
+          return len(self._heap)
+
+      # schedule an event, returning it
+      def push(self, time, kind, subject=None, version=0):
+          event = NetEvent(time, kind, subject, version)
+          heapq.heappush(self._heap, (time, next(self._sequence), event))
+          return event
+
+      # time of the next event, or None if there are no events at all
+      def nextTime(self):
+          if len(self._heap) == 0:
+             return None
+          return self._heap[0][0]
+
+      # removes and returns (in order) all the events due at or before time
+      def popDue(self, time):
+          due = []
+          while len(self._heap) > 0 and self._heap[0][0] <= time:
+                due.append(heapq.heappop(self._heap)[2])
+          return due
+
+      def clear(self):
+          self._heap = []
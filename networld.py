@@ -2,9 +2,21 @@ import math
 import numpy
 import heapq
 import inspect
+import itertools
+import logging
 
-from node import Node
+from node import Node, fareRate
 from fare import Fare
+from netevent import NetEvent, NetEventQueue
+from recorder import asRecorder
+from pathtable import PathTable
+from junctiongraph import JunctionGraph
+from servicemap import ServiceMap
+from taxiindex import TaxiIndex
+from aliastable import AliasTable
+from trafficarrays import TrafficArrays, FLOWED, SOURCED, ARRIVED
+
+logger = logging.getLogger(__name__)
 
 # some straightforward data containers to help in initialising Worlds. A junction will
 # end up being a Node, a street will end up being an Edge.
@@ -53,6 +65,10 @@ graph is a map of Nodes, each of which lies at some (x,y) coordinate.
     
 class NetWorld:
 
+      # at most this many rows of the distance matrix (see distances) are kept at a time; a row takes 4 bytes for
+      # every node in the map
+      distanceRows = 1024
+
       '''
       Constructor. The x, y size of the world must be specified, all other parameters
       are optional:
@@ -66,36 +82,129 @@ class NetWorld:
       to stop at any point on a street and fares to appear there. If not, only the nodes themselves
       will be generated and this means taxis can only stop at junctions and fares will
       only ever appear there.
+      seed - seeds the world's own random generator, which drives fare generation (for default
+      and fareRate generators) and fare destinations and waiting times. Anything numpy.random.default_rng
+      accepts will do; worlds with the same seed and setup run identically.
+      vectorTraffic - if True, traffic is flowed for the whole map at once with array operations (see the
+      trafficarrays module), rather than by each Node in turn.
+      The traffic comes out exactly as the Nodes would flow it themselves.
+      fareDestinations - a function weighting how likely a fare is to be going to a destination given its
+      distance from the fare's origin, e.g. lambda d: math.exp(-d/20). None (the default) sends fares to any
+      stopping point with equal probability.
      '''
-      def __init__(self,x,y,runtime = 0, fareprob=None, jctNodes=None,edges=None,interpolateNodes=False):
+      def __init__(self,x,y,runtime = 0, fareprob=None, jctNodes=None,edges=None,interpolateNodes=False,seed=None,
+                   fareDestinations=None,vectorTraffic=False):
 
           # size of the virtual grid. Nodes must be at (x,y) positions within the grid.
           self.xSize = x
           self.ySize = y
           # number of time steps to run. 0 means run forever.
           self.runTime = runtime
+          # all the randomness in the world comes from here, so that independent worlds don't share
+          # (or disturb) each other's random state
+          self._rng = numpy.random.default_rng(seed)
           # default fare generator is used for interpolated positions. A defined Node can
           # have its own fare probability structure
           self.defaultFareGen = fareprob
           # the network itself (which starts blank) is a dictionary indexed by node number
           # (a straightforward (x,y) hash)
           self._net = {}
+          # bumped whenever nodes or edges are added to the network, so that anything derived from it knows to rebuild
+          self._mapVersion = 0
+          # the active set: Nodes with something to do, which are the only ones ticked. Nodes join it by
+          # calling activateNode and leave it when they settle after a tick with nothing left to do. They are
+          # ticked in network order, given by their positions in _net (rebuilt along with the map).
+          self._activeNodes = set()
+          self._nodeOrder = {}
+          self._nodeOrderVersion = -1
+          # the exported map (see exportMap), built on demand for the current map version and shared by everyone
+          self._serviceMap = None
+          self._serviceMapVersion = -1
+          # every node has a dense id, its place in the network order (the same as its id in the exported map),
+          # and nodePositions holds the (x,y) index of each id. Rows of the straight-line distance matrix, from one
+          # node to every other, are filled in as they are needed: the full matrix would grow with the square of
+          # the map's size.
+          self._nodeIds = {}
+          self._nodePositions = numpy.zeros((0, 2), dtype=numpy.int32)
+          self._nodeIdVersion = -1
+          self._distanceRows = {}
+          # the all-pairs shortest path table, built on demand (exportPathTable) for the current map version
+          self._pathTable = None
+          self._pathTableVersion = -1
+          # likewise the compressed junction-to-junction routing graph (exportJunctionGraph)
+          self._junctionGraph = None
+          self._junctionGraphVersion = -1
+          # fare generation state, rebuilt from the network when it changes: the Nodes with a fixed fare
+          # probability, a numpy array of those probabilities (drawn against all at once each tick), and the
+          # Nodes with arbitrary generators, which have to be polled one by one. 
+          self._fareGenVersion = -1
+          self._fareNodes = []
+          self._fareProbs = numpy.zeros(0)
+          self._polledFareNodes = []
+          # likewise the fare destinations: the Nodes where fares can stop, where each is in that list, and their
+          # node ids (see nodeId) as an array. With fareDestinations, each origin gets an alias table for drawing
+          # destinations weighted by distance (built the first time a fare starts there).
+          self.fareDestinations = fareDestinations
+          self._stopNodes = []
+          self._stopOrder = {}
+          self._stopIds = numpy.zeros(0, dtype=numpy.int64)
+          self._destinationTables = {}
           # the traffic queue is a dictionary of entries for each node into which traffic is
           # to be injected
           self._trafficQ = {}
+          # nodes into which traffic was flowed at the end of the last time step (see recordNodes)
+          self._injectedNodes = []
+          # the traffic each Node was last seen with, and the Nodes whose traffic changed during the current
+          # time step (see trafficChanges), so that route planners can repair just the affected routes
+          self._trafficLevels = {}
+          self._trafficChanges = []
+          # the engine flowing the traffic, if the Nodes don't flow it themselves: arrays of the traffic in the
+          # whole map. It is built on demand for the current map version (see _currentTrafficEngine).
+          self._vectorTraffic = vectorTraffic
+          self._trafficEngine = None
+          self._trafficEngineVersion = -1
           # the taxi queue is a dictionary of entries for each taxi giving (node, direction)
           # ground-truth locations and admission token pairs. It looks like this therefore:
           #{taxi_obj: ((here_loc, here_dir), (admit_loc, admit_dir))
           self._taxis = {}
+          # the one Node (and direction) each taxi is currently indicating it wants to enter, as (node, direction)
+          self._indications = {}
+          # where the taxis in the world are, for finding the ones near a place (see nearestTaxis)
+          self._taxiIndex = TaxiIndex()
           # this is a dict indexed by origin of the active fares waiting for collection
           self._fareQ = {}
-          # the dispatcher (there can only be one) handles allocation of fares to taxis
+          # and the abandonment queue orders them by when they will give up: a heap of (abandon time,
+          # tie-breaker, origin, fare) entries. Collected fares, and fares whose abandon time has been brought
+          # forward (which just pushes a new entry), leave stale entries behind that are skipped when popped.
+          self._abandonQ = []
+          self._abandonTieBreaker = itertools.count()
+          # the taxis each waiting fare has been advertised to (by origin), so that widening a broadcast only
+          # advises the taxis that haven't heard of the fare yet
+          self._fareAdvised = {}
+          # the dispatcher handles allocation of fares to taxis. The map can also be divided into zones (see
+          # setZones), each with a dispatcher of its own for the fares starting there; the dispatcher added for no
+          # zone in particular handles everywhere else. zones gives the zone of each node index, dispatchers the
+          # dispatcher for each zone, and fareDispatchers which dispatcher is handling each fare (to be paid
+          # when it completes).
           self._dispatcher = None
+          self._zones = {}
+          self._zoneDispatchers = {}
+          self._fareDispatchers = {}
+          # running totals of what has happened in the world, for summary reporting. taxiTicks counts
+          # on-duty taxi time steps and carryingTicks those in which the taxi had a passenger aboard.
+          self._stats = {'faresCreated': 0, 'faresCompleted': 0, 'faresAbandoned': 0, 'fareRevenue': 0,
+                         'taxiTicks': 0, 'carryingTicks': 0}
+          # taxis currently conducting a fare
+          self._carrying = set()
           if jctNodes is not None:
              self.addNodes(jctNodes)
           if edges is not None:
              self.addEdges(edges,interpolateNodes)
-          #self.eventQ = NetEventQueue()
+          # the event queue drives the discrete-event engine (runEvents). It only exists while the world is
+          # being run that way; arrivalVersion tags the fare arrivals currently scheduled, so that a map change
+          # can reschedule them all without having to find the old ones.
+          self._eventQ = None
+          self._arrivalVersion = -1
           # the simulation clock. 
           self._time = 0
 
@@ -106,11 +215,28 @@ class NetWorld:
       def simTime(self):
           return self._time
 
+      # the world's random number generator
+      @property
+      def rng(self):
+          return self._rng
+
       # size of the world in number of nodes.
       @property
       def size(self):
           return len(self._net)
 
+      # a snapshot of the running totals of fares and taxi activity
+      @property
+      def stats(self):
+          return dict(self._stats)
+
+      # the (x,y) indices of the nodes whose traffic has changed in the current time step. Traffic only
+      # changes as nodes are ticked or have traffic flowed into them, so during a tick this is the complete
+      # list of nodes a traffic-aware route planner needs to look at again.
+      @property
+      def trafficChanges(self):
+          return [node.index for node in self._trafficChanges]
+
       #__________________________________________________________________________________________________________
       # methods to build the graph and place agents in it
 
@@ -124,7 +250,7 @@ class NetWorld:
           if isinstance(nodes, list) or isinstance(nodes, tuple):
              try:
                  invalid = next(node for node in nodes if not isinstance(node, junctionDef))
-                 print("Invalid node list to add to NetWorld graph: at least one object is not a junctionDef")
+                 logger.error("Invalid node list to add to NetWorld graph: at least one object is not a junctionDef")
                  return
              # passed validation: we have a list of nodes.
              except StopIteration:       
@@ -138,8 +264,9 @@ class NetWorld:
                                            'traffic_in': node.tSrc,
                                            'traffic_out': node.tSink}))
                                    for node in nodes])
+                 self._mapVersion += 1
                  return
-          print("Invalid nodes argument to add to Networld graph: not a list or tuple")
+          logger.error("Invalid nodes argument to add to Networld graph: not a list or tuple")
 
       # takes a list of streetDefs and adds it to the network as outgoing links. Interpolate
       # will create a series of interstitial nodes from the source to the destination. 
@@ -149,9 +276,11 @@ class NetWorld:
           if isinstance(edges, list) or isinstance(edges, tuple):
              try:
                  invalid = next(edge for edge in edges if not isinstance(edge, streetDef))
-                 print("Invalid edge list to add to NetWorld graph: at least one object is not a streetDef")
+                 logger.error("Invalid edge list to add to NetWorld graph: at least one object is not a streetDef")
                  return
              except StopIteration:
+                 # the connections are changing (possibly without any new nodes), so anything derived from the map is out of date
+                 self._mapVersion += 1
                  # in the interpolation case, we create additional interstitial nodes between junctions
                  if interpolate:
                     for edge in edges:
@@ -225,6 +354,7 @@ class NetWorld:
                                                         'capacity': 1,
                                                         'fare_probability': self.defaultFareGen})
                               self._net[penultimateNodeIdx] = penultimateNode
+                              self._mapVersion += 1
                            if self.addEdgeSegment(penultimateNode,(dst.index[0], dst.index[1]),False) != dst:
                               raise KeyError("Penultimate node {1} should be adjacent to end junction {2}".format(penultimateNode.index,dst.index))
                         # bidirectional cases can be just handled by the ordinary machinery.
@@ -242,7 +372,8 @@ class NetWorld:
                         self._net[edge.nodeA].addNeighbour(self, self._net[edge.nodeB], edge.dirA)
                         if edge.bidirectional:
                            self._net[edge.nodeB].addNeighbour(self, self._net[edge.nodeA], edge.dirB)
-          print("Invalid edges argument to add to Networld graph: not a list or tuple")
+                 return
+          logger.error("Invalid edges argument to add to Networld graph: not a list or tuple")
 
       # builds edges by adding one segment at a time, auto-computing entry and exit points.
       # start is the actual point from which we are going to add another segment. We assume
@@ -267,6 +398,7 @@ class NetWorld:
                                 'capacity': 2 if bidir else 1,
                                 'fare_probability': self.defaultFareGen})
              self._net[nextIdx] = nextNode
+             self._mapVersion += 1
           # find the exit directions from each node 
           startEgress = 0
           backEgress = 4
@@ -340,30 +472,70 @@ class NetWorld:
           else:
              return (None, -1)
           # the dispatcher ought to know a new taxi is available
-          if self._dispatcher is not None:
-             self._dispatcher.addTaxi(taxi)
+          dispatcher = self._dispatcherFor(location)
+          if dispatcher is not None:
+             dispatcher.addTaxi(taxi)
           # a taxi just coming on duty has no predefined right of way
           self._taxis[taxi] = [(None, -1), (None, -1)]
+          self._taxiIndex.remove(taxi)
           # but does get a traffic light indicator to allow it in
           return (self._net[location],ingressPoint)
 
       # adds a dispatcher. This is straightforward because the dispatcher doesn't need to have any physical location.
-      # a dispatcher added using this method will supersede any previous dispatchers that have been there.
-      def addDispatcher(self,dispatcher):
+      # a dispatcher added using this method will supersede any previous dispatchers that have been there: for the
+      # whole map, or if zone is given, for that zone of it (see setZones).
+      def addDispatcher(self,dispatcher,zone=None):
           # place the dispatcher in the world
-          self._dispatcher = dispatcher
+          if zone is None:
+             self._dispatcher = dispatcher
+          else:
+             self._zoneDispatchers[zone] = dispatcher
           # let it know the taxis that are already there,
-          for taxi in self._taxis.keys():
-              self._dispatcher.addTaxi(taxi)
+          for taxi in self._taxis.items():
+              if zone is None or (taxi[1][0][0] is not None and self._zones.get(taxi[1][0][0].index) == zone):
+                 dispatcher.addTaxi(taxi[0])
           # give it the map of the service area,
-          self._dispatcher.importMap(self.exportMap())
-          # and any fares that happen to be waiting already
+          dispatcher.importMap(self.exportMap())
+          # and any fares that happen to be waiting already (in its area)
           for fare in self._fareQ.values():
+              if self._dispatcherFor(fare.origin) is not dispatcher:
+                 continue
+              self._fareDispatchers[fare] = dispatcher
               # we can also handle fares previously dispatched by another dispatcher
               if fare.taxi is not None:
-                 self._dispatcher.handover(self, fare.origin, fare.destination, fare.callTime, fare.taxi, fare.price)
+                 dispatcher.handover(self, fare.origin, fare.destination, fare.calltime, fare.taxi, fare.price)
               else:
-                 self._dispatcher.newFare(self, fare.origin, fare.destination, fare.callTime)
+                 dispatcher.newFare(self, fare.origin, fare.destination, fare.calltime)
+
+      ''' setZones divides the map into zones, for dispatching fares zone by zone: zones is a dict giving the zone
+          of each (x,y) node index (any hashable will do to name a zone, except None). Fares are handled by the
+          dispatcher of the zone they start in (see addDispatcher), or the dispatcher for the whole map if their
+          zone hasn't got one. Taxis are handed over between dispatchers as they drive from zone to zone: a taxi
+          entering a zone is made known to its dispatcher (which can then allocate it fares), as is a taxi
+          bidding for a fare in another zone, and the other zones' dispatchers release it (Dispatcher.releaseTaxi)
+          and hand its allocations still waiting to be collected over to the new one (Dispatcher.handover),
+          along with the fare's payment.
+      '''
+      def setZones(self, zones):
+          self._zones = dict(zones)
+
+      # zones in a regular grid, columns across by rows down, for setZones. Each zone is named by its (column, row).
+      def gridZones(self, columns, rows):
+          return dict([(index, (index[0]*columns//self.xSize, index[1]*rows//self.ySize)) for index in self._net.keys()])
+
+      # the dispatcher responsible for fares from a node index
+      def _dispatcherFor(self, index):
+          zone = self._zones.get(index)
+          if zone is not None and zone in self._zoneDispatchers:
+             return self._zoneDispatchers[zone]
+          return self._dispatcher
+
+      # all the dispatchers in the world, the one for the whole map first
+      @property
+      def dispatchers(self):
+          if self._dispatcher is None:
+             return list(self._zoneDispatchers.values())
+          return [self._dispatcher]+[dispatcher for dispatcher in self._zoneDispatchers.values() if dispatcher is not self._dispatcher]
 
       #----------------------------------------------------------------------------------------------------------------
 
@@ -375,18 +547,52 @@ class NetWorld:
              return None
           return self._net[(x,y)]
 
+      # the k on-duty taxis in the world nearest to (x,y) point, as a list of (straight-line distance, taxi) pairs,
+      # nearest first
+      def nearestTaxis(self, point, k=1):
+          return self._taxiIndex.nearest(point, k)
+
+      # the on-duty taxis in the world within radius of (x,y) point, as a list of (distance, taxi) pairs, nearest first
+      def taxisWithin(self, point, radius):
+          return self._taxiIndex.within(point, radius)
+
+      # generates (distance, taxi) pairs for all the on-duty taxis in the world, nearest to (x,y) point first
+      def taxisByDistance(self, point):
+          return self._taxiIndex.byDistance(point)
+
       ''' this dumps out the complete map of the network. it is arranged as a nested dictionary. The
           outer dict is indexed by each node's (x,y) coordinate and there is one entry per node. Its
           inner dict is a map of the nodes to which the outer node connects directly, indexed by the
           destination (x,y) coordinate and giving a tuple of outward direction from the origin to the
-          destination along with the distance to it.
+          destination along with the distance to it. The dictionary is a read-only ServiceMap (see
+          servicemap): only one is built for each version of the map, and everyone who asks for the
+          map gets that same one.
       ''' 
       def exportMap(self):
-          return dict([(node.index,
-                        dict([((neighbour[1],neighbour[2]),
-                               (neighbour[0], self.distance2Node(node,self._net[(neighbour[1],neighbour[2])])))
-                              for neighbour in node.neighbours]))
-                        for node in self._net.values()])
+          if self._serviceMapVersion != self._mapVersion:
+             self._serviceMap = ServiceMap(dict([(node.index,
+                                                  dict([((neighbour[1],neighbour[2]),
+                                                         (neighbour[0], self.distance2Node(node,self._net[(neighbour[1],neighbour[2])])))
+                                                        for neighbour in node.neighbours]))
+                                                 for node in self._net.values()]))
+             self._serviceMapVersion = self._mapVersion
+          return self._serviceMap
+
+      # the shortest-path table for the map (see pathtable). It is built when first asked for and then shared by
+      # everyone who asks, until the map changes.
+      def exportPathTable(self):
+          if self._pathTableVersion != self._mapVersion:
+             self._pathTable = PathTable(self.exportMap())
+             self._pathTableVersion = self._mapVersion
+          return self._pathTable
+
+      # the compressed routing graph for the map (see junctiongraph), in which routes only visit junctions.
+      # Like the path table, built when first asked for and shared until the map changes.
+      def exportJunctionGraph(self):
+          if self._junctionGraphVersion != self._mapVersion:
+             self._junctionGraph = JunctionGraph(self.exportMap())
+             self._junctionGraphVersion = self._mapVersion
+          return self._junctionGraph
 
       # the next 2 functions are heuristics, that is, in some situations they will not be strictly
       # accurate. 
@@ -414,18 +620,77 @@ class NetWorld:
              return round((origin.traffic+destination.traffic+self.distance2Node(origin, destination))/2)
 
       # straight-line distance between 2 nodes. If the nodes are directly connected
-      # this will be an exact heuristic
+      # this will be an exact heuristic. (For one pair, working it out is quicker than a
+      # lookup in the distance matrix; see distances for many at once.)
       def distance2Node(self, origin, destination):
           # give an invalid distance if the nodes were invalid
           if origin is None or destination is None:
              return -1
           return math.sqrt((destination.index[0]-origin.index[0])**2+(destination.index[1]-origin.index[1])**2)
 
+      ''' distances gives the straight-line distances from origin to each of a list of destination nodes at once,
+          as a float32 array (-1 for any destination that is None, as distance2Node gives). The distances come
+          from origin's row of the distance matrix, which is filled in if it isn't there already, unless fill is
+          False: then they are worked out just for these destinations, which is cheaper for a one-off query.
+      '''
+      def distances(self, origin, destinations, fill=True):
+          self._updateNodeIds()
+          destinationIds = numpy.array([-1 if destination is None else self._nodeIds.get(destination.index, -1)
+                                        for destination in destinations], dtype=numpy.int64)
+          found = destinationIds >= 0
+          destinationIds = destinationIds[found]
+          result = numpy.full(len(destinations), -1, dtype=numpy.float32)
+          if origin is None or not found.any():
+             return result
+          originId = self._nodeIds.get(origin.index)
+          if originId is not None and (fill or originId in self._distanceRows):
+             result[found] = self._distanceRow(originId)[destinationIds]
+          else:
+             offsets = self._nodePositions[destinationIds]-numpy.array(origin.index)
+             result[found] = numpy.hypot(offsets[:,0], offsets[:,1])
+          return result
+
+      # the dense id of the node at (x,y) index, or None if there is no node there
+      def nodeId(self, index):
+          self._updateNodeIds()
+          return self._nodeIds.get(index)
+
+      # (n, 2) array of the (x,y) index of each node id
+      @property
+      def nodePositions(self):
+          self._updateNodeIds()
+          return self._nodePositions
+
+      # renumbers the nodes (and forgets the distance matrix) if the map has changed since they were numbered
+      def _updateNodeIds(self):
+          if self._nodeIdVersion != self._mapVersion:
+             self._nodeIds = dict([(node, nodeId) for nodeId, node in enumerate(self._net.keys())])
+             self._nodePositions = numpy.array(list(self._net.keys()), dtype=numpy.int32).reshape(-1, 2)
+             self._distanceRows = {}
+             self._nodeIdVersion = self._mapVersion
+
+      # the row of the distance matrix for a node id, worked out if need be. When there are too many rows, the
+      # one filled in longest ago makes way.
+      def _distanceRow(self, nodeId):
+          row = self._distanceRows.get(nodeId)
+          if row is None:
+             offsets = self._nodePositions-self._nodePositions[nodeId]
+             row = numpy.hypot(offsets[:,0], offsets[:,1]).astype(numpy.float32)
+             if len(self._distanceRows) >= self.distanceRows:
+                del self._distanceRows[next(iter(self._distanceRows))]
+             self._distanceRows[nodeId] = row
+          return row
+
       #_____________________________________________________________________________________________________________
       # methods called by world's members to execute coordinated actions
       
       '''methods generally called by Nodes
       '''
+
+      # activateNode is called by a Node that has gained something to do (traffic, a taxi, a fare), and puts it
+      # in the set of Nodes ticked at each time step.
+      def activateNode(self, node):
+          self._activeNodes.add(node)
       
       # addTraffic is called by a Node and inserts traffic into another Node. We can
       # do this 'properly' on an event queue if desired
@@ -453,75 +718,218 @@ class NetWorld:
               if self._taxis[taxi[1]][1][0] != node:
                  self._taxis[taxi[1]][1] = (None, -1)
                  
+      # registerIndication is called by a Node that a taxi has indicated it wants to enter. A taxi only
+      # wants to go one way at a time, so an indication it left at another Node (or in another direction)
+      # is abandoned, rather than left holding up the taxis queued behind it there.
+      def registerIndication(self, node, direction, taxi):
+          previous = self._indications.get(taxi)
+          if previous is not None and (previous[0] is not node or previous[1] != direction):
+             previous[0].abandon(previous[1], taxi)
+          self._indications[taxi] = (node, direction)
+
       # clearAdmission is called by a Node to release a taxi's admission when it has entered
       # the node.
       # --BUGFIX -- added 6 December 2020 
       def clearAdmission(self, node, taxi):
+          if taxi in self._indications and self._indications[taxi][0] is node:
+             del self._indications[taxi]
           if taxi in self._taxis and self._taxis[taxi][1][0] == node:
              # second field in each taxi's admission request is the node and direction to enter.
              newLoc = self._taxis[taxi][1]
              # it's now entered that node, so this becomes the first field in the admission request:
              # its current node and direction. Second field is cleared out.
+             # a taxi driving into another zone is handed over to that zone's dispatcher
+             if (len(self._zoneDispatchers) > 0 and self._taxis[taxi][0][0] is not None and
+                 self._zones.get(self._taxis[taxi][0][0].index) != self._zones.get(newLoc[0].index)):
+                self._handOverTaxi(taxi, newLoc[0].index)
              self._taxis[taxi] = [newLoc, (None, -1)]
+             self._taxiIndex.move(taxi, newLoc[0].index)
+
+      # hands a taxi that has driven into another zone over to the dispatcher for the node index it is now at.
+      # Every other zone's dispatcher forgets it - the one for the zone it left, and any it bid into from
+      # outside - so each only knows the taxis around its own zone. Its allocations that are still waiting to
+      # be collected go along with it (and so do their payments); the rest are done with. (The dispatcher for
+      # the whole map, if there is one, knows every taxi, and keeps them.)
+      def _handOverTaxi(self, taxi, index):
+          dispatcher = self._dispatcherFor(index)
+          if dispatcher is not None:
+             dispatcher.addTaxi(taxi)
+          for zoneDispatcher in self._zoneDispatchers.values():
+              if zoneDispatcher is dispatcher or zoneDispatcher is self._dispatcher:
+                 continue
+              for allocation in zoneDispatcher.releaseTaxi(self, taxi):
+                  fare = self._fareQ.get(allocation.origin)
+                  if (dispatcher is not None and fare is not None and fare.calltime == allocation.calltime and
+                      fare.taxi is taxi and not fare.enroute):
+                     dispatcher.handover(self, allocation.origin, allocation.destination, allocation.calltime, taxi,
+                                         allocation.price)
+                     self._fareDispatchers[fare] = dispatcher
 
       # insertFare is called by a Node, creates a fare, adds it to the Node, and notifies
       # the Dispatcher
       def insertFare(self, node):
           if node.index in self._fareQ:
              raise IndexError("Node {0} generated a new fare for one where a Fare is already waiting".format(node.index))
-          # generate a random valid destination. This isn't actually ideal, what we really want is a distance-dependent
-          # distribution over the node pairs, but implementing a *fast* generator of such a form is not easy. Dictionaries,
-          # furthermore, have in Python 3.x the subtlety that their values() can't be indexed, it returns an iterator
-          # instead, so you have to turn it into a list. It may actually be faster to grab the keys(), turn those into
-          # a list, then index the element in self._net.
-          destinationNode = node
-          while destinationNode == node or not destinationNode.canStop:
-                destinationNode = list(self._net.values())[round(numpy.random.uniform(0,len(self._net)-1))]
+          destinationNode = self._fareDestination(node)
           # fares will wait only for so long; a function of the distance to destination plus a gamma distribution 
-          maxWait = self.distance2Node(node, destinationNode)*10 + 5*numpy.random.gamma(2.0,1.0)
+          maxWait = self.distance2Node(node, destinationNode)*10 + 5*self._rng.gamma(2.0,1.0)
           newFare = Fare(self, node, destinationNode, self._time, maxWait)
+          self._stats['faresCreated'] += 1
           # notify the Dispatcher, if any. If there is no Dispatcher yet, when it does come on-shift, it will
           # be notified of any pending Fares that it ought to dispatch, assuming they've not abandoned the attempt.
           # Dispatchers get no idea of how long a fare will wait! 
-          if self._dispatcher is not None:
-             self._dispatcher.newFare(self, newFare.origin, newFare.destination, newFare.calltime)
+          dispatcher = self._dispatcherFor(newFare.origin)
+          if dispatcher is not None:
+             self._fareDispatchers[newFare] = dispatcher
+             dispatcher.newFare(self, newFare.origin, newFare.destination, newFare.calltime)
+             self.scheduleEvent(self._time, NetEvent.DISPATCHER_WAKEUP)
           self._fareQ[newFare.origin] = newFare
+          self._fareAdvised[newFare.origin] = set()
+          self.scheduleAbandonment(newFare)
           return newFare
 
+      # puts a waiting fare on the abandonment queue. The fare gives up at the first tick it has waited for
+      # longer than its maxWait; if that changes, calling this again reschedules it.
+      def scheduleAbandonment(self, fare):
+          abandonTime = math.floor(fare.calltime+fare.maxWait)+1
+          heapq.heappush(self._abandonQ, (abandonTime, next(self._abandonTieBreaker), fare.origin, fare))
+          self.scheduleEvent(abandonTime, NetEvent.FARE_ABANDON, (fare.origin, fare))
+
+      # pops the fares due to give up by now off the abandonment queue, and has their Nodes expire them
+      def _expireFares(self):
+          while len(self._abandonQ) > 0 and self._abandonQ[0][0] <= self._time:
+                abandonTime, tie, origin, fare = heapq.heappop(self._abandonQ)
+                # the fare may well have been collected (or abandoned) already
+                if origin in self._fareQ and self._fareQ[origin] is fare:
+                   self._net[origin].expireFare(self)
+
+      # hailFares gives every Node the chance to generate a new fare. Nodes with a fixed fare probability
+      # are all drawn against at once, with a single vector of uniform random numbers, so that only those
+      # which come up need any individual attention. Nodes with arbitrary generators are polled. (The random
+      # numbers are used in a different order from when each Node drew its own fares as it ticked, so a seeded
+      # run doesn't reproduce the fares it got before fares were drawn this way.)
+      def hailFares(self):
+          self._updateFareGenerators()
+          if len(self._fareNodes) > 0:
+             for nodeIdx in numpy.flatnonzero(self._rng.random(len(self._fareProbs)) < self._fareProbs):
+                 self._fareNodes[nodeIdx].hailFare(self, drawn=True)
+          for node in self._polledFareNodes:
+              node.hailFare(self)
+
+      # rebuilds the fare generation state if the map has changed since it was last built
+      def _updateFareGenerators(self):
+          if self._fareGenVersion != self._mapVersion:
+             self._fareNodes = [node for node in self._net.values() if node.canStop and node.fareProbability is not None]
+             self._fareProbs = numpy.array([node.fareProbability for node in self._fareNodes], dtype=float)
+             self._polledFareNodes = [node for node in self._net.values() if node.canStop and node.fareProbability is None]
+             self._stopNodes = [node for node in self._net.values() if node.canStop]
+             self._stopOrder = dict([(node, order) for order, node in enumerate(self._stopNodes)])
+             self._stopIds = numpy.array([self.nodeId(node.index) for node in self._stopNodes], dtype=numpy.int64)
+             self._destinationTables = {}
+             self._fareGenVersion = self._mapVersion
+
+      ''' _fareDestination draws a destination for a fare starting at origin: any other Node a fare can stop at,
+          either with equal probability or, with fareDestinations, weighted by its distance from the origin. Either
+          way a draw takes constant time. The uniform draw skips the origin by drawing from one fewer stopping
+          points and stepping over the origin's place among them.
+      '''
+      def _fareDestination(self, origin):
+          self._updateFareGenerators()
+          originOrder = self._stopOrder.get(origin)
+          stops = len(self._stopNodes) - (0 if originOrder is None else 1)
+          if stops <= 0:
+             raise ValueError("There is nowhere for a fare from {0} to go".format(origin.index))
+          if self.fareDestinations is None:
+             destination = int(self._rng.integers(stops))
+             if originOrder is not None and destination >= originOrder:
+                destination += 1
+             return self._stopNodes[destination]
+          if origin not in self._destinationTables:
+             originId = self.nodeId(origin.index)
+             if originId is None:
+                distances = self.distances(origin, self._stopNodes).tolist()
+             else:
+                distances = self._distanceRow(originId)[self._stopIds].tolist()
+             weights = numpy.array([self.fareDestinations(distance) for distance in distances], dtype=float)
+             if originOrder is not None:
+                weights[originOrder] = 0
+             self._destinationTables[origin] = AliasTable(weights)
+          return self._stopNodes[self._destinationTables[origin].sample(self._rng)]
+
       def removeFare(self, fare):
           # if the fare wasn't collected, inform the dispatcher that they abandoned
           if not fare.enroute:
-             if self._dispatcher is not None:
-                self._dispatcher.cancelFare(self,
-                                            fare.origin,
-                                            fare.destination,
-                                            fare.calltime)
+             self._stats['faresAbandoned'] += 1
+             dispatcher = self._fareDispatchers.pop(fare, None)
+             if dispatcher is not None:
+                dispatcher.cancelFare(self,
+                                      fare.origin,
+                                      fare.destination,
+                                      fare.calltime)
+          else:
+             self._carrying.add(fare.taxi)
           # both collected and abandoned fares disappear from the fare queue
           del self._fareQ[fare.origin]
+          self._fareAdvised.pop(fare.origin, None)
 
       '''methods generally called by Dispatchers
       '''
 
-      # broadcastFare is called by the Dispatcher, and issues a message to Taxis informing
-      # them of a fare from origin to destination with a given price
-      def broadcastFare(self, origin, destination, price):
+      # broadcastFare advertises a fare to the taxis. By default every on-duty taxi hears of it, but the
+      # broadcast can be geofenced: radius limits it to taxis within that distance of the origin by road, and
+      # nearest to that many of the taxis nearest the origin by road. Taxis already advised of the fare aren't
+      # told again, so a dispatcher that gets no bids can simply broadcast again more widely.
+      def broadcastFare(self, origin, destination, price, radius=None, nearest=None):
           # small chance the fare has already given up, if the Dispatcher took too long to get around
           # to announcing it. If so, inform the Dispatcher
           if origin not in self._fareQ or self._fareQ[origin].destination != destination:
              return 0
           # let the fare know the price
-          print("Fare broadcast at {0}, destination {1}, price {2}".format(origin,destination,price))
-          self._fareQ[origin].setPrice(price)
+          logger.info("Fare broadcast at %s, destination %s, price %s", origin, destination, price)
+          if self._fareQ[origin].price != price:
+             self._fareQ[origin].setPrice(price)
+          if radius is None and nearest is None:
+             taxis = self._taxis.keys()
+          else:
+             taxis = self._taxisNear(origin, radius, nearest)
+          advised = self._fareAdvised.setdefault(origin, set())
+          advice = {'origin': origin, 'destination': destination, 'price': price}
           onDuty = 0
           # inform the taxis,
-          for taxi in self._taxis.keys():
-              if taxi.onDuty:
+          for taxi in taxis:
+              if taxi.onDuty and taxi not in advised:
                  onDuty +=1
-                 taxi.recvMsg(taxi.FARE_ADVICE, **{'origin': origin, 'destination': destination, 'price': price})
-                 print("Taxi {0} alerted at {1}".format(taxi.number,taxi.currentLocation))
+                 advised.add(taxi)
+                 taxi.recvMsg(taxi.FARE_ADVICE, **advice)
+                 if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Taxi %s alerted at %s", taxi.number, taxi.currentLocation)
           # and return how many taxis were advised
           return onDuty
 
+      # the taxis within radius of origin by road and/or the nearest of them by road, nearest first. The taxi index
+      # offers up taxis in order of straight-line distance, which no road can be shorter than, so the search
+      # stops as soon as the taxis are too far away in a straight line to qualify. With nearest, only the best
+      # so far are kept, in a heap with the furthest of them on top (ties go to the taxi found first).
+      def _taxisNear(self, origin, radius=None, nearest=None):
+          if nearest is not None and nearest <= 0:
+             return []
+          pathTable = self.exportPathTable()
+          found = []
+          for order, (straightDistance, taxi) in enumerate(self._taxiIndex.byDistance(origin)):
+              if radius is not None and straightDistance > radius:
+                 break
+              if nearest is not None and len(found) >= nearest and straightDistance > -found[0][0]:
+                 break
+              roadDistance = pathTable.distance(self._taxiIndex.position(taxi), origin)
+              if roadDistance < 0 or (radius is not None and roadDistance > radius):
+                 continue
+              if nearest is None or len(found) < nearest:
+                 heapq.heappush(found, (-roadDistance, -order, taxi))
+              elif (roadDistance, order) < (-found[0][0], -found[0][1]):
+                 heapq.heapreplace(found, (-roadDistance, -order, taxi))
+          found.sort(key=lambda candidate: (-candidate[0], -candidate[1]))
+          return [candidate[2] for candidate in found]
+
       # allocateFare is called by the Dispatcher, and assigns a given fare to a given Taxi.
       def allocateFare(self, origin, taxi):
           # fare may have abandoned the attempt, while the taxi may have gone off-duty
@@ -529,7 +937,7 @@ class NetWorld:
              return False
           self._fareQ[origin].assignTaxi(taxi)
           taxi.recvMsg(taxi.FARE_ALLOC, **{'origin': origin, 'destination': self._fareQ[origin].destination})
-          print("Taxi {0} at {1} allocated fare at {2}".format(taxi.number,taxi.currentLocation,origin))
+          logger.info("Taxi %s at %s allocated fare at %s", taxi.number, taxi.currentLocation, origin)
 
                       
       # cancelFare is called by the Dispatcher when a fare abandons their request, and informs any allocated
@@ -549,7 +957,12 @@ class NetWorld:
       # completeFare is called by the taxi and registers the fare as conducted to the destination
       # which then assigns the fare's price to the Taxi and Dispatcher.
       def completeFare(self, fare):
-          self._dispatcher.recvPayment(self,fare.price*0.1)
+          self._stats['faresCompleted'] += 1
+          self._stats['fareRevenue'] += fare.price
+          self._carrying.discard(fare.taxi)
+          dispatcher = self._fareDispatchers.pop(fare, self._dispatcher)
+          if dispatcher is not None:
+             dispatcher.recvPayment(self,fare.price*0.1)
           fare.taxi.recvMsg(fare.taxi.FARE_PAY, **{'amount': fare.price*0.9})
           # get rid of the fare's taxi allocation so that garbage collection doesn't have to worry
           # about back pointers. The taxi itself should already have got rid of the fare in the
@@ -559,75 +972,277 @@ class NetWorld:
       # transmitFareBid is called by the taxi and notifies the Dispatcher that it it is willing
       # to accept the fare. It also notifies the Dispatcher of the taxi's location.
       def transmitFareBid(self, origin, taxi):
-          self._dispatcher.fareBid(origin, taxi)
+          dispatcher = self._dispatcherFor(origin)
+          if dispatcher is not None:
+             # a taxi bidding from another zone introduces itself to this zone's dispatcher
+             if dispatcher is not self._dispatcher:
+                dispatcher.addTaxi(taxi)
+             dispatcher.fareBid(origin, taxi)
 
       #----------------------------------------------------------------------------------------------------------------
                  
       # runWorld operates the model. It can be run in single-stepping mode (ticks = 1), batch mode
       # (ticks = 0) or any number of step-aggregation modes (ticks > 1). In batch mode, live output
       # may be unreliable, if running in a separate thread.
+      # outputs is where to record what happens: a dict, or a recorder (see the recorder module).
       def runWorld(self,ticks=0,outputs=None):
-          if outputs is None:
-             outputs = {}
+          outputs = asRecorder(outputs)
+          # stepping tick by tick needs no schedule. If the event engine had one, it is dropped: fare arrivals
+          # are memoryless, so the engine can simply schedule them afresh if it takes over again.
+          self._eventQ = None
           ticksRun = 0
           while (ticks == 0 or ticksRun < ticks) and (self.runTime == 0 or self._time < self.runTime):
-                print("Current time in the simulation world: {0}".format(self._time))
-                if 'time' in outputs:
-                   outputs['time'].append(self._time)
-                # really simple recording of fares: just where there are fares still waiting. More
-                # sophisticated recording including price information and enroute fare information,
-                # could easily be added, e.g. by making the fare output a list of fare objects.
-                if 'fares' in outputs:
-                   for fare in self._fareQ.values():
-                       if fare.origin in outputs['fares']:
-                          outputs['fares'][fare.origin][self._time] = fare.calltime
-                       else:
-                          outputs['fares'][fare.origin] = {self._time: fare.calltime}
-                # go through all the nodes and update the time tick
-                for node in self._net.values():
-                    node.clockTick(self)
-                    # we can output live traffic information if we want. Or possibly other
-                    # parameters of a node, depending on how much reporting is desirable. (With
-                    # very large networks and lots of reporting, this could slow things considerably)                   
-                    if 'nodes' in outputs:
-                        if node.index in outputs['nodes']:
-                           outputs['nodes'][node.index][self._time] = node.traffic
-                        else:
-                           outputs['nodes'][node.index] = {self._time: node.traffic}
-                # next go through the (live) taxis
-                for taxi in self._taxis.items():
-                    if taxi[0].onDuty:
-                       taxi[0].drive(taxi[1][1])
-                       taxi[0].clockTick(self)
-                       # similarly basic recording of taxis: just their current position, as long as they
-                       # are on duty. 
-                       if 'taxis' in outputs:
-                          # taxi[1][0][0] is taxi[admission_request][current_pose][current_node] where
-                          # current_pose is a (node, direction) pair. So this is just asking: is the taxi
-                          # somewhere in the world?
-                          if taxi[1][0][0] is not None:
-                             if taxi[0].number in outputs['taxis']:
-                                # outputs['taxis'][taxi[0].number][self._time] = taxi[0].currentLocation
-                                outputs['taxis'][taxi[0].number][self._time] = taxi[1][0][0].index
-                             else:
-                                # outputs['taxis'][taxi[0].number] = {self._time: taxi[0].currentLocation}
-                                outputs['taxis'][taxi[0].number] = {self._time: taxi[1][0][0].index}
-                    # an off-duty taxi can come on if it decides to (and will call addTaxi to add itself)
-                    else:
-                       taxi[0].comeOnDuty(self._time)
-                # then run the dispatcher. With this ordering, taxis bidding for fares can always get
-                # them allocated immediately (provided the dispatcher decides to do so). Taxis always
-                # receive notice of potential fares for collection one clock after the fare first appeared
-                # to the dispatcher. We can make this fully asynchronous if we wish with an event queue.
-                if self._dispatcher is not None:
-                   self._dispatcher.clockTick(self)
-                # new traffic arrives last. Since we flow old traffic out of Nodes first, this gives
-                # taxis the best chance to reach a Node, they shouldn't be helplessly stuck whilst
-                # traffic flows around them.
-                for node in self._trafficQ.items():
-                    self._trafficQ[node[0]] -= self._net[node[0]].injectTraffic(self, node[1])
-                # update the batch stepper
-                self._time += 1
-                ticksRun +=1                
-
- 
+                self._tick(outputs)
+                ticksRun +=1
+
+      ''' runEvents is the discrete-event alternative to runWorld, with the same arguments (here ticks counts
+          time steps of simulated time, however many are actually stepped through). Whenever the world is
+          quiescent - no active Nodes, no traffic on the move, an idle Dispatcher and idle or off-duty Taxis -
+          time jumps straight to the next thing that can happen: an event on the queue, an idle taxi running
+          out of money or an off-duty one coming back. Taxis and the Dispatcher are still clock-driven agents,
+          so as soon as any of them has something to do, the world steps a tick at a time exactly as runWorld
+          does. Fares at nodes with a fixed probability arrive as scheduled events (a geometric waiting time
+          between draws is the same process as drawing at every tick), so results are statistically the same
+          as runWorld's, while quiet periods cost next to nothing. Nodes with arbitrary fare generators have to
+          be polled every tick, so a world with any of those never gets to skip ahead.
+      '''
+      def runEvents(self,ticks=0,outputs=None):
+          outputs = asRecorder(outputs)
+          if self._eventQ is None:
+             self._eventQ = NetEventQueue()
+          endTime = None
+          if ticks > 0:
+             endTime = self._time + ticks
+          if self.runTime > 0 and (endTime is None or self.runTime < endTime):
+             endTime = self.runTime
+          while endTime is None or self._time < endTime:
+                # fare arrivals need (re)scheduling whenever the map has changed
+                if self._arrivalVersion != self._mapVersion:
+                   self._scheduleFareArrivals()
+                if self._quiescent():
+                   wakeTimes = [wakeTime for wakeTime in (self._quietHorizon(), endTime) if wakeTime is not None]
+                   # nothing will ever happen again, and there's no end to wait for
+                   if len(wakeTimes) == 0:
+                      return
+                   if min(wakeTimes) > self._time:
+                      self._skipTicks(min(wakeTimes)-self._time, outputs)
+                      continue
+                self._tick(outputs, eventDriven=True)
+
+      # _tick runs a single time step of the world: record the outputs, bring in new fares, then tick the
+      # (active) nodes, the taxis and the dispatcher in turn, and finally flow in new traffic.
+      def _tick(self, outputs, eventDriven=False):
+          logger.info("Current time in the simulation world: %s", self._time)
+          if 'time' in outputs:
+             outputs.recordTime(self._time)
+          # really simple recording of fares: just where there are fares still waiting. More
+          # sophisticated recording including price information and enroute fare information,
+          # could easily be added, e.g. by making the fare output a list of fare objects.
+          if 'fares' in outputs:
+             outputs.recordFares(self._time, self._fareQ.values())
+          # new fares appear. In the event engine, they (and any other events due now) come off the event queue.
+          if eventDriven:
+             self._fireEvents()
+          else:
+             self.hailFares()
+          # go through the active nodes and update the time tick. Idle nodes have nothing to do, so
+          # there's no need to visit them; a node that has become idle drops out of the active set.
+          if self._nodeOrderVersion != self._mapVersion:
+             self._nodeOrder = dict([(node, order) for order, node in enumerate(self._net.values())])
+             self._nodeOrderVersion = self._mapVersion
+          # (a node replaced in the map may still be hanging around in the active set) 
+          self._activeNodes.intersection_update(self._nodeOrder.keys())
+          # with a traffic engine, the engine flows all the traffic first, and the Nodes are given their
+          # traffic as it would be at each stage of their own clockTick
+          trafficEngine = self._currentTrafficEngine()
+          engineNodes = []
+          if trafficEngine is not None:
+             trafficEngine.flow()
+             engineNodes = self._setTraffic(trafficEngine.changes(FLOWED))
+          tickedNodes = sorted(self._activeNodes, key=self._nodeOrder.__getitem__)
+          for node in tickedNodes:
+              node.clockTick(self, flowTraffic=trafficEngine is None)
+              if node.settle(self):
+                 self._activeNodes.discard(node)
+          if trafficEngine is not None:
+             engineNodes.extend(self._setTraffic(trafficEngine.changes(SOURCED)))
+          # fares that have waited too long give up. Only those that are due come off the queue, so nodes
+          # with a fare waiting don't need ticking just to check on it.
+          self._expireFares()
+          # we can output live traffic information if we want. Or possibly other
+          # parameters of a node, depending on how much reporting is desirable. Traffic in a
+          # node only changes when it is ticked or has traffic flowed into it, so a recorder
+          # that can make use of it is told which nodes those were.
+          self._noteTrafficChanges(tickedNodes+engineNodes+self._injectedNodes)
+          if 'nodes' in outputs:
+             outputs.recordNodes(self._time, self._net.values(), self._trafficChanges, self._mapVersion)
+          # next go through the (live) taxis
+          for taxi in self._taxis.items():
+              if taxi[0].onDuty:
+                 self._stats['taxiTicks'] += 1
+                 if taxi[0] in self._carrying:
+                    self._stats['carryingTicks'] += 1
+                 taxi[0].drive(taxi[1][1])
+                 taxi[0].clockTick(self)
+                 # a taxi going off duty has to be cleared out of its node
+                 if not taxi[0].onDuty:
+                    self._taxiIndex.remove(taxi[0])
+                    if taxi[1][0][0] is not None:
+                       self.activateNode(taxi[1][0][0])
+                 # similarly basic recording of taxis: just their current position, as long as they
+                 # are on duty. 
+                 if 'taxis' in outputs:
+                    # taxi[1][0][0] is taxi[admission_request][current_pose][current_node] where
+                    # current_pose is a (node, direction) pair. So this is just asking: is the taxi
+                    # somewhere in the world?
+                    if taxi[1][0][0] is not None:
+                       outputs.recordTaxi(self._time, taxi[0].number, taxi[1][0][0])
+              # an off-duty taxi can come on if it decides to (and will call addTaxi to add itself)
+              else:
+                 taxi[0].comeOnDuty(self._time)
+          # then run the dispatcher. With this ordering, taxis bidding for fares can always get
+          # them allocated immediately (provided the dispatcher decides to do so). Taxis always
+          # receive notice of potential fares for collection one clock after the fare first appeared
+          # to the dispatcher. We can make this fully asynchronous if we wish with an event queue.
+          # With zones, each zone's dispatcher runs in turn.
+          for dispatcher in self.dispatchers:
+              dispatcher.clockTick(self)
+          # new traffic arrives last. Since we flow old traffic out of Nodes first, this gives
+          # taxis the best chance to reach a Node, they shouldn't be helplessly stuck whilst
+          # traffic flows around them.
+          if trafficEngine is not None:
+             self._injectedNodes = self._setTraffic(trafficEngine.changes(ARRIVED))
+          else:
+             self._injectedNodes = [self._net[node[0]] for node in self._trafficQ.items() if node[1] != 0]
+             for node in self._trafficQ.items():
+                 self._trafficQ[node[0]] -= self._net[node[0]].injectTraffic(self, node[1])
+          # update the batch stepper
+          self._time += 1
+
+      # the world is quiescent if nothing in it would change by ticking it, beyond idle taxis' running costs
+      def _quiescent(self):
+          if len(self._activeNodes) > 0 or len(self._polledFareNodes) > 0:
+             return False
+          if any(volume > 0 for volume in self._trafficQ.values()):
+             return False
+          if self._trafficEngine is not None and self._trafficEngine.busy:
+             return False
+          if any(not dispatcher.idle for dispatcher in self.dispatchers):
+             return False
+          try:
+              next(taxi for taxi in self._taxis.keys() if taxi.onDuty and not taxi.idle)
+              return False
+          except StopIteration:
+              return True
+
+      # _quietHorizon gives the earliest time at which a quiescent world might stop being quiescent: the next
+      # event, an idle taxi running out of money (and so going off duty), or an off-duty taxi returning.
+      # None means never.
+      def _quietHorizon(self):
+          wakeTimes = [self._eventQ.nextTime()]
+          for taxi in self._taxis.keys():
+              if taxi.onDuty:
+                 wakeTimes.append(self._time + taxi.idleTicks)
+              else:
+                 wakeTimes.append(taxi.nextDutyTime(self._time))
+          wakeTimes = [wakeTime for wakeTime in wakeTimes if wakeTime is not None]
+          if len(wakeTimes) == 0:
+             return None
+          return min(wakeTimes)
+
+      # _skipTicks jumps a quiescent world forward. All that happens meanwhile is that idle taxis pay their
+      # running costs, and the outputs record the (unchanging) state at every skipped time step.
+      def _skipTicks(self, ticks, outputs):
+          logger.info("Nothing happening in the simulation world until %s", self._time+ticks)
+          onDuty = [taxi for taxi in self._taxis.items() if taxi[0].onDuty]
+          for taxi in onDuty:
+              taxi[0].idleFor(ticks)
+          self._stats['taxiTicks'] += ticks*len(onDuty)
+          # the traffic flowed in at the end of the last tick is the only change there will be
+          self._noteTrafficChanges(self._injectedNodes)
+          for time in range(self._time, self._time+ticks):
+              if 'time' in outputs:
+                 outputs.recordTime(time)
+              if 'nodes' in outputs:
+                 outputs.recordNodes(time, self._net.values(), self._trafficChanges, self._mapVersion)
+                 self._trafficChanges = []
+              if 'taxis' in outputs:
+                 for taxi in onDuty:
+                     if taxi[1][0][0] is not None:
+                        outputs.recordTaxi(time, taxi[0].number, taxi[1][0][0])
+          self._injectedNodes = []
+          self._trafficChanges = []
+          self._time += ticks
+
+      # the traffic engine, if the Nodes don't flow the traffic themselves, (re)built for the current map. Traffic
+      # still waiting to get into Nodes carries over to the new engine.
+      def _currentTrafficEngine(self):
+          if not self._vectorTraffic:
+             return None
+          if self._trafficEngineVersion != self._mapVersion:
+             if self._trafficEngine is not None:
+                self._trafficQ = self._trafficEngine.pending()
+             self._trafficEngine = TrafficArrays(self._net.values(), self._trafficQ)
+             self._trafficEngineVersion = self._mapVersion
+             self._trafficQ = {}
+          return self._trafficEngine
+
+      # gives Nodes the traffic the engine has worked out for them, from a list of (Node, traffic) pairs, and
+      # returns the Nodes
+      def _setTraffic(self, changes):
+          for node, traffic in changes:
+              node.setTraffic(self, traffic)
+          return [change[0] for change in changes]
+
+      # lets go of the traffic engine, if there is one, taking back the traffic still waiting to get into
+      # Nodes. The engine is built again if the world is run again.
+      def close(self):
+          if self._trafficEngine is not None:
+             self._trafficQ = self._trafficEngine.pending()
+             self._trafficEngine = None
+             self._trafficEngineVersion = -1
+
+      # works out which of the candidate Nodes (those that might have changed) actually have different
+      # traffic from when they were last looked at, and makes them the current time step's traffic changes
+      def _noteTrafficChanges(self, candidates):
+          self._trafficChanges = []
+          for node in candidates:
+              if node.traffic != self._trafficLevels.get(node, 0):
+                 self._trafficLevels[node] = node.traffic
+                 self._trafficChanges.append(node)
+
+      # schedules the next fare arrival at every node with a fixed fare probability, from the current time.
+      # Drawing whether a fare appears at each tick with probability p is the same as waiting a geometrically
+      # distributed number of ticks between draws that come up.
+      def _scheduleFareArrivals(self):
+          self._updateFareGenerators()
+          self._arrivalVersion = self._mapVersion
+          for node in self._fareNodes:
+              self._scheduleFareArrival(node, self._time-1)
+
+      def _scheduleFareArrival(self, node, lastDraw):
+          if node.fareProbability > 0:
+             self._eventQ.push(lastDraw + self._rng.geometric(node.fareProbability),
+                               NetEvent.FARE_ARRIVAL, node, self._arrivalVersion)
+
+      # _fireEvents handles the events due at the current time. Most events just make sure the engine stops
+      # at the right time for the (clock-driven) agents concerned; fare arrivals and abandonments act directly.
+      def _fireEvents(self):
+          # nodes with arbitrary fare generators can't be scheduled, so still get polled every tick
+          for node in self._polledFareNodes:
+              node.hailFare(self)
+          dueEvents = self._eventQ.popDue(self._time)
+          # arrivals go first: as when stepping tick by tick, a node can't get a new fare in the same tick its
+          # old one abandons
+          for event in dueEvents:
+              # (stale arrivals from before a map change are ignored)
+              if event.kind == NetEvent.FARE_ARRIVAL and event.version == self._arrivalVersion:
+                 event.subject.hailFare(self, drawn=True)
+                 self._scheduleFareArrival(event.subject, self._time)
+          # (abandonments only need the engine to stop at the right tick: the abandonment queue deals with them)
+
+      # scheduleEvent puts an event on the event engine's queue. When the world is being run tick by tick
+      # there is no schedule, and this does nothing.
+      def scheduleEvent(self, time, kind, subject=None):
+          if self._eventQ is not None:
+             self._eventQ.push(time, kind, subject)
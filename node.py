@@ -1,5 +1,25 @@
 import numpy
 import inspect
+import logging
+
+from netevent import NetEvent
+
+logger = logging.getLogger(__name__)
+
+'''
+A fareRate is a fare probability generator with a fixed chance of a fare appearing at each
+time step. It can be used anywhere a fare probability callable is expected, but because the
+probability is known, Nodes draw for it from their world's own random generator rather than the
+global numpy.random state, so that seeded worlds are reproducible.
+'''
+class fareRate:
+
+      def __init__(self, probability):
+          self.probability = probability
+
+      # called stand-alone, a fareRate behaves just like the equivalent lambda
+      def __call__(self, t):
+          return numpy.random.random() < self.probability
 
 '''
 A Node represents any reachable point in the RoboUber world. Nodes can be thought of as lying on a
@@ -42,6 +62,7 @@ class Node:
           self._capacity = capacity                # max number of taxis that can be in this point 
           self._occupied = {}                      # dictionary of taxis at this point, indexed by current direction
           self._incoming = {}                      # dictionary of taxis attempting to enter this point
+          self._waiting = {}                       # taxis queued behind those, by direction, in order of indication
           self._traffic_light = 0                  # priority management for access. Indexes the direction with first priority
           self._trafficMax = traffic_cap           # _traffic point where the Node becomes locked
           self._trafficSrc = traffic_in            # amount of traffic automatically generated coming in per clock
@@ -55,14 +76,23 @@ class Node:
           # sides before becoming overloaded)
           if self._trafficMax == 0:            
              self._trafficMax = 8
+          # a fixed per-tick fare probability, where one is known. The world draws fares for all such Nodes
+          # in bulk, so they need no generator of their own; only arbitrary generators are polled individually.
+          self._fareProb = None
           # default fare generator just randomly produces a new fare with probability given by the size of the network
           if self._fare_generator is None:
              if self._parent.size == 0:
                 # 1/1000 chance if there is no information on network size (approximately 1 call per day)
-                self._fare_generator = lambda t: numpy.random.random() > 0.999
-             else:
-                # otherwise default probability would generate on average 1 call every 100 minutes for the service area
-                self._fare_generator = lambda q: numpy.random.random() > 1 - 1/(10*self._parent.size())
+                self._fareProb = 0.001
+             # otherwise default probability would generate on average 1 call every 100 minutes for the service
+             # area. This is left as None and worked out from the current network size when asked for.
+          # fixed-rate generators likewise only need their probability
+          elif isinstance(self._fare_generator, fareRate):
+             self._fareProb = self._fare_generator.probability
+             self._fare_generator = None
+          # a traffic source always has something to do
+          if self._trafficSrc > 0:
+             self._wake()
 
       # properties of the Node that other objects can see
       
@@ -78,6 +108,30 @@ class Node:
       def haveSpace(self):
           return self._traffic < self._trafficMax
 
+      # the probability of a fare appearing here at each time step, or None if fares come from an
+      # arbitrary generator the world can't see inside.
+      @property
+      def fareProbability(self):
+          if self._fare_generator is not None:
+             return None
+          if self._fareProb is None:
+             return 1/(10*self._parent.size)
+          return self._fareProb
+
+      # an idle Node has nothing to do at the next time step: no traffic to flow or generate, no taxis waiting
+      # to get in, and no off-duty taxis to clear out. (On-duty taxis parked here need nothing from the Node;
+      # the world wakes it up if one goes off duty. Nor does a waiting fare: the world's abandonment queue
+      # tells the Node when the fare gives up.)
+      @property
+      def idle(self):
+          if self._traffic > 0 or self._trafficSrc != 0 or len(self._incoming) > 0:
+             return False
+          try:
+              next(occupant for occupant in self._occupied.values() if not occupant[0].onDuty)
+              return False
+          except StopIteration:
+              return True
+
       @property
       def index(self):
           return self._idx
@@ -105,6 +159,15 @@ class Node:
       def traffic(self):
           return self._traffic
 
+      # the traffic generated in the Node, and removed from it as traffic flows out, at each time step
+      @property
+      def trafficIn(self):
+          return self._trafficSrc
+
+      @property
+      def trafficOut(self):
+          return -self._trafficSink
+
       # methods generally called by the parent world
 
       # adds an adjoining node. Used in building the graph
@@ -116,14 +179,15 @@ class Node:
           should be called by the Node's parent; there is a check that the calling object is
           indeed the parent. Within the timer tick the following things happen: taxis in the 
           incoming list are scheduled for access; traffic is flowed through (if traffic in 
-          neighbouring Nodes is not blocking); and fares appear or disappear (the latter if
-          it has been waiting too long)
+          neighbouring Nodes is not blocking); and a waiting fare disappears if it has been
+          waiting too long (fares appear beforehand, through hailFare). flowTraffic False
+          leaves the traffic alone, for a world that flows it some other way (see setTraffic).
       '''     
-      def clockTick(self, parent):
+      def clockTick(self, parent, flowTraffic=True):
           if self._parent == parent:
              # flow through traffic first, to give the node the best chance of allowing taxis in
              for neighbour in self._neighbours:
-                 if neighbour is not None and neighbour.haveSpace and self._traffic > 0:
+                 if flowTraffic and neighbour is not None and neighbour.haveSpace and self._traffic > 0:
                     self._parent.addTraffic(neighbour)
                     self._traffic -= 1
                     self.injectTraffic(self._parent,self._trafficSink)
@@ -132,6 +196,12 @@ class Node:
              offDuty = [taxi for taxi in self._occupied.items() if not taxi[1][0].onDuty]
              for taxi in offDuty:
                  del self._occupied[taxi[0]]
+             # and neither should off-duty taxis waiting to come in hold up those behind them
+             offDuty = [(direction, taxi) for direction, taxi in self._incoming.items() if not taxi.onDuty]
+             offDuty.extend([(direction, taxi) for direction, waiting in self._waiting.items()
+                             for taxi in waiting if not taxi.onDuty])
+             for taxi in offDuty:
+                 self.abandon(taxi[0], taxi[1])
              # now deal with admitting taxis
              if len(self._incoming) > 0 and self._traffic < self._trafficMax and len(self._occupied) <= self._capacity:
                 remaining = self._capacity - len(self._occupied)
@@ -145,18 +215,39 @@ class Node:
                       admitted[self._traffic_light] = self._incoming[self._traffic_light]
                       remaining -= 1
                 self._parent.admitTaxi(self, admitted)
-             # next deal with new fares appearing or abandoning
-             if self._fare is not None:
-                # fares won't wait forever for a ride
-                if self._parent.simTime-self._fare.calltime > self._fare.maxWait:
-                   self._parent.removeFare(self._fare)
-                   self._fare = None
-             # and will only hail a taxi in allowed stopping locations
-             elif self._canStop:
-                if self._fare_generator(self._parent.simTime):
-                   self._fare = self._parent.insertFare(self)
+             # (new fares appear through hailFare, and abandon through expireFare, which the world calls when
+             # they are due to)
              # last thing to do is inject intrinsic traffic
-             self.injectTraffic(self._parent,self._trafficSrc)
+             if flowTraffic:
+                self.injectTraffic(self._parent,self._trafficSrc)
+
+      # fares won't wait forever for a ride. Called by the world when the waiting fare is due to give up;
+      # returns True if it did.
+      def expireFare(self, parent):
+          if self._parent == parent and self._fare is not None:
+             if self._parent.simTime-self._fare.calltime > self._fare.maxWait:
+                self._parent.removeFare(self._fare)
+                self._fare = None
+                return True
+          return False
+
+      # called by the parent after clockTick. An idle Node drops out of the world's active set, and
+      # is not ticked again until something (traffic, a taxi, a fare) wakes it up.
+      def settle(self, parent):
+          return self._parent == parent and self.idle
+
+      # puts the Node back in the world's active set when it gains something to do
+      def _wake(self):
+          self._parent.activateNode(self)
+
+      # called by the parent at each time step, before clockTick, to let a new fare appear. For Nodes with a
+      # fixed fare probability the world has already made the draw (in bulk, for all of them at once) and
+      # passes drawn=True if it came up; other Nodes consult their own generator. A Node only ever has one fare
+      # waiting at a time, and fares will only hail a taxi in allowed stopping locations.
+      def hailFare(self, parent, drawn=False):
+          if self._parent == parent and self._fare is None and self._canStop:
+             if drawn or (self._fare_generator is not None and self._fare_generator(self._parent.simTime)):
+                self._fare = self._parent.insertFare(self)
 
       # the world can interrogate the node for a given taxi to see if it is physically there.
       def hasTaxi(self, parent, taxi):
@@ -179,9 +270,20 @@ class Node:
              if self._traffic > self._trafficMax:
                 excess = self._traffic - self._trafficMax
                 self._traffic = self._trafficMax
+                self._wake()
                 return volume-excess
+             if self._traffic > 0:
+                self._wake()
              return volume
 
+      # sets the Node's traffic outright, for a world that works out the flow of traffic itself, rather
+      # than leaving each Node to flow its own
+      def setTraffic(self, parent, traffic):
+          if self._parent == parent:
+             self._traffic = traffic
+             if self._traffic > 0:
+                self._wake()
+
       # methods generally called by Taxis. Almost all of these are automated into the Taxi
       # machinery.
 
@@ -245,14 +347,33 @@ class Node:
           return self.turn(directionIn)
 
       # indicate requests access to the Node. direction is the incoming direction
-      # as seen from the Node.
+      # as seen from the Node. Only one taxi per direction can be waiting for admission;
+      # any others indicating the same direction queue behind it, in turn, rather than
+      # displacing it.
       def indicate(self, direction, occupant):
-          self._incoming[direction] = occupant
+          if direction not in self._incoming:
+             self._incoming[direction] = occupant
+          elif self._incoming[direction] != occupant and occupant not in self._waiting.get(direction, []):
+             self._waiting.setdefault(direction, []).append(occupant)
+          self._parent.registerIndication(self, direction, occupant)
+          self._wake()
 
       # abandon turns off an existing indication (e.g. if the taxi waited too long to gain admission)    
       def abandon(self, direction, occupant):
-          if self._incoming[direction] == occupant:
+          if self._incoming.get(direction) == occupant:
              del self._incoming[direction]
+             self._nextIncoming(direction)
+          elif occupant in self._waiting.get(direction, []):
+             self._waiting[direction].remove(occupant)
+             if len(self._waiting[direction]) == 0:
+                del self._waiting[direction]
+
+      # the next taxi queued in a direction (if any) becomes the one waiting for admission
+      def _nextIncoming(self, direction):
+          if direction in self._waiting:
+             self._incoming[direction] = self._waiting[direction].pop(0)
+             if len(self._waiting[direction]) == 0:
+                del self._waiting[direction]
 
       # claims the space. A vehicle can only occupy an available space.
       def occupy(self, direction, occupant, origin=None):
@@ -265,10 +386,12 @@ class Node:
           if (len(self._occupied) == self._capacity or direction in self._occupied or
               direction not in self._incoming or self._incoming[direction] != occupant
               or time2Occupy < 0):
-             print ("Taxi {0} can't occupy node: full".format(occupant.number))
+             logger.debug("Taxi %s can't occupy node: full", occupant.number)
              return (None, -1)
           self._occupied[direction] = (occupant,self._parent.simTime+time2Occupy)
+          self._parent.scheduleEvent(self._parent.simTime+time2Occupy, NetEvent.TAXI_ARRIVAL, (occupant,self))
           del self._incoming[direction]
+          self._nextIncoming(direction)
           self._parent.clearAdmission(self,occupant) #BUGFIX clear from parent
           return (self, direction)
 
@@ -0,0 +1,124 @@
+import collections
+import heapq
+import itertools
+import numpy
+
+'''
+A PathTable answers shortest-route queries over a service map by table lookup: for a destination, it holds
+the shortest distance to it from every node in the map, and the next step to take from each node on the
+way there, so that distance is O(1) and a complete path takes one lookup per node along it. Rows of the
+table - one per destination - are worked out when first asked for, with a single Dijkstra search backwards
+from the destination, and remembered (up to cachedRows of them, the least recently used making way), which
+is worthwhile because maps are static for a run while routes to the same few places - fares' origins and
+destinations - are asked for constantly. Building the whole table up front would take time cubic in the
+size of the map, and memory quadratic, which big maps can't afford. The service map is the nested dict
+NetWorld.exportMap produces: {(x,y): {(neighbourx,neighboury): (direction, distance)}}.
+
+Nodes are numbered in the map's order; nodes gives the (x,y) index for each number and distances is
+the full (read-only) matrix of shortest distances, numpy.inf where there is no path at all.
+'''
+class PathTable:
+
+      # at most this many destinations' rows are kept at a time; a row takes 12 bytes for every node in the map
+      cachedRows = 512
+
+      def __init__(self, serviceMap):
+          self._nodes = list(serviceMap.keys())
+          self._ids = dict([(node, nodeId) for nodeId, node in enumerate(self._nodes)])
+          # the links into each node, as {from node id: distance}, keeping only the shortest of any parallel links.
+          # Links out of the map lead nowhere we know about.
+          self._incoming = [{} for node in self._nodes]
+          for node, neighbours in serviceMap.items():
+              origin = self._ids[node]
+              for neighbour, link in neighbours.items():
+                  if neighbour in self._ids:
+                     incoming = self._incoming[self._ids[neighbour]]
+                     if link[1] < incoming.get(origin, numpy.inf):
+                        incoming[origin] = link[1]
+          # destination id -> (distances to it, next hops towards it), most recently used at the end
+          self._rows = collections.OrderedDict()
+
+      def __contains__(self, node):
+          return node in self._ids
+
+      def __len__(self):
+          return len(self._nodes)
+
+      @property
+      def nodes(self):
+          return self._nodes
+
+      # the full matrix, distances[origin id, destination id]. This needs every row, so only ask for it on small maps.
+      @property
+      def distances(self):
+          size = len(self._nodes)
+          distances = numpy.array([self._row(destination)[0] for destination in range(size)]).reshape(size, size).T
+          distances.flags.writeable = False
+          return distances
+
+      # the row for a destination id, searching for it if it isn't already there
+      def _row(self, destination):
+          row = self._rows.get(destination)
+          if row is not None:
+             self._rows.move_to_end(destination)
+             return row
+          size = len(self._nodes)
+          distances = [numpy.inf]*size
+          nextHops = [-1]*size
+          distances[destination] = 0
+          nextHops[destination] = destination
+          # Dijkstra, backwards along the links from the destination. Entries with equal distances come off in the
+          # order they were pushed, so the routes are deterministic.
+          tieBreaker = itertools.count()
+          frontier = [(0, next(tieBreaker), destination)]
+          while len(frontier) > 0:
+                distance, tie, node = heapq.heappop(frontier)
+                if distance > distances[node]:
+                   continue
+                for previous, length in self._incoming[node].items():
+                    if distance+length < distances[previous]:
+                       distances[previous] = distance+length
+                       nextHops[previous] = node
+                       heapq.heappush(frontier, (distance+length, next(tieBreaker), previous))
+          row = (numpy.array(distances, dtype=numpy.float64), numpy.array(nextHops, dtype=numpy.int32))
+          for array in row:
+              array.flags.writeable = False
+          self._rows[destination] = row
+          if len(self._rows) > self.cachedRows:
+             self._rows.popitem(last=False)
+          return row
+
+      # length of the shortest path from origin to destination, -1 if either is not in the map or there is no
+      # path between them (the same convention as NetWorld.distance2Node)
+      def distance(self, origin, destination):
+          if origin not in self._ids or destination not in self._ids:
+             return -1
+          distance = self._row(self._ids[destination])[0][self._ids[origin]]
+          if distance == numpy.inf:
+             return -1
+          return float(distance)
+
+      # the next node to go to on the way from origin to destination, None if there is no way
+      def nextHop(self, origin, destination):
+          if origin not in self._ids or destination not in self._ids:
+             return None
+          nextHop = self._row(self._ids[destination])[1][self._ids[origin]]
+          if nextHop < 0:
+             return None
+          return self._nodes[nextHop]
+
+      # the shortest path from origin to destination as a list of nodes, starting with origin and ending with
+      # destination, with every node along the way (as Taxi paths have it). None if there is no way.
+      def path(self, origin, destination):
+          if origin not in self._ids or destination not in self._ids:
+             return None
+          here = self._ids[origin]
+          there = self._ids[destination]
+          nextHops = self._row(there)[1]
+          if nextHops[here] < 0:
+             return None
+          path = [origin]
+          while here != there:
+                here = nextHops[here]
+                path.append(self._nodes[here])
+          return path
@@ -0,0 +1,255 @@
+import collections.abc
+import numpy
+
+'''
+Recorders take down what happens in a NetWorld as it runs: runWorld and runEvents hand each time
+step's state to whatever recorder they are given as outputs. There are two kinds:
+
+DictRecorder is the original recording scheme - nested dicts keyed by object, then by time step,
+e.g. outputs['taxis'][number][time] - wrapped around a plain dict the caller supplies. It is what
+the world uses when outputs is a dict, so code that passes dicts in keeps working unchanged.
+
+OutputRecorder keeps the same information in preallocated numpy arrays, one row per time step:
+taxi positions as an int array of shape (T, n_taxis, 2), node traffic as (T, n_nodes), and waiting
+fares as an append-only record array. That costs a few array stores per tick rather than a dict
+entry per object per tick, and node traffic only needs reading for nodes that may have changed,
+so recording even a big map's traffic is cheap. An OutputRecorder can also be read as if it were
+the old outputs dict (see its Mapping methods), which is how the RoboUber display consumes it.
+
+Both support the same recording interface:
+recorder[kind]/kind in recorder - whether the kind of output ('time', 'fares', 'nodes', 'taxis')
+is being recorded at all
+recordTime(time) - starts a new time step
+recordFares(time, fares) - the fares waiting at this time step
+recordNodes(time, nodes, changed, version) - the traffic in every node. changed lists the nodes whose
+traffic may have changed since the previous time step and version is the world's map version: as long
+as the map has not changed, only the changed nodes need looking at.
+recordTaxi(time, number, node) - the node an on-duty taxi is in
+'''
+
+# wraps outputs in a DictRecorder, unless it is a recorder already
+def asRecorder(outputs):
+   if outputs is None:
+      return DictRecorder({})
+   if isinstance(outputs, (DictRecorder, OutputRecorder)):
+      return outputs
+   return DictRecorder(outputs)
+
+'''
+DictRecorder records into a dict holding any of the keys 'time' (a list of time steps), 'fares'
+(fare origin -> {time: call time}), 'nodes' (node index -> {time: traffic}) and 'taxis' (taxi
+number -> {time: node index}). Only the kinds of output whose keys are present are recorded.
+'''
+class DictRecorder:
+
+      def __init__(self, outputs):
+          self.outputs = outputs
+
+      def __contains__(self, kind):
+          return kind in self.outputs
+
+      def recordTime(self, time):
+          self.outputs['time'].append(time)
+
+      def recordFares(self, time, fares):
+          for fare in fares:
+              if fare.origin in self.outputs['fares']:
+                 self.outputs['fares'][fare.origin][time] = fare.calltime
+              else:
+                 self.outputs['fares'][fare.origin] = {time: fare.calltime}
+
+      # dicts keep every node at every time step, so changed can't save anything here
+      def recordNodes(self, time, nodes, changed=None, version=None):
+          for node in nodes:
+              if node.index in self.outputs['nodes']:
+                 self.outputs['nodes'][node.index][time] = node.traffic
+              else:
+                 self.outputs['nodes'][node.index] = {time: node.traffic}
+
+      def recordTaxi(self, time, number, node):
+          if number in self.outputs['taxis']:
+             self.outputs['taxis'][number][time] = node.index
+          else:
+             self.outputs['taxis'][number] = {time: node.index}
+
+'''
+OutputRecorder records into numpy arrays. Constructor arguments:
+ticks - the number of time steps to make room for (usually the world's run time). Recording beyond
+this is allowed, the arrays simply grow (doubling), but it is best to size them right in the first place.
+fares, nodes, taxis - which kinds of output to record ('time' always is). Node traffic is off by default,
+as the original dict outputs had it.
+The taxi and node columns are allocated as taxis and nodes first turn up; taxiNumbers and nodeIndices
+give the taxi number or node index for each column. Array elements with no data (a taxi off duty, say)
+hold -1 (positions) or 0 (traffic).
+'''
+class OutputRecorder(collections.abc.Mapping):
+
+      # the layout of the fare records
+      fareFields = [('time', numpy.int64), ('x', numpy.int32), ('y', numpy.int32), ('calltime', numpy.int64)]
+
+      def __init__(self, ticks, fares=True, nodes=False, taxis=True):
+          self._kinds = ['time']
+          if fares:
+             self._kinds.append('fares')
+          if nodes:
+             self._kinds.append('nodes')
+          if taxis:
+             self._kinds.append('taxis')
+          capacity = max(ticks, 1)
+          self._length = 0
+          self._times = numpy.zeros(capacity, dtype=numpy.int64)
+          self._taxiPositions = numpy.full((capacity, 0, 2), -1, dtype=numpy.int32)
+          self._taxiCols = {}
+          self._nodeTraffic = numpy.zeros((capacity, 0), dtype=numpy.int32)
+          self._nodeCols = {}
+          self._nodeColsByNode = {}
+          self._fares = numpy.zeros(capacity, dtype=self.fareFields)
+          self._fareCount = 0
+          # the map version and time step at which node traffic was last recorded, to know when
+          # looking at just the changed nodes is enough
+          self._nodeVersion = None
+          self._nodeTime = None
+          # the dict-style views are built on demand, and kept until more has been recorded
+          self._views = {}
+          self._viewLength = None
+          self._viewFareCount = None
+
+      # ---------------------------------------------------------------------------------------------------
+      # the recording interface
+
+      def recordTime(self, time):
+          if self._length == len(self._times):
+             self._grow(2*self._length)
+          self._times[self._length] = time
+          self._length += 1
+
+      def recordFares(self, time, fares):
+          records = [(time, fare.origin[0], fare.origin[1], fare.calltime) for fare in fares]
+          if len(records) == 0:
+             return
+          while self._fareCount+len(records) > len(self._fares):
+                self._fares = numpy.concatenate((self._fares, numpy.zeros(len(self._fares), dtype=self.fareFields)))
+          self._fares[self._fareCount:self._fareCount+len(records)] = records
+          self._fareCount += len(records)
+
+      def recordNodes(self, time, nodes, changed=None, version=None):
+          row = self._length-1
+          # with an unchanged map, picking up straight after the last recorded time step, the traffic
+          # carries over, and only the changed nodes need updating.
+          if (changed is not None and version is not None and version == self._nodeVersion
+              and self._nodeTime == time-1 and row > 0):
+             self._nodeTraffic[row] = self._nodeTraffic[row-1]
+             nodes = changed
+          else:
+             nodes = list(nodes)
+             newNodes = [node.index for node in nodes if node.index not in self._nodeCols]
+             if len(newNodes) > 0:
+                for index in newNodes:
+                    self._nodeCols[index] = len(self._nodeCols)
+                self._nodeTraffic = numpy.concatenate((self._nodeTraffic,
+                                                       numpy.zeros((len(self._nodeTraffic), len(newNodes)), dtype=numpy.int32)),
+                                                      axis=1)
+             # the column of each of the current Node objects, so that the index needn't be looked up every time
+             self._nodeColsByNode = dict([(node, self._nodeCols[node.index]) for node in nodes])
+          if len(nodes) > 0:
+             self._nodeTraffic[row, [self._nodeColsByNode[node] for node in nodes]] = [node.traffic for node in nodes]
+          self._nodeVersion = version
+          self._nodeTime = time
+
+      def recordTaxi(self, time, number, node):
+          if number not in self._taxiCols:
+             self._taxiCols[number] = len(self._taxiCols)
+             self._taxiPositions = numpy.concatenate((self._taxiPositions,
+                                                      numpy.full((len(self._taxiPositions), 1, 2), -1, dtype=numpy.int32)),
+                                                     axis=1)
+          self._taxiPositions[self._length-1, self._taxiCols[number]] = node.index
+
+      # enlarges the per-time-step arrays to hold capacity time steps
+      def _grow(self, capacity):
+          extra = capacity-len(self._times)
+          self._times = numpy.concatenate((self._times, numpy.zeros(extra, dtype=numpy.int64)))
+          self._taxiPositions = numpy.concatenate((self._taxiPositions,
+                                                   numpy.full((extra,)+self._taxiPositions.shape[1:], -1, dtype=numpy.int32)))
+          self._nodeTraffic = numpy.concatenate((self._nodeTraffic,
+                                                 numpy.zeros((extra,)+self._nodeTraffic.shape[1:], dtype=numpy.int32)))
+
+      # ---------------------------------------------------------------------------------------------------
+      # the recorded data, as arrays. These are views onto the recorder's own storage: copy them if they
+      # need to outlive further recording.
+
+      # the recorded time steps
+      @property
+      def times(self):
+          return self._times[:self._length]
+
+      # taxi number for each column of taxiPositions
+      @property
+      def taxiNumbers(self):
+          return list(self._taxiCols.keys())
+
+      # (T, n_taxis, 2) array of the (x,y) index of the node each taxi was in
+      @property
+      def taxiPositions(self):
+          return self._taxiPositions[:self._length]
+
+      # node index for each column of nodeTraffic
+      @property
+      def nodeIndices(self):
+          return list(self._nodeCols.keys())
+
+      # (T, n_nodes) array of the traffic in each node
+      @property
+      def nodeTraffic(self):
+          return self._nodeTraffic[:self._length]
+
+      # record array of the fares waiting at each time step: (time, x, y, calltime)
+      @property
+      def fares(self):
+          return self._fares[:self._fareCount]
+
+      # ---------------------------------------------------------------------------------------------------
+      # the Mapping methods make the recorder look like the outputs dict a DictRecorder would have filled
+      # in (e.g. self['taxis'][number][time] is the taxi's position at that time). The dicts are built on
+      # demand from the arrays, so reading them is only as cheap as the original dicts ever were.
+
+      def __getitem__(self, kind):
+          if kind not in self._kinds:
+             raise KeyError(kind)
+          if self._viewLength != self._length or self._viewFareCount != self._fareCount:
+             self._views = {}
+             self._viewLength = self._length
+             self._viewFareCount = self._fareCount
+          if kind not in self._views:
+             self._views[kind] = self._buildView(kind)
+          return self._views[kind]
+
+      def __iter__(self):
+          return iter(self._kinds)
+
+      def __len__(self):
+          return len(self._kinds)
+
+      def __contains__(self, kind):
+          return kind in self._kinds
+
+      def _buildView(self, kind):
+          times = self.times.tolist()
+          if kind == 'time':
+             return times
+          view = {}
+          if kind == 'fares':
+             for fare in self.fares.tolist():
+                 view.setdefault((fare[1], fare[2]), {})[fare[0]] = fare[3]
+          elif kind == 'taxis':
+             positions = self.taxiPositions
+             for number, col in self._taxiCols.items():
+                 # only the time steps when the taxi was somewhere in the world
+                 present = numpy.flatnonzero(positions[:, col, 0] >= 0)
+                 if len(present) > 0:
+                    view[number] = dict(zip([times[step] for step in present],
+                                            [tuple(position) for position in positions[present, col].tolist()]))
+          elif kind == 'nodes':
+             traffic = self.nodeTraffic.T.tolist()
+             for index, col in self._nodeCols.items():
+                 view[index] = dict(zip(times, traffic[col]))
+          return view
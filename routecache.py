@@ -0,0 +1,53 @@
+import collections
+
+'''
+A RouteCache remembers planned paths, indexed by (start, target), so that a taxi asked for the same
+route again - and taxis ask for the same few routes constantly - gets it straight back instead of
+planning it afresh. It holds at most maxSize routes, discarding the least recently used when full.
+hits and misses count the lookups that found (or didn't find) a route, to see whether the cache
+is earning its keep. A single cache can be shared by any number of taxis using the same map. The routes
+in it may no longer be the best, or even exist, once the map changes, so the cache remembers which map
+(the map object itself) they were planned over, and forgets them all when asked for routes over another
+(see useMap). A map changed in place has to be cleared explicitly.
+'''
+class RouteCache:
+
+      def __init__(self, maxSize=4096):
+          self.maxSize = maxSize
+          self.hits = 0
+          self.misses = 0
+          # most recently used routes at the end
+          self._routes = collections.OrderedDict()
+          # the map the routes were planned over
+          self._map = None
+
+      def __len__(self):
+          return len(self._routes)
+
+      # the cached path from start to target, or None if there isn't one. The path is a fresh list that
+      # the caller is free to change (Taxis pop their path as they drive it).
+      def get(self, start, target):
+          route = self._routes.get((start, target))
+          if route is None:
+             self.misses += 1
+             return None
+          self.hits += 1
+          self._routes.move_to_end((start, target))
+          return list(route)
+
+      def put(self, start, target, path):
+          self._routes[(start, target)] = tuple(path)
+          self._routes.move_to_end((start, target))
+          while len(self._routes) > self.maxSize:
+                self._routes.popitem(last=False)
+
+      # says which map routes are about to be looked up or put in for. If it isn't the one the cached routes
+      # were planned over, they are all forgotten.
+      def useMap(self, serviceMap):
+          if serviceMap is not self._map:
+             self._routes.clear()
+             self._map = serviceMap
+
+      # forget all the routes (the counters carry on)
+      def clear(self):
+          self._routes.clear()
@@ -0,0 +1,109 @@
+import collections.abc
+import types
+import numpy
+
+'''
+A ServiceMap is a compact, read-only service map. It holds the same information as the nested dict
+NetWorld.exportMap used to hand out - {(x,y): {(neighbourx,neighboury): (direction, distance)}} - but
+stored once, as compressed sparse row (CSR) arrays:
+
+nodes - (n, 2) int array, the (x,y) index of each node id. Ids are numbered in the map's order; any
+neighbours outside the map (which can only be reached, not routed through) get ids after the map's own.
+indptr - the links out of node id i are entries indptr[i] to indptr[i+1] of the next 3 arrays
+indices - the node id each link leads to
+direction - the direction of each link, as the Node's turn method expects it
+weight - the length of each link
+
+and looking just like the nested dict to everyone else: map[(x,y)] is a read-only dict-like view of a
+node's neighbours, and keys, items, len, in and so on all work as before. Since nothing can change it,
+a single ServiceMap can be handed by reference to every agent in a world, however many there are,
+instead of each having its own copy. Agents that want to change their map (addMapNode) have to take
+a private copy first (toDict).
+'''
+class ServiceMap(collections.abc.Mapping):
+
+      def __init__(self, serviceMap):
+          nodes = list(serviceMap.keys())
+          self._size = len(nodes)
+          self._ids = dict([(node, nodeId) for nodeId, node in enumerate(nodes)])
+          links = [list(neighbours.items()) for neighbours in serviceMap.values()]
+          for nodeLinks in links:
+              for link in nodeLinks:
+                  if link[0] not in self._ids:
+                     self._ids[link[0]] = len(nodes)
+                     nodes.append(link[0])
+          self._nodes = nodes
+          self._indptr = numpy.zeros(self._size+1, dtype=numpy.int64)
+          self._indptr[1:] = numpy.cumsum([len(nodeLinks) for nodeLinks in links])
+          self._indices = numpy.array([self._ids[link[0]] for nodeLinks in links for link in nodeLinks], dtype=numpy.int32)
+          self._direction = numpy.array([link[1][0] for nodeLinks in links for link in nodeLinks], dtype=numpy.int8)
+          self._weight = numpy.array([link[1][1] for nodeLinks in links for link in nodeLinks], dtype=numpy.float64)
+          for array in (self._indptr, self._indices, self._direction, self._weight):
+              array.flags.writeable = False
+          # the neighbour views are built as they are asked for, and shared by everyone using the map
+          self._rows = [None]*self._size
+
+      # ---------------------------------------------------------------------------------------------------
+      # the CSR form
+
+      # (n, 2) array of the (x,y) index of each node id
+      @property
+      def nodes(self):
+          nodes = numpy.array(self._nodes, dtype=numpy.int32).reshape(-1, 2)
+          nodes.flags.writeable = False
+          return nodes
+
+      @property
+      def indptr(self):
+          return self._indptr
+
+      @property
+      def indices(self):
+          return self._indices
+
+      @property
+      def direction(self):
+          return self._direction
+
+      @property
+      def weight(self):
+          return self._weight
+
+      # the id of the node at (x,y), None if it isn't in the map
+      def nodeId(self, node):
+          nodeId = self._ids.get(node)
+          if nodeId is None or nodeId >= self._size:
+             return None
+          return nodeId
+
+      # the (x,y) index of a node id
+      def index(self, nodeId):
+          return self._nodes[nodeId]
+
+      # ---------------------------------------------------------------------------------------------------
+      # the Mapping methods, which make the map look like the nested dict
+
+      def __getitem__(self, node):
+          nodeId = self.nodeId(node)
+          if nodeId is None:
+             raise KeyError(node)
+          if self._rows[nodeId] is None:
+             first = self._indptr[nodeId]
+             last = self._indptr[nodeId+1]
+             self._rows[nodeId] = types.MappingProxyType(dict(zip([self._nodes[neighbour] for neighbour in self._indices[first:last].tolist()],
+                                                                  zip(self._direction[first:last].tolist(),
+                                                                      self._weight[first:last].tolist()))))
+          return self._rows[nodeId]
+
+      def __iter__(self):
+          return iter(self._nodes[:self._size])
+
+      def __len__(self):
+          return self._size
+
+      def __contains__(self, node):
+          return self.nodeId(node) is not None
+
+      # a private, changeable copy of the map as the original nested dict
+      def toDict(self):
+          return dict([(node, dict(self[node])) for node in self])
@@ -0,0 +1,66 @@
+import logging
+import sys
+
+'''
+Logging set-up for RoboUber. Each module logs through its own logger (logging.getLogger(__name__)),
+with messages formatted lazily, so a message below the configured level costs no more than the level
+check. Running commentary (the clock, fare broadcasts and allocations, pickups, cancellations) is
+logged at INFO; per-tick, per-taxi detail at DEBUG. Nothing below WARNING appears unless logging is
+configured, e.g. with configureLogging here.
+'''
+
+# the format of a log line. The bare message keeps the output looking just like the old stdout
+# commentary, which the coursework log analysis expects.
+logFormat = '%(message)s'
+
+'''
+BufferedFileHandler is a high-throughput file sink. The standard FileHandler flushes the file after
+every record, which at thousands of records per simulated minute makes the writes themselves the
+bottleneck. This one lets the file's own (large) buffer decide when to write, and flushes only when
+closed, so log files are only complete once logging has been shut down (logging.shutdown() runs
+automatically at exit).
+'''
+class BufferedFileHandler(logging.FileHandler):
+
+      def __init__(self, filename, mode='w', bufferSize=1 << 20, encoding=None):
+          self._bufferSize = bufferSize
+          super(BufferedFileHandler, self).__init__(filename, mode, encoding)
+
+      def _open(self):
+          return open(self.baseFilename, self.mode, buffering=self._bufferSize, encoding=self.encoding)
+
+      # StreamHandler.emit flushes after every record: leave that to the buffer
+      def flush(self):
+          pass
+
+      def close(self):
+          self.acquire()
+          try:
+              if self.stream is not None:
+                 self.stream.flush()
+          finally:
+              self.release()
+          super(BufferedFileHandler, self).close()
+
+''' configureLogging sets the level of all the simulation's loggers and where their output goes.
+    level - a logging level, or its name (e.g. 'DEBUG')
+    logFile - if given, log to this file through a BufferedFileHandler rather than to the stream
+    stream - the stream to log to otherwise (default: stdout, where the commentary has always gone)
+    Calling it again replaces the handler installed by the previous call.
+'''
+def configureLogging(level=logging.INFO, logFile=None, stream=None, bufferSize=1 << 20):
+   if isinstance(level, str):
+      level = logging.getLevelName(level.upper())
+   root = logging.getLogger()
+   for handler in [handler for handler in root.handlers if getattr(handler, '_roboUber', False)]:
+       root.removeHandler(handler)
+       handler.close()
+   if logFile is not None:
+      handler = BufferedFileHandler(logFile, bufferSize=bufferSize)
+   else:
+      handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+   handler.setFormatter(logging.Formatter(logFormat))
+   handler._roboUber = True
+   root.addHandler(handler)
+   root.setLevel(level)
+   return handler
@@ -1,6 +1,16 @@
 import math
 import numpy
 import heapq
+import itertools
+import logging
+
+from routecache import RouteCache
+from servicemap import ServiceMap
+from dstarlite import DStarLite, predecessorMap
+from pathtable import PathTable
+from junctiongraph import JunctionGraph
+
+logger = logging.getLogger(__name__)
 
 # a data container object for the taxi's internal list of fares. This
 # tells the taxi what fares are available to what destinations at
@@ -53,8 +63,14 @@ class Taxi:
          service_area - the world can optionally populate the taxi's map at creation time.
          start_point - this gives the location in the network where the taxi will start. It should be an (x,y) tuple.
          default is None which means the world will randomly place the Taxi somewhere on the edge of the service area.
+         route_cache - a RouteCache for the taxi's planned routes. Taxis with the same map can share one. Default is
+         None, which gives the taxi a cache of its own.
+         traffic_aware - whether shortest routes should take the traffic into account. If so, the taxi plans its
+         routes by travel time rather than distance, and repairs the route it is driving whenever traffic along
+         the way changes. Default is False: plain shortest routes, which are quicker to plan.
       '''
-      def __init__(self, world, taxi_num, idle_loss=256, max_wait=50, on_duty_time=0, off_duty_time=0, service_area=None, start_point=None):
+      def __init__(self, world, taxi_num, idle_loss=256, max_wait=50, on_duty_time=0, off_duty_time=0, service_area=None, start_point=None,
+                   route_cache=None, traffic_aware=False):
 
           self._world = world
           self.number = taxi_num
@@ -73,10 +89,25 @@ class Taxi:
           # and dropOffFare() in a given Node to collect and deliver a fare
           self._passenger = None
           # the map is a dictionary of nodes indexed by (x,y) pair. Each entry is a dictionary of (x,y) nodes that indexes a 
-          # direction and distance. such a structure allows rapid lookups of any node from any other.
+          # direction and distance. such a structure allows rapid lookups of any node from any other. The world's map
+          # is a read-only ServiceMap shared with everyone else in the world, copied only if the taxi changes it.
           self._map = service_area
           if self._map is None:
               self._map = self._world.exportMap()
+          # the shortest-path table for the map, shared with everyone else in the world as long as the taxi has the
+          # world's map (see _routingTable). Fetched when first needed, and dropped whenever the map changes.
+          self._pathTable = None
+          # and the compressed junction graph, for searches with heuristics of the taxi's own
+          self._junctionGraph = None
+          # routes already planned. Like the path table, it has to be cleared when the map changes.
+          self._routeCache = route_cache
+          if self._routeCache is None:
+             self._routeCache = RouteCache()
+          # traffic-aware routing keeps an incremental planner (see dstarlite) for the route being driven, so that
+          # it can be repaired as traffic changes. The predecessors of each node in the map are worked out once.
+          self._trafficAware = traffic_aware
+          self._planner = None
+          self._predecessors = None
           # path is a list of nodes to be traversed on the way from one point to another. The list is
           # in order of traversal, and does NOT have to include every node passed through, if these
           # are incidental (i.e. involve no turns or stops or any other remarkable feature)
@@ -97,13 +128,21 @@ class Taxi:
           # this dict maintains which fares the Dispatcher has broadcast as available. After a certain
           # period of time, fares should be removed  given that the dispatcher doesn't inform the taxis
           # explicitly that their bid has not been successful. The dictionary is indexed by 
-          # a tuple of (time, originx, originy) to be unique, and the expiry can be implemented using a heap queue
-          # for priority management. You would do this by initialising a self._fareQ object as:
-          # self._fareQ = heapq.heapify(self._fares.keys()) (once you have some fares to consider)
+          # a tuple of (time, originx, originy) to be unique.
 
           # the dictionary items, meanwhile, contain a FareInfo object with the price, the destination, and whether 
           # or not this taxi has been allocated the fare (and thus should proceed to collect them ASAP from the origin)
           self._availableFares = {}
+          # so that dealing with the fares only ever involves the ones that need it, they are also indexed:
+          # fareExpiry is a heap of (time the fare goes stale, key) entries, so that expiring fares only have to
+          # be looked for at the top (entries for fares already gone are skipped); faresByOrigin gives the key of
+          # the fare at each origin, which is how the dispatcher's messages refer to them; and undecidedFares and
+          # allocatedFares hold the keys of the fares not bid on yet and those allocated to this taxi (dicts, which
+          # keep them in order).
+          self._fareExpiry = []
+          self._faresByOrigin = {}
+          self._undecidedFares = {}
+          self._allocatedFares = {}
 
       # This property allows the dispatcher to query the taxi's location directly. It's like having a GPS transponder
       # in each taxi.
@@ -113,11 +152,35 @@ class Taxi:
              return (-1,-1)
           return self._loc.index
 
+      # the taxi's current balance: revenue taken less the running cost of being on duty
+      @property
+      def account(self):
+          return self._account
+
+      # an idle taxi is on duty and parked somewhere in the world with nothing to do: no passenger, nowhere
+      # to go and no fares to think about. All a clock tick does for it is charge the running cost. The
+      # world's event engine uses this (with idleTicks and idleFor) to skip over quiet periods.
+      @property
+      def idle(self):
+          return (self.onDuty and self._loc is not None and self._nextLoc is None and self._passenger is None
+                  and len(self._path) == 0 and len(self._availableFares) == 0)
+
+      # how many ticks an idle taxi can sit idle before anything changes, i.e. before it runs out of money
+      # and goes off duty
+      @property
+      def idleTicks(self):
+          return max(math.ceil(self._account)-1, 0)
+
       #___________________________________________________________________________________________________________________________
       # methods to populate the taxi's knowledge base
 
       # get a map if none was provided at the outset
       def importMap(self, newMap):
+          self._pathTable = None
+          self._junctionGraph = None
+          self._routeCache.clear()
+          self._planner = None
+          self._predecessors = None
           # a fresh map can just be inserted
           if self._map is None:
              self._map = newMap
@@ -145,7 +208,16 @@ class Taxi:
               if neighbourNode is None:
                  return KeyError("Node {0} expects neighbour {1} which is not in this Taxi's service area".format(coords, neighbour))
               neighbourDict[neighbourCoords] = (neighbour[0],self._world.distance2Node(node, neighbourNode))
+          # a shared map can't be changed: the taxi needs a copy of its own, and its own route cache to go with it
+          if isinstance(self._map, ServiceMap):
+             self._map = self._map.toDict()
+             self._routeCache = RouteCache(self._routeCache.maxSize)
           self._map[coords] = neighbourDict
+          self._pathTable = None
+          self._junctionGraph = None
+          self._routeCache.clear()
+          self._planner = None
+          self._predecessors = None
 
       #---------------------------------------------------------------------------------------------------------------------------
       # automated methods to handle the taxi's interaction with the world. You should not need to change these.
@@ -165,6 +237,21 @@ class Taxi:
              self._nextLoc = onDutyPose[0]
              self._nextDirection = onDutyPose[1]
 
+      # the earliest time, from time onwards, at which an off-duty taxi would come back on duty (see comeOnDuty),
+      # or None if it never will
+      def nextDutyTime(self, time):
+          if self._offDutyTime == 0:
+             return time
+          dutyTime = max(time, self._onDutyTime)
+          if dutyTime < self._offDutyTime:
+             return dutyTime
+          return None
+
+      # the equivalent of ticks clock ticks spent idle. The world's event engine calls this instead of
+      # clockTick when it skips ahead, and only for idle taxis, so the running cost is all there is to pay.
+      def idleFor(self, ticks):
+          self._account -= ticks
+
       # clockTick should handle all the non-driving behaviour, turn selection, stopping, etc. Drive automatically
       # stops once it reaches its next location so that if continuing on is desired, clockTick has to select
       # that action explicitly. This can be done using the turn and continueThrough methods of the node. Taxis
@@ -172,11 +259,25 @@ class Taxi:
       # using transmitFareBid, and any other internal activity seen as potentially useful. 
       def clockTick(self, world):
           # automatically go off duty if we have absorbed as much loss as we can in a day
-          print("{0};{1};{2};{3};".format(self.number,self._passenger is not None,self._account,self.currentLocation))
+          if logger.isEnabledFor(logging.DEBUG):
+             logger.debug("%s;%s;%s;%s;", self.number, self._passenger is not None, self._account, self.currentLocation)
           if self._account <= 0 and self._passenger is None:
-             print("Taxi {0} is going off-duty".format(self.number))
+             logger.info("Taxi %s is going off-duty", self.number)
              self.onDuty = False
              self._offDutyTime = self._world.simTime
+          # with traffic-aware routing, keep the route being driven up to date with the traffic: the planner only
+          # has to look again at the nodes whose traffic has changed. The route is replanned from its first node,
+          # which is where the taxi is (or is already headed).
+          if self._planner is not None:
+             if len(self._path) == 0 or self._path[-1] != self._planner.goal:
+                self._planner = None
+             else:
+                trafficChanges = world.trafficChanges
+                if len(trafficChanges) > 0:
+                   self._planner.update(trafficChanges, self._path[0])
+                   path = self._planner.path()
+                   if path is not None:
+                      self._path = path
           # have we reached our last known destination? Decide what to do now.
           if len(self._path) == 0:
              # obviously, if we have a fare aboard, we expect to have reached their destination,
@@ -191,45 +292,44 @@ class Taxi:
                    
           # decide what to do about available fares. This can be done whenever, but should be done
           # after we have dropped off fares so that they don't complicate decisions.
-          faresToRemove = []
-          for fare in self._availableFares.items():
-              # remember that availableFares is a dict indexed by (time, originx, originy). A location,
-              # meanwhile, is an (x, y) tuple. So fare[0][0] is the time the fare called, fare[0][1]
-              # is the fare's originx, and fare[0][2] is the fare's originy, which we can use to
-              # build the location tuple.
-              origin = (fare[0][1], fare[0][2])
-              # much more intelligent things could be done here. This simply naively takes the first
-              # allocated fare we have and plans a basic path to get us from where we are to where
-              # they are waiting. 
-              if len(self._path) == 0 and fare[1].allocated and self._passenger is None:
-                 # at the collection point for our next passenger?
-                 if self._loc.index[0] == origin[0] and self._loc.index[1] == origin[1]:
-                    self._passenger = self._loc.pickupFare(self._direction)
-                    # if a fare was collected, we can start to drive to their destination. If they
-                    # were not collected, that probably means the fare abandoned.
-                    if self._passenger is not None:
-                       self._path = self._planPath(self._loc.index, self._passenger.destination)
-                    faresToRemove.append(fare[0])
-                 # not at collection point, so determine how to get there
-                 else:
-                    self._path = self._planPath(self._loc.index, origin)
-              # get rid of any unallocated fares that are too stale to be likely customers
-              elif self._world.simTime-fare[0][0] > self._maxFareWait:
-                   faresToRemove.append(fare[0])
-              # may want to bid on available fares. This could be done at any point here, it
-              # doesn't need to be a particularly early or late decision amongst the things to do.
-              elif fare[1].bid == 0:
-                 if self._bidOnFare(fare[0][0],origin,fare[1].destination,fare[1].price):
-                    self._world.transmitFareBid(origin, self)
-                    fare[1].bid = 1
-                 else:
-                    fare[1].bid = -1
-          for expired in faresToRemove:
-              del self._availableFares[expired]
+          # much more intelligent things could be done here. This simply naively takes the first
+          # allocated fare we have and plans a basic path to get us from where we are to where
+          # they are waiting. 
+          if len(self._path) == 0 and len(self._allocatedFares) > 0 and self._passenger is None:
+             # remember that availableFares is a dict indexed by (time, originx, originy). A location,
+             # meanwhile, is an (x, y) tuple. So fare[0] is the time the fare called, fare[1]
+             # is the fare's originx, and fare[2] is the fare's originy, which we can use to
+             # build the location tuple.
+             fare = min(self._allocatedFares.keys())
+             origin = (fare[1], fare[2])
+             # at the collection point for our next passenger?
+             if self._loc.index[0] == origin[0] and self._loc.index[1] == origin[1]:
+                self._passenger = self._loc.pickupFare(self._direction)
+                # if a fare was collected, we can start to drive to their destination. If they
+                # were not collected, that probably means the fare abandoned.
+                if self._passenger is not None:
+                   self._path = self._planPath(self._loc.index, self._passenger.destination)
+                self._removeFare(fare)
+             # not at collection point, so determine how to get there
+             else:
+                self._path = self._planPath(self._loc.index, origin)
+          # get rid of any unallocated fares that are too stale to be likely customers
+          while len(self._fareExpiry) > 0 and self._fareExpiry[0][0] < self._world.simTime:
+                fare = heapq.heappop(self._fareExpiry)[1]
+                if fare in self._availableFares and not self._availableFares[fare].allocated:
+                   self._removeFare(fare)
+          # may want to bid on available fares. This could be done at any point here, it
+          # doesn't need to be a particularly early or late decision amongst the things to do.
+          for fare in list(self._undecidedFares.keys()):
+              del self._undecidedFares[fare]
+              origin = (fare[1], fare[2])
+              if self._bidOnFare(fare[0],origin,self._availableFares[fare].destination,self._availableFares[fare].price):
+                 self._world.transmitFareBid(origin, self)
+                 self._availableFares[fare].bid = 1
+              else:
+                 self._availableFares[fare].bid = -1
           # may want to do something active whilst enroute - this simple default version does
           # nothing, but that is probably not particularly 'intelligent' behaviour.
-          else:
-             pass
        
           # the last thing to do is decrement the account - the fixed 'time penalty'. This is always done at
           # the end so that the last possible time tick isn't wasted e.g. if that was just enough time to
@@ -305,25 +405,43 @@ class Taxi:
           # A new fare has requested service: add it to the list of availables
           if msg == self.FARE_ADVICE:
              callTime = self._world.simTime
-             self._availableFares[callTime,args['origin'][0],args['origin'][1]] = FareInfo(args['destination'],args['price'])
+             origin = (args['origin'][0],args['origin'][1])
+             # there is only ever one fare at a time at any origin, so one we knew of from before has gone
+             if origin in self._faresByOrigin:
+                self._removeFare(self._faresByOrigin[origin])
+             fare = (callTime,origin[0],origin[1])
+             self._availableFares[fare] = FareInfo(args['destination'],args['price'])
+             self._faresByOrigin[origin] = fare
+             self._undecidedFares[fare] = None
+             heapq.heappush(self._fareExpiry, (callTime+self._maxFareWait, fare))
              return
           # the dispatcher has approved our bid: mark the fare as ours
           elif msg == self.FARE_ALLOC:
-             for fare in self._availableFares.items():
-                 if fare[0][1] == args['origin'][0] and fare[0][2] == args['origin'][1]:
-                    if fare[1].destination[0] == args['destination'][0] and fare[1].destination[1] == args['destination'][1]:
-                       fare[1].allocated = True
-                       return
+             fare = self._faresByOrigin.get((args['origin'][0],args['origin'][1]))
+             if fare is not None:
+                destination = self._availableFares[fare].destination
+                if destination[0] == args['destination'][0] and destination[1] == args['destination'][1]:
+                   self._availableFares[fare].allocated = True
+                   self._allocatedFares[fare] = None
+                   return
           # we just dropped off a fare and received payment, add it to the account
           elif msg == self.FARE_PAY:
              self._account += args['amount']
              return
           # a fare cancelled before being collected, remove it from the list
           elif msg == self.FARE_CANCEL:
-             for fare in self._availableFares.items():
-                 if fare[0][1] == args['origin'][0] and fare[0][2] == args['origin'][1]: # and fare[1].allocated: 
-                    del self._availableFares[fare[0]]
-                    return
+             fare = self._faresByOrigin.get((args['origin'][0],args['origin'][1]))
+             if fare is not None:
+                self._removeFare(fare)
+             return
+
+      # removes a fare from the available fares (and their indices). Its expiry entry is left for clockTick to skip.
+      def _removeFare(self, fare):
+          del self._availableFares[fare]
+          if self._faresByOrigin.get((fare[1], fare[2])) == fare:
+             del self._faresByOrigin[(fare[1], fare[2])]
+          self._undecidedFares.pop(fare, None)
+          self._allocatedFares.pop(fare, None)
       #_____________________________________________________________________________________________________________________
 
       ''' HERE IS THE PART THAT YOU NEED TO MODIFY
@@ -331,45 +449,110 @@ class Taxi:
 
       # TODO
       # this function should build your route and fill the _path list for each new
-      # journey. Below is a naive depth-first search implementation. You should be able
-      # to do much better than this!
+      # journey. Shortest routes are simply looked up in the world's path table. With a heuristic
+      # of your own, it runs an A* search over the world's junction graph (or, if that doesn't cover
+      # the journey, over the map itself). Either way these are just the shortest routes: you should
+      # be able to do much better than this!
 
       def _planPath(self, start, target, heuristic=None):
           if start not in self._map:
               return None
           if start == target:
               return [start]
-          if heuristic is None: heuristic = lambda x, y: math.sqrt((x[0] - y[0]) ** 2 + (x[1] - y[1]) ** 2)
-          # these are the nodes that have been completely expanded, so don't need to be traced backwards
+          # traffic-aware routes are planned by travel time, with the current traffic, so they can't be cached
+          if heuristic is None and self._trafficAware:
+             path = self._planTrafficPath(start, target)
+             if path is not None:
+                return path
+          # shortest routes are remembered in the route cache, so each only needs working out once (as long as
+          # the map stays the same: a cache shared with taxis on an older or newer map starts again)
+          if heuristic is None:
+             self._routeCache.useMap(self._map)
+             path = self._routeCache.get(start, target)
+             if path is not None:
+                return path
+             if self._pathTable is None:
+                self._pathTable = self._routingTable(self._world.exportPathTable, PathTable)
+             if start in self._pathTable and target in self._pathTable:
+                path = self._pathTable.path(start, target)
+             else:
+                path = self._planPath(start, target, lambda x, y: math.sqrt((x[0] - y[0]) ** 2 + (x[1] - y[1]) ** 2))
+             if path is not None:
+                self._routeCache.put(start, target, path)
+             return path
+          # searches with a heuristic go over the junction graph, which is far smaller than the map itself, and
+          # the streets between junctions are filled in afterwards
+          if self._junctionGraph is None:
+             self._junctionGraph = self._routingTable(self._world.exportJunctionGraph, JunctionGraph)
+          if start in self._junctionGraph and target in self._junctionGraph:
+             return self._junctionGraph.path(start, target, heuristic)
+          # failing that, A* search over the map itself. The frontier is a heap of (estimated total cost, tie-breaker, node) entries. Rather than
+          # storing a whole path with each entry, each node just remembers the node it was reached from (its
+          # parent) along the cheapest known route, and the path is traced back once, at the end. 
+          # bestCost holds the cheapest known cost of reaching each node seen so far; finding a cheaper route
+          # to a node already on the frontier just pushes it again, and the stale entry is skipped when it
+          # comes up (a lazy decrease-key). Entries with equal estimates come off in the order they were
+          # pushed, so the search is deterministic.
+          bestCost = {start: 0}
+          parents = {start: None}
           explored = set()
-          # these are the nodes still to be explored, sorted by estimated cost. They need to have
-          # the complete path stored because any one of them might contain the best solution. We
-          # arrange this as a nested dictionary to get a reasonably straightforward way to look up
-          # the cheapest path. A heapq could also work but introduces implementation complexities.
-          expanded = {heuristic(start, target): {start: [start]}}
-          while len(expanded) > 0:
-              bestPath = min(expanded.keys())
-              nextExpansion = expanded[bestPath]
-              if target in nextExpansion:
-                  return nextExpansion[target]
-              nextNode = nextExpansion.popitem()
-              while len(nextExpansion) > 0 and nextNode[0] in explored:
-                  nextNode = nextExpansion.popitem()
-              if len(nextExpansion) == 0:
-                  del expanded[bestPath]
-              if nextNode[0] not in explored:
-                  explored.add(nextNode[0])
-                  expansionTargets = [node for node in self._map[nextNode[0]].items() if node[0] not in explored]
-                  while len(expansionTargets) > 0:
-                      expTgt = expansionTargets.pop()
-                      estimatedDistance = bestPath - heuristic(nextNode[0], target) + expTgt[1][0] + heuristic(expTgt[0],
-                                                                                                            target)
-                      if estimatedDistance in expanded:
-                          expanded[estimatedDistance][expTgt[0]] = nextNode[1] + [expTgt[0]]
-                      else:
-                          expanded[estimatedDistance] = {expTgt[0]: nextNode[1] + [expTgt[0]]}
+          tieBreaker = itertools.count()
+          frontier = [(heuristic(start, target), next(tieBreaker), start)]
+          while len(frontier) > 0:
+              nextNode = heapq.heappop(frontier)[2]
+              if nextNode in explored:
+                 continue
+              if nextNode == target:
+                 path = [target]
+                 while parents[path[-1]] is not None:
+                       path.append(parents[path[-1]])
+                 path.reverse()
+                 return path
+              explored.add(nextNode)
+              for expTgt in self._map[nextNode].items():
+                  if expTgt[0] in explored or expTgt[0] not in self._map:
+                     continue
+                  cost = bestCost[nextNode] + expTgt[1][1]
+                  if expTgt[0] not in bestCost or cost < bestCost[expTgt[0]]:
+                     bestCost[expTgt[0]] = cost
+                     parents[expTgt[0]] = nextNode
+                     heapq.heappush(frontier, (cost + heuristic(expTgt[0], target), next(tieBreaker), expTgt[0]))
           return None
 
+      # a routing structure (a PathTable or JunctionGraph) for the taxi's map. While the taxi has the world's own map,
+      # it can use the world's, shared with everyone (from export); once it has a map of its own, it needs its own
+      # (built by build), or it would route along streets it doesn't know about.
+      def _routingTable(self, export, build):
+          if self._map is self._world.exportMap():
+             return export()
+          return build(self._map)
+
+      # plans the quickest route from start to target given the traffic, with D* Lite. The planner is kept for
+      # repairing the route as the traffic changes (see clockTick); asked for the same target again, it just
+      # brings the route it has up to date. Travel between neighbours costs the world's travel time plus 1 (so
+      # that no step is free), which means the number of grid steps, the larger of the x and y distances,
+      # never overestimates the cost. None if there is no way through the traffic.
+      def _planTrafficPath(self, start, target):
+          if target not in self._map:
+             return None
+          if self._planner is not None and self._planner.goal == target:
+             self._planner.update((), start)
+          else:
+             if self._predecessors is None:
+                self._predecessors = predecessorMap(self._map)
+             self._planner = DStarLite(self._map, self._travelCost, lambda x, y: max(abs(x[0]-y[0]), abs(x[1]-y[1])),
+                                       start, target, self._predecessors)
+          return self._planner.path()
+
+      # the cost of driving from one node to a neighbouring one with the current traffic, math.inf if it is
+      # gridlocked
+      def _travelCost(self, origin, destination):
+          travelTime = self._world.travelTime(self._world.getNode(origin[0], origin[1]),
+                                              self._world.getNode(destination[0], destination[1]))
+          if travelTime < 0:
+             return math.inf
+          return travelTime+1
+
 
 
 
@@ -383,7 +566,7 @@ class Taxi:
       # other methodologies could work well. For best results you will almost certainly need to use probabilistic reasoning.
       def _bidOnFare(self, time, origin, destination, price):
           NoCurrentPassengers = self._passenger is None
-          NoAllocatedFares = len([fare for fare in self._availableFares.values() if fare.allocated]) == 0
+          NoAllocatedFares = len(self._allocatedFares) == 0
           TimeToOrigin = self._world.travelTime(self._loc, self._world.getNode(origin[0], origin[1]))
           TimeToDestination = self._world.travelTime(self._world.getNode(origin[0], origin[1]),
                                                      self._world.getNode(destination[1], destination[1]))
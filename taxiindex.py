@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import math
+
+'''
+A TaxiIndex keeps track of where taxis are, so that the taxis near a point can be found without looking
+at every taxi in the world. The world is divided into square buckets of cellSize x cellSize nodes, and each
+taxi is filed in the bucket it is in; a query then only has to look at the buckets around the point,
+working outwards ring by ring until it has what it wants. NetWorld keeps one up to date as taxis enter
+nodes (clearAdmission) and leave the world, and answers the dispatcher's queries with it.
+
+Distances are straight-line distances between (x,y) indices, as NetWorld.distance2Node measures them.
+Since no road between 2 points is shorter than the straight line, taxis come out of byDistance in an
+order that also bounds how far away by road they can be.
+'''
+class TaxiIndex:
+
+      def __init__(self, cellSize=8):
+          self.cellSize = cellSize
+          # taxi -> (x,y) position, and bucket -> the taxis in it (a dict, so that it keeps its order)
+          self._positions = {}
+          self._buckets = {}
+
+      def __len__(self):
+          return len(self._positions)
+
+      def __contains__(self, taxi):
+          return taxi in self._positions
+
+      def _bucket(self, position):
+          return (position[0]//self.cellSize, position[1]//self.cellSize)
+
+      # the position a taxi was last filed at, None if it isn't in the index
+      def position(self, taxi):
+          return self._positions.get(taxi)
+
+      # files a taxi at its new (x,y) position
+      def move(self, taxi, position):
+          oldPosition = self._positions.get(taxi)
+          if oldPosition is not None:
+             if oldPosition == position:
+                return
+             self._unfile(taxi, oldPosition)
+          self._positions[taxi] = position
+          self._buckets.setdefault(self._bucket(position), {})[taxi] = None
+
+      # takes a taxi out of the index (if it is there)
+      def remove(self, taxi):
+          position = self._positions.pop(taxi, None)
+          if position is not None:
+             self._unfile(taxi, position)
+
+      def _unfile(self, taxi, position):
+          bucket = self._bucket(position)
+          del self._buckets[bucket][taxi]
+          if len(self._buckets[bucket]) == 0:
+             del self._buckets[bucket]
+
+      # the buckets in the square ring radius buckets out from centre
+      def _ring(self, centre, radius):
+          if radius == 0:
+             return [centre]
+          ring = [(centre[0]+dx, centre[1]+dy) for dx in range(-radius, radius+1) for dy in (-radius, radius)]
+          ring.extend([(centre[0]+dx, centre[1]+dy) for dx in (-radius, radius) for dy in range(-radius+1, radius)])
+          return ring
+
+      ''' byDistance generates (distance, taxi) pairs for the taxis in the index, nearest to point first (taxis
+          at the same distance come out in the order they were filed). It only ever looks at the buckets it
+          needs to, so stopping early - once a taxi good enough has turned up - is cheap.
+      '''
+      def byDistance(self, point):
+          centre = self._bucket(point)
+          tieBreaker = itertools.count()
+          candidates = []
+          seen = 0
+          radius = 0
+          while seen < len(self._positions) or len(candidates) > 0:
+                if seen < len(self._positions):
+                   for bucket in self._ring(centre, radius):
+                       for taxi in self._buckets.get(bucket, {}).keys():
+                           position = self._positions[taxi]
+                           distance = math.sqrt((position[0]-point[0])**2+(position[1]-point[1])**2)
+                           heapq.heappush(candidates, (distance, next(tieBreaker), taxi))
+                           seen += 1
+                   # anything in the rings further out is at least this far away
+                   bound = radius*self.cellSize
+                   radius += 1
+                else:
+                   bound = math.inf
+                while len(candidates) > 0 and candidates[0][0] <= bound:
+                      candidate = heapq.heappop(candidates)
+                      yield (candidate[0], candidate[2])
+
+      # the k taxis nearest to point, as a list of (distance, taxi) pairs, nearest first
+      def nearest(self, point, k=1):
+          return list(itertools.islice(self.byDistance(point), k))
+
+      # the taxis no further than radius from point, as a list of (distance, taxi) pairs, nearest first
+      def within(self, point, radius):
+          reach = math.ceil(radius/self.cellSize)
+          centre = self._bucket(point)
+          found = []
+          for bucketX in range(centre[0]-reach, centre[0]+reach+1):
+              for bucketY in range(centre[1]-reach, centre[1]+reach+1):
+                  for taxi in self._buckets.get((bucketX, bucketY), {}).keys():
+                      position = self._positions[taxi]
+                      distance = math.sqrt((position[0]-point[0])**2+(position[1]-point[1])**2)
+                      if distance <= radius:
+                         found.append((distance, taxi))
+          found.sort(key=lambda candidate: candidate[0])
+          return found
@@ -0,0 +1,45 @@
+import RoboUber
+
+'''
+Seeded regression checks for taxi admission to Nodes. Two taxis waiting at the same Node to go to the same
+neighbour used to livelock: each one's indication displaced the other's, so neither was ever let in. With
+the seeds here, that froze an on-duty taxi for the rest of the run. Run with pytest, or directly.
+'''
+
+# the longest time an on-duty taxi with somewhere to go sat at the same place, over a seeded default run
+def longestWait(seed, ticks, eventDriven=False):
+   svcArea, taxis, dispatcher0 = RoboUber.createRoboUber(RoboUber.worldX, RoboUber.worldY, ticks,
+                                                         RoboUber.junctions, RoboUber.streets, True, seed,
+                                                         fareProbNormal=RoboUber.fareProbNormal)
+   waiting = {}
+   longest = 0
+   for tick in range(ticks):
+       if eventDriven:
+          svcArea.runEvents(ticks=1)
+       else:
+          svcArea.runWorld(ticks=1)
+       for cab in taxis:
+           if cab.onDuty and len(cab._path) > 0:
+              place = (cab.currentLocation, len(cab._path))
+              if cab not in waiting or waiting[cab][0] != place:
+                 waiting[cab] = (place, tick)
+              longest = max(longest, tick-waiting[cab][1])
+           else:
+              waiting.pop(cab, None)
+   svcArea.close()
+   return longest
+
+def test_sharedTurnSeed2():
+   assert longestWait(2, 400) < 150
+
+def test_sharedTurnSeed3():
+   assert longestWait(3, 400) < 150
+
+def test_sharedTurnEvents():
+   assert longestWait(2, 700, eventDriven=True) < 150
+
+if __name__ == '__main__':
+   test_sharedTurnSeed2()
+   test_sharedTurnSeed3()
+   test_sharedTurnEvents()
+   print("admission checks passed")
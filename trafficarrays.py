@@ -0,0 +1,198 @@
+import numpy
+
+# the stages of a time step the traffic levels are kept at: after traffic has flowed out of each Node (and
+# its sink has taken its share), after the Node's own source has added to it, and after the traffic flowed
+# in from its neighbours has arrived. These are the levels a Node would have at the corresponding points of
+# a time step if it flowed its own traffic (see Node.clockTick and NetWorld._tick).
+FLOWED = 0
+SOURCED = 1
+ARRIVED = 2
+
+# the directions a Node's neighbours can be in (N, NE, E ... NW, as the Node orders them)
+DIRECTIONS = 8
+
+'''
+TrafficArrays flows a world's traffic as a whole, with array operations, instead of each Node flowing its
+own a unit at a time. The traffic, cap, source and sink of every Node are kept in arrays (indexed by the
+Node's place in the network order), along with the neighbours of each Node in each direction, and the
+traffic queued to get into each Node. Flowing traffic out is 8 rounds of array operations - one for each
+direction, in the order the Node tries them - over all the Nodes at once, and gathering up what arrived is
+a sum over the links into each Node (held in compressed sparse row form).
+
+The flow rules are the Node's own - traffic leaves a Node one unit at a time for each neighbour with space
+(haveSpace), taking the Node's sink with it, and arrives at the end of the time step, as much as there is
+space for below the cap, the rest waiting to get in at the next - and the result is exactly what the Nodes
+would get flowing their own traffic one after another in network order. The catch is that a Node asking
+whether a neighbour has space sees the neighbour as it is at that moment: already flowed and sourced if it
+comes earlier in the order, as it arrived at the last time step if it comes later. So all the Nodes first
+flow out judging every neighbour as it arrived at the last time step; then any Node that judged an earlier
+neighbour wrongly flows out again, until none has. Each of these rounds puts right at least the earliest
+Node still wrong, and in practice it takes a handful at most, all but the first only for the few Nodes near
+their caps.
+
+The world copies the levels back into its Nodes at each stage (only for the Nodes whose traffic has
+changed), so that taxis see exactly what they would otherwise.
+
+Arguments:
+nodes - the world's Nodes, in network order
+pending - traffic already waiting to get into Nodes, as {(x,y): volume}
+'''
+class TrafficArrays:
+
+      def __init__(self, nodes, pending=None):
+          self._nodes = list(nodes)
+          self._ids = dict([(node.index, nodeId) for nodeId, node in enumerate(self._nodes)])
+          size = len(self._nodes)
+          neighbours = numpy.full((size, DIRECTIONS), -1, dtype=numpy.int64)
+          for nodeId, node in enumerate(self._nodes):
+              for direction, x, y in node.neighbours:
+                  neighbours[nodeId, direction] = self._ids.get((x, y), -1)
+          self._arrays = dict([(name, numpy.zeros(shape, dtype=numpy.int64))
+                               for name, shape in (('neighbours', (size, DIRECTIONS)),
+                                                   ('capacity', (size,)),
+                                                   ('source', (size,)),
+                                                   ('sink', (size,)),
+                                                   ('levels', (3, size)),
+                                                   ('pending', (size,)),
+                                                   ('sent', (size, DIRECTIONS)),
+                                                   ('judged', (size, DIRECTIONS)))])
+          self._arrays['neighbours'][:] = neighbours
+          self._arrays['capacity'][:] = [node.maxTraffic for node in self._nodes]
+          self._arrays['source'][:] = [node.trafficIn for node in self._nodes]
+          self._arrays['sink'][:] = [-node.trafficOut for node in self._nodes]
+          self._arrays['levels'][:] = [node.traffic for node in self._nodes]
+          self._arrays['pending'][:] = 0
+          if pending is not None:
+             for index, volume in pending.items():
+                 if index in self._ids:
+                    self._arrays['pending'][self._ids[index]] = volume
+          self._arrays['sent'][:] = 0
+          self._arrays['judged'][:] = -1
+          self._everyNode = numpy.arange(size)
+          # the Nodes that had traffic to flow at the last time step (see startFlow)
+          self._moving = self._everyNode[:0]
+          # the links into all the Nodes (see incomingLinks)
+          self._inPtr, self._inLinks = incomingLinks(neighbours, self._everyNode)
+          # the level each Node was last given (see changes)
+          self._written = self._arrays['levels'][ARRIVED].copy()
+
+      # whether any traffic is still waiting to get into a Node
+      @property
+      def busy(self):
+          return bool((self._arrays['pending'] > 0).any())
+
+      # the traffic still waiting to get into Nodes, as {(x,y): volume}
+      def pending(self):
+          pending = self._arrays['pending']
+          return dict([(self._nodes[nodeId].index, int(pending[nodeId])) for nodeId in numpy.flatnonzero(pending)])
+
+      # the traffic levels of all the Nodes at one of the stages of the last time step
+      def levels(self, stage=ARRIVED):
+          return self._arrays['levels'][stage]
+
+      # runs a time step's traffic flow
+      def flow(self):
+          self._moving = startFlow(self._arrays, self._everyNode, self._moving)
+          flowOut(self._arrays, self._moving, haveSpace(self._arrays, self._moving, guess=True))
+          nodes, space = misjudged(self._arrays, self._moving)
+          while len(nodes) > 0:
+                flowOut(self._arrays, nodes, space)
+                nodes, space = misjudged(self._arrays, self._moving)
+          flowIn(self._arrays, self._everyNode, self._inPtr, self._inLinks)
+
+      ''' changes gives the Nodes whose traffic at the given stage differs from what they were last given, as a
+          list of (Node, level) pairs, and takes note that they have now been given it. Only these Nodes need
+          their traffic setting.
+      '''
+      def changes(self, stage):
+          levels = self._arrays['levels'][stage]
+          changed = numpy.flatnonzero(levels != self._written)
+          self._written[changed] = levels[changed]
+          return [(self._nodes[nodeId], int(self._written[nodeId])) for nodeId in changed]
+
+# the links (numbered node*DIRECTIONS+direction) leading into each of the given nodes, in compressed sparse row
+# form: the links into nodes[i] are entries inPtr[i] to inPtr[i+1] of inLinks
+def incomingLinks(neighbours, nodes):
+   links = numpy.flatnonzero(neighbours.reshape(-1) >= 0)
+   receivers = neighbours.reshape(-1)[links]
+   # where each node comes in nodes, if it does
+   place = numpy.full(len(neighbours), -1, dtype=numpy.int64)
+   place[nodes] = numpy.arange(len(nodes))
+   links = links[place[receivers] >= 0]
+   receivers = place[neighbours.reshape(-1)[links]]
+   order = numpy.argsort(receivers, kind='stable')
+   inPtr = numpy.zeros(len(nodes)+1, dtype=numpy.int64)
+   inPtr[1:] = numpy.cumsum(numpy.bincount(receivers, minlength=len(nodes)))
+   return (inPtr, links[order])
+
+# adds volume to traffic, element by element, exactly as Node.injectTraffic does: returns the new traffic and how
+# much of the volume went in
+def inject(traffic, capacity, volume):
+   over = traffic > capacity
+   added = traffic+volume
+   injected = numpy.where(over, 0, numpy.where(added > capacity, volume-(added-capacity), volume))
+   return (numpy.where(over, traffic, numpy.minimum(added, capacity)), injected)
+
+# gets a time step going for the given nodes (an array of ids): those with no traffic and no source have nothing
+# to flow, and stay as they arrived, and what moved was sent at the last time step is cleared. Returns the
+# nodes that do have something to flow, which are the only ones the rest of the time step's flowing out needs
+# to visit.
+def startFlow(arrays, nodes, moved):
+   levels = arrays['levels']
+   arrays['sent'][moved] = 0
+   arrays['judged'][moved] = -1
+   traffic = levels[ARRIVED, nodes]
+   levels[FLOWED, nodes] = traffic
+   levels[SOURCED, nodes] = traffic
+   return nodes[(traffic > 0) | (arrays['source'][nodes] != 0)]
+
+# whether the neighbours of the given nodes (an array of ids) have space, as the nodes would find when they
+# flow in network order: an array of shape (len(nodes), DIRECTIONS), False where there is no neighbour. A
+# neighbour earlier in the order has already flowed and been sourced; a later one is as it arrived at the last
+# time step. With guess, every neighbour is taken as it arrived, which is right for the later ones and a
+# first guess for the earlier ones.
+def haveSpace(arrays, nodes, guess=False):
+   levels = arrays['levels']
+   neighbours = arrays['neighbours'][nodes]
+   present = neighbours >= 0
+   neighbours = numpy.where(present, neighbours, 0)
+   traffic = levels[ARRIVED, neighbours]
+   if not guess:
+      traffic = numpy.where(neighbours < nodes[:,None], levels[SOURCED, neighbours], traffic)
+   return present & (traffic < arrays['capacity'][neighbours])
+
+# the first part of a time step for the given nodes (an array of ids): flow traffic out of them, one direction
+# at a time, to the neighbours space says have room, then add their sources' traffic. What each node found
+# when it asked a neighbour is kept in judged (-1 where it never asked), so misjudged can check it.
+def flowOut(arrays, nodes, space):
+   levels = arrays['levels']
+   capacity = arrays['capacity'][nodes]
+   sink = arrays['sink'][nodes]
+   traffic = levels[ARRIVED, nodes]
+   judged = numpy.empty((len(nodes), DIRECTIONS), dtype=numpy.int64)
+   for direction in range(DIRECTIONS):
+       asked = (arrays['neighbours'][nodes, direction] >= 0) & (traffic > 0)
+       judged[:,direction] = numpy.where(asked, space[:,direction], -1)
+       sending = asked & space[:,direction]
+       arrays['sent'][nodes, direction] = sending
+       traffic = numpy.where(sending, inject(traffic-1, capacity, sink)[0], traffic)
+   arrays['judged'][nodes] = judged
+   levels[FLOWED, nodes] = traffic
+   levels[SOURCED, nodes] = inject(traffic, capacity, arrays['source'][nodes])[0]
+
+# the given nodes that, flowing out, found a neighbour with or without space when as things stand now it
+# should have been the other way, along with the space each of them should have found
+def misjudged(arrays, nodes):
+   space = haveSpace(arrays, nodes)
+   judged = arrays['judged'][nodes]
+   wrong = ((judged >= 0) & (judged != space)).any(axis=1)
+   return (nodes[wrong], space[wrong])
+
+# the second part: gather the traffic sent into the given nodes over their incoming links (see incomingLinks),
+# and let in as much of it (and of what was left waiting before) as there is space for
+def flowIn(arrays, nodes, inPtr, inLinks):
+   levels = arrays['levels']
+   arrived = numpy.concatenate(([0], numpy.cumsum(arrays['sent'].reshape(-1)[inLinks])))
+   waiting = arrays['pending'][nodes]+arrived[inPtr[1:]]-arrived[inPtr[:-1]]
+   levels[ARRIVED, nodes], injected = inject(levels[SOURCED, nodes], arrays['capacity'][nodes], waiting)
+   arrays['pending'][nodes] = waiting-injected